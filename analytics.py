@@ -0,0 +1,242 @@
+"""
+Отчёты для администратора.
+
+Запросы отчётов выполняются в отдельном процессе (ProcessPoolExecutor)
+на соединении только для чтения: в режиме WAL читатель не мешает
+очереди записи бота, а тяжёлая агрегация и форматирование
+не занимают ни event loop, ни GIL основного процесса.
+
+Готовый текст отчёта кэшируется на ttl секунд: повторные нажатия
+и одновременные запросы одного отчёта не запускают запрос заново.
+"""
+
+import asyncio
+import multiprocessing
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from html import escape
+
+from database import DB_NAME
+
+
+# Отчёты: заголовок и период (дней назад от сегодня)
+REPORTS = {
+    "overview": {
+        "title": "📊 Общая статистика",
+        "days": 30,
+    },
+    "cafes": {
+        "title": "📈 Активность по кафе",
+        "days": 7,
+    },
+    "top": {
+        "title": "🏆 Топ клиентов",
+        "days": 30,
+    },
+    "cashiers": {
+        "title": "🧾 Работа кассиров",
+        "days": 30,
+    },
+}
+
+TOP_LIMIT = 10
+
+
+# Соединение процесса-исполнителя (открывается один раз в initializer)
+_worker_conn = None
+
+
+def _init_worker(db_name):
+    global _worker_conn
+    _worker_conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+
+
+def _since(days):
+    return f"-{int(days)} days"
+
+
+def _report_overview(conn, days, cafes):
+    clients, points = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(points), 0) FROM clients").fetchone()
+    earned, spent, active = conn.execute("""
+        SELECT COALESCE(SUM(CASE WHEN delta > 0 THEN delta END), 0),
+               COALESCE(-SUM(CASE WHEN delta < 0 THEN delta END), 0),
+               COUNT(DISTINCT user_id)
+        FROM ledger
+        WHERE created_at >= datetime('now', ?) AND reason != 'opening'""",
+                                         (_since(days),)).fetchone()
+    return [
+        f"👥 Клиентов: <b>{clients}</b>",
+        f"💰 Баллов на счетах: <b>{points}</b>",
+        "",
+        f"За {days} дней:",
+        f"🙋 Активных клиентов: <b>{active}</b>",
+        f"➕ Начислено: <b>{earned}</b>",
+        f"➖ Списано: <b>{spent}</b>",
+    ]
+
+
+def _report_cafes(conn, days, cafes):
+    rows = conn.execute("""
+        SELECT cafe_id, date(created_at) AS day,
+               COALESCE(SUM(CASE WHEN delta > 0 THEN delta END), 0),
+               COALESCE(-SUM(CASE WHEN delta < 0 THEN delta END), 0),
+               COUNT(*)
+        FROM ledger
+        WHERE created_at >= date('now', ?) AND cafe_id IS NOT NULL
+        GROUP BY cafe_id, day
+        ORDER BY cafe_id, day""", (_since(days - 1),)).fetchall()
+    if not rows:
+        return ["Операций за период нет"]
+
+    lines = []
+    current_cafe = None
+    for cafe_id, day, earned, spent, operations in rows:
+        if cafe_id != current_cafe:
+            current_cafe = cafe_id
+            lines.append(f"\n☕ <b>{escape(cafes.get(cafe_id, f'Кафе #{cafe_id}'))}</b>")
+        lines.append(f"{day[8:10]}.{day[5:7]}: +{earned} / −{spent} ({operations} оп.)")
+    return lines
+
+
+def _report_top(conn, days, cafes):
+    rows = conn.execute("""
+        SELECT l.user_id, c.username, c.full_name, SUM(l.delta) AS earned, COUNT(*)
+        FROM ledger AS l
+        LEFT JOIN clients AS c ON c.user_id = l.user_id
+        WHERE l.created_at >= datetime('now', ?) AND l.reason = 'purchase'
+        GROUP BY l.user_id
+        ORDER BY earned DESC
+        LIMIT ?""", (_since(days), TOP_LIMIT)).fetchall()
+    if not rows:
+        return ["Начислений за период нет"]
+    lines = []
+    for place, (user_id, username, full_name, earned, purchases) in enumerate(rows, 1):
+        name = escape(full_name or (f"@{username}" if username else str(user_id)))
+        lines.append(f"{place}. {name} — {earned} баллов, {purchases} покупок")
+    return lines
+
+
+def _report_cashiers(conn, days, cafes):
+    rows = conn.execute("""
+        SELECT l.staff_id, s.full_name, s.cafe_id,
+               SUM(l.reason = 'purchase'), SUM(l.reason = 'spend')
+        FROM ledger AS l
+        LEFT JOIN staff AS s ON s.staff_id = l.staff_id
+        WHERE l.created_at >= datetime('now', ?) AND l.staff_id IS NOT NULL
+        GROUP BY l.staff_id
+        ORDER BY COUNT(*) DESC""", (_since(days),)).fetchall()
+    if not rows:
+        return ["Подтверждений за период нет"]
+    lines = []
+    for staff_id, full_name, cafe_id, purchases, spends in rows:
+        name = escape(full_name or str(staff_id))
+        cafe = escape(cafes.get(cafe_id, "—"))
+        lines.append(f"👤 {name} ({cafe}): начислений {purchases}, списаний {spends}")
+    return lines
+
+
+_RENDERERS = {
+    "overview": _report_overview,
+    "cafes": _report_cafes,
+    "top": _report_top,
+    "cashiers": _report_cashiers,
+}
+
+
+def render_report(conn, name, cafes):
+    """
+    Строит текст отчёта (HTML).
+
+    Args:
+        conn (sqlite3.Connection): Соединение с базой (только чтение)
+        name (str): Название отчёта (ключ REPORTS)
+        cafes (dict[int, str]): Названия кафе по ID
+
+    Returns:
+        str: Готовый текст отчёта
+    """
+    spec = REPORTS[name]
+    started = time.perf_counter()
+    lines = _RENDERERS[name](conn, spec["days"], cafes)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return (f"{spec['title']} <i>(за {spec['days']} дн.)</i>\n\n" + "\n".join(lines).strip("\n")
+            + f"\n\n<i>⏱ {elapsed_ms:.0f} мс</i>")
+
+
+def _run_report(name, cafes):
+    """Выполняется в процессе-исполнителе"""
+    return render_report(_worker_conn, name, cafes)
+
+
+class AnalyticsExecutor:
+    """
+    Выполняет отчёты в пуле процессов и кэширует результат на ttl секунд.
+
+    Пул создаётся при первом запросе (способ запуска spawn:
+    fork процесса с потоками и event loop небезопасен).
+    """
+
+    def __init__(self, max_workers=1, ttl=60.0, db_name=DB_NAME):
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.db_name = db_name
+        self._pool = None
+        self._cache = {}
+
+    async def report(self, name, cafes):
+        """
+        Возвращает текст отчёта — из кэша или посчитанный в пуле процессов.
+
+        Args:
+            name (str): Название отчёта (ключ REPORTS)
+            cafes (dict[int, str]): Названия кафе по ID
+
+        Returns:
+            str: Готовый текст отчёта (HTML)
+
+        Raises:
+            KeyError: Если такого отчёта нет
+        """
+        if name not in REPORTS:
+            raise KeyError(name)
+
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] > time.monotonic():
+            # Результат ещё свежий или уже считается — ждём тот же future
+            return await asyncio.shield(cached[1])
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_pool(), _run_report, name, cafes)
+        self._cache[name] = (time.monotonic() + self.ttl, future)
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            # Ошибку не кэшируем
+            if self._cache.get(name, (None, None))[1] is future:
+                del self._cache[name]
+            raise
+
+    def invalidate(self):
+        """Сбрасывает кэш отчётов"""
+        self._cache.clear()
+
+    def shutdown(self):
+        """Останавливает пул процессов"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.db_name,),
+            )
+        return self._pool
+
+
+analytics = AnalyticsExecutor()
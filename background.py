@@ -0,0 +1,70 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundTasks:
+    """
+    Реестр фоновых задач бота.
+
+    Хранит ссылки на все запущенные задачи, чтобы их не собрал сборщик мусора,
+    и позволяет дождаться их завершения при остановке бота,
+    чтобы ни одно начисление или уведомление не потерялось.
+    """
+
+    def __init__(self):
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def spawn(self, coro, name=None):
+        """
+        Запускает корутину как отслеживаемую фоновую задачу.
+
+        Args:
+            coro: Корутина, которую нужно выполнить
+            name (str): Имя задачи для логов (необязательно)
+
+        Returns:
+            asyncio.Task: Запущенная задача
+        """
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            logger.error("Фоновая задача %s завершилась с ошибкой: %r", task.get_name(), exc)
+
+    async def drain(self, timeout=10.0):
+        """
+        Дожидается завершения всех фоновых задач.
+
+        Задачи, не успевшие завершиться за `timeout` секунд, отменяются.
+
+        Args:
+            timeout (float): Максимальное время ожидания в секундах
+
+        Returns:
+            int: Количество отменённых задач
+        """
+        pending = set(self._tasks)
+        if not pending:
+            return 0
+        _, pending = await asyncio.wait(pending, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Отменено %d фоновых задач по таймауту", len(pending))
+        return len(pending)
+
+
+background_tasks = BackgroundTasks()
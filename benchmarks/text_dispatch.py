@@ -0,0 +1,107 @@
+"""
+Сравнение поиска обработчика текстового сообщения:
+- цепочка фильтров F.text == "..." (как было раньше)
+- цепочка фильтров ExactText (как проверяет aiogram без индекса)
+- индекс TextIndex (одно обращение к словарю)
+
+К реальным кнопкам бота добавляются синтетические, чтобы было видно,
+как время поиска зависит от количества кнопок.
+
+Запуск (из корня репозитория):
+    python benchmarks/text_dispatch.py [--extra 0 100 500] [--repeat 20000]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "42:benchmark")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from aiogram import Dispatcher, Router, F  # noqa: E402
+from aiogram.types import Chat, Message, User  # noqa: E402
+
+from filters import ExactText  # noqa: E402
+from middlewares.text_dispatch import TextIndex, _iter_handlers  # noqa: E402
+
+
+BUTTONS = [
+    "/start", "➕ Получить баллы", "💸 Потратить баллы", "💰 Мои баллы",
+    "Главное меню", "ℹ️ О программе", "/admin", "👥 Управление персоналом",
+    "📊 Статистика", "📢 Рассылка", "➕ Добавить кассира", "➖ Удалить кассира",
+    "📋 Список кассиров", "📥 Загрузить кассиров", "📤 Выгрузка", "◀️ Главное меню",
+]
+
+
+async def _noop():
+    return None
+
+
+def build_dispatcher(texts, exact):
+    router = Router()
+    for text in texts:
+        router.message(ExactText(text) if exact else F.text == text)(_noop)
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def resolve_by_chain(dp, message, raw_state):
+    for _, handler in _iter_handlers(dp):
+        result, _ = await handler.check(message, raw_state=raw_state)
+        if result:
+            return handler
+    return None
+
+
+def make_message(text):
+    return Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=Chat(id=1, type="private"),
+        from_user=User(id=1, is_bot=False, first_name="Bench"),
+        text=text,
+    )
+
+
+async def measure(texts, repeat):
+    # Худший для цепочки случай — последняя кнопка
+    message = make_message(texts[-1])
+    results = {}
+
+    for label, exact in (("F.text ==", False), ("ExactText", True)):
+        dp = build_dispatcher(texts, exact)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            await resolve_by_chain(dp, message, None)
+        results[label] = (time.perf_counter() - started) / repeat
+
+    index = TextIndex.build(build_dispatcher(texts, True))
+    started = time.perf_counter()
+    for _ in range(repeat):
+        index.lookup(None, message.text)
+    results["TextIndex"] = (time.perf_counter() - started) / repeat
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--extra", type=int, nargs="*", default=[0, 100, 500])
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'кнопок':>8} | {'F.text ==':>12} | {'ExactText':>12} | {'TextIndex':>12}")
+    for extra in args.extra:
+        texts = BUTTONS + [f"кнопка {i}" for i in range(extra)]
+        results = await measure(texts, args.repeat)
+        print(f"{len(texts):>8} | " + " | ".join(
+            f"{results[label] * 1e6:>9.2f} мкс" for label in ("F.text ==", "ExactText", "TextIndex")
+        ))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,377 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from html import escape
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from database import SAVE_DASHBOARD_SQL, SET_CAFE_MODE_SQL, PENDING_CODE_TTL_MINUTES
+from repository import (get_cafe_staff_ids, get_staff_by_cafes, get_pending_codes,
+                        get_cashier_dashboards, get_cafe_modes)
+from write_queue import write_queue
+from keyboards.callbacks import CodeKind
+from keyboards.staff_kb import get_queue_keyboard
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько кодов показывать в одном сообщении (у Telegram не больше 100 кнопок)
+MAX_VISIBLE_CODES = 20
+
+# Длина кода; если за CODE_ATTEMPTS попыток свободный код не нашёлся,
+# код удлиняется на цифру (но не длиннее MAX_CODE_LENGTH)
+CODE_LENGTH = 3
+CODE_ATTEMPTS = 20
+MAX_CODE_LENGTH = 8
+
+# Режимы работы с кодами в кафе
+PUSH = "push"
+PULL = "pull"
+CODE_MODES = {
+    PUSH: "коды приходят кассирам в закреплённое сообщение",
+    PULL: "кассир сам вводит код, который показывает клиент",
+}
+
+
+class CashierQueue:
+    """
+    Очередь невыкупленных кодов каждого кафе.
+
+    Вместо отдельного сообщения каждому кассиру на каждый код у кассира есть
+    одно закреплённое сообщение со всеми кодами его кафе и кнопками
+    подтверждения/отмены. Изменения очереди копятся debounce секунд
+    и применяются одним редактированием сообщения на кассира,
+    поэтому число запросов к Telegram зависит от времени, а не от числа кодов.
+
+    Результат действия кассира (подтверждено, отменено, код не найден)
+    показывается строкой в его же сообщении, а не новым сообщением.
+
+    В режиме PULL (загруженное кафе) сообщение кассира не перерисовывается
+    на каждый код: клиент показывает код, кассир вводит его сам,
+    а очередь служит только картой невыкупленных кодов для поиска.
+    Поэтому коды выдаёт сама очередь (new_code): невыкупленные коды
+    одного кафе не повторяются.
+    """
+
+    def __init__(self, debounce=1.0, sweep_interval=60.0, ttl_minutes=PENDING_CODE_TTL_MINUTES):
+        """
+        Args:
+            debounce (float): Сколько секунд копить изменения перед редактированием
+            sweep_interval (float): Как часто (сек) убирать просроченные коды
+            ttl_minutes (int): Сколько минут код остаётся в очереди
+        """
+        self.debounce = debounce
+        self.sweep_interval = sweep_interval
+        self.ttl = ttl_minutes * 60
+        self.edits = 0
+        self._bot = None
+        self._items = {}
+        self._codes = {}
+        self._dashboards = {}
+        self._staff_cafe = {}
+        self._status = {}
+        self._modes = {}
+        self._timers = {}
+        self._sweeper = None
+
+    def load(self):
+        """
+        Восстанавливает очереди и ID сообщений кассиров из базы (при старте бота)
+        """
+        self._items = {}
+        self._codes = {}
+        for item in get_pending_codes():
+            self._queue(item.cafe_id)[(item.kind, item.code_id)] = item
+            self._codes.setdefault(item.cafe_id, {})[item.code] = item.created_at
+        self._dashboards = get_cashier_dashboards()
+        self._modes = get_cafe_modes()
+        logger.info("Очередь кассиров: %d кодов, %d сообщений, режим ввода кода в %d кафе",
+                    sum(map(len, self._items.values())), len(self._dashboards),
+                    sum(mode == PULL for mode in self._modes.values()))
+
+    def pending(self, cafe_id):
+        """Коды очереди кафе в порядке выдачи"""
+        return list(self._items.get(cafe_id, {}).values())
+
+    def find(self, cafe_id, code):
+        """
+        Ищет невыкупленный код кафе по тексту кода (последний выданный)
+
+        Returns:
+            PendingCode or None: Код, или None, если его нет в очереди
+        """
+        for item in reversed(self._items.get(cafe_id, {}).values()):
+            if item.code == code:
+                return item
+        return None
+
+    def new_code(self, cafe_id, length=CODE_LENGTH):
+        """
+        Подбирает код, которого нет среди невыкупленных кодов кафе, и резервирует его.
+
+        Проверка и резервирование происходят без await, поэтому двум клиентам,
+        получающим коды одновременно, не достанется один код, даже пока
+        их записи ещё ждут в очереди записи. Резерв снимается, когда код
+        убран из очереди, или при уборке просроченных кодов.
+
+        Args:
+            cafe_id (int): ID кафе
+            length (int): Начальная длина кода
+
+        Returns:
+            str: Код
+
+        Raises:
+            RuntimeError: Если свободного кода нет даже длины MAX_CODE_LENGTH
+        """
+        taken = self._codes.setdefault(cafe_id, {})
+        for size in range(length, MAX_CODE_LENGTH + 1):
+            for _ in range(CODE_ATTEMPTS):
+                code = "".join(random.choices("0123456789", k=size))
+                if code not in taken:
+                    taken[code] = time.time()
+                    return code
+        raise RuntimeError(f"No free code for cafe {cafe_id}")
+
+    def mode(self, cafe_id):
+        """Режим работы с кодами в кафе (PUSH или PULL)"""
+        return self._modes.get(cafe_id, PUSH)
+
+    async def set_mode(self, cafe_id, mode):
+        """
+        Переключает режим работы с кодами в кафе и перерисовывает сообщения кассиров.
+
+        Args:
+            cafe_id (int): ID кафе
+            mode (str): PUSH или PULL
+
+        Raises:
+            ValueError: Если режим неизвестен
+        """
+        if mode not in CODE_MODES:
+            raise ValueError(f"Unknown code mode {mode!r}")
+        self._modes[cafe_id] = mode
+        await write_queue.execute(SET_CAFE_MODE_SQL, (cafe_id, mode))
+        self._touch(cafe_id)
+
+    def is_dashboard(self, staff_id, message_id):
+        """Является ли сообщение очередью этого кассира"""
+        return self._dashboards.get(staff_id) == message_id
+
+    def add(self, item):
+        """
+        Добавляет выданный код в очередь его кафе.
+
+        Args:
+            item (PendingCode): Код (см. repository.PendingCode)
+        """
+        if item.cafe_id is None:
+            return
+        self._queue(item.cafe_id)[(item.kind, item.code_id)] = item
+        self._codes.setdefault(item.cafe_id, {}).setdefault(item.code, item.created_at)
+        self._changed(item.cafe_id)
+
+    def remove(self, kind, code_id, code=None):
+        """
+        Убирает код из очереди (после подтверждения или отмены).
+        Для кнопок старого формата ID записи неизвестен — ищем по коду.
+
+        Args:
+            kind (CodeKind): Тип кода
+            code_id (int): ID записи кода (0, если неизвестен)
+            code (str): Сам код
+        """
+        kind = CodeKind(kind).value
+        for cafe_id, queue in self._items.items():
+            if code_id:
+                found = queue.pop((kind, code_id), None)
+            else:
+                key = next((key for key, item in queue.items()
+                            if key[0] == kind and item.code == code), None)
+                found = queue.pop(key) if key else None
+            if found is not None:
+                self._codes.get(cafe_id, {}).pop(found.code, None)
+                self._changed(cafe_id)
+                return
+
+    def set_status(self, staff_id, text):
+        """
+        Показывает кассиру результат его действия строкой в его сообщении-очереди
+        """
+        self._status[staff_id] = (text, time.time())
+        cafe_id = self._staff_cafe.get(staff_id)
+        if cafe_id is not None:
+            self._touch(cafe_id)
+
+    def start(self, bot: Bot):
+        """
+        Запускает периодическую уборку просроченных кодов
+        """
+        self._bot = bot
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name="cashier-queue-sweep")
+
+    async def stop(self):
+        """
+        Останавливает уборку и сразу применяет накопленные изменения
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        timers, self._timers = self._timers, {}
+        for timer in timers.values():
+            timer.cancel()
+        # Кассиры всех кафе с изменениями — одним запросом
+        for cafe_id, staff in get_staff_by_cafes(timers).items():
+            await self.flush(cafe_id, [member.staff_id for member in staff])
+
+    async def flush(self, cafe_id, staff_ids=None):
+        """
+        Перерисовывает сообщения-очереди всех кассиров кафе.
+        Кассиру без сообщения (или если сообщение удалено) отправляется
+        новое сообщение и закрепляется.
+
+        Args:
+            cafe_id (int): ID кафе
+            staff_ids (list[int]): Кассиры кафе, если уже известны (иначе читаются из базы)
+        """
+        if self._bot is None:
+            return
+        items = self.pending(cafe_id)
+        if self.mode(cafe_id) == PULL:
+            text, keyboard = render_pull_notice(), None
+        else:
+            text = render_queue(items)
+            keyboard = get_queue_keyboard(items[:MAX_VISIBLE_CODES])
+
+        if staff_ids is None:
+            staff_ids = get_cafe_staff_ids(cafe_id)
+        for staff_id in staff_ids:
+            self._staff_cafe[staff_id] = cafe_id
+            status = self._status.get(staff_id)
+            staff_text = text + (f"\n\n<i>{escape(status[0])}</i>" if status else "")
+            try:
+                await self._show(staff_id, staff_text, keyboard)
+            except TelegramForbiddenError:
+                logger.warning("Кассир %s заблокировал бота", staff_id)
+            except TelegramRetryAfter as e:
+                # Следующее редактирование всё равно покажет актуальную очередь
+                logger.warning("Очередь кассиров: лимит Telegram, ждём %s с", e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                self._touch(cafe_id)
+                return
+            except Exception as e:
+                logger.error("Ошибка обновления очереди кассира %s: %r", staff_id, e)
+
+    async def _show(self, staff_id, text, keyboard):
+        message_id = self._dashboards.get(staff_id)
+        if message_id is not None:
+            try:
+                await self._bot.edit_message_text(text, chat_id=staff_id, message_id=message_id,
+                                                  reply_markup=keyboard)
+                self.edits += 1
+                return
+            except TelegramBadRequest as e:
+                if "not modified" in str(e):
+                    return
+                # Сообщение удалено или слишком старое — отправляем новое
+
+        message = await self._bot.send_message(staff_id, text, reply_markup=keyboard)
+        self.edits += 1
+        self._dashboards[staff_id] = message.message_id
+        await write_queue.execute(SAVE_DASHBOARD_SQL, (staff_id, message.message_id))
+        try:
+            await self._bot.pin_chat_message(staff_id, message.message_id, disable_notification=True)
+        except TelegramBadRequest as e:
+            logger.debug("Не удалось закрепить очередь у кассира %s: %r", staff_id, e)
+
+    def _queue(self, cafe_id):
+        return self._items.setdefault(cafe_id, {})
+
+    def _changed(self, cafe_id):
+        """Очередь кафе изменилась: в режиме PULL кассирам ничего не отправляется"""
+        if self.mode(cafe_id) == PUSH:
+            self._touch(cafe_id)
+
+    def _touch(self, cafe_id):
+        """Помечает очередь кафе изменившейся; перерисовка — не чаще раза в debounce секунд"""
+        if cafe_id not in self._timers:
+            self._timers[cafe_id] = asyncio.create_task(self._flush_later(cafe_id),
+                                                        name=f"cashier-queue-{cafe_id}")
+
+    async def _flush_later(self, cafe_id):
+        await asyncio.sleep(self.debounce)
+        # Изменения, пришедшие во время перерисовки, запустят новый таймер
+        self._timers.pop(cafe_id, None)
+        await self.flush(cafe_id)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            expire_before = time.time() - self.ttl
+            for cafe_id, queue in self._items.items():
+                expired = [key for key, item in queue.items() if item.created_at < expire_before]
+                for key in expired:
+                    del queue[key]
+                if expired:
+                    self._changed(cafe_id)
+            # Резерв кода снимается вместе с просроченным кодом (или кодом,
+            # который так и не попал в очередь)
+            for cafe_id, codes in self._codes.items():
+                for code in [code for code, issued in codes.items() if issued < expire_before]:
+                    del codes[code]
+            # Строка результата живёт до следующей уборки
+            self._status = {staff_id: status for staff_id, status in self._status.items()
+                            if status[1] >= time.time() - self.sweep_interval}
+
+
+def render_pull_notice():
+    """
+    Текст сообщения кассира в режиме PULL (HTML)
+
+    Returns:
+        str: Текст сообщения
+    """
+    return ("⌨️ <b>Режим ввода кода</b>\n\n"
+            "Клиент показывает код — пришлите его сообщением:\n"
+            "<code>123</code> — списание или выбор баллов кнопкой\n"
+            "<code>123 14</code> — начислить 14 баллов\n\n"
+            "Вернуть очередь кодов: <code>/mode push</code>")
+
+
+def render_queue(items):
+    """
+    Текст сообщения-очереди (HTML)
+
+    Args:
+        items (list[PendingCode]): Коды очереди
+
+    Returns:
+        str: Текст сообщения
+    """
+    lines = [f"📋 <b>Очередь кодов</b> · {datetime.now():%H:%M:%S}"]
+    if not items:
+        lines.append("\nНевыкупленных кодов нет ☕️")
+        return "\n".join(lines)
+
+    lines.append("")
+    for item in items[:MAX_VISIBLE_CODES]:
+        name = escape(item.client_name or str(item.user_id))
+        if item.kind == CodeKind.purchase.value:
+            lines.append(f"🟢 <code>{item.code}</code> — начисление · {name}")
+        else:
+            what = escape(item.label) if item.label else "списание"
+            lines.append(f"💸 <code>{item.code}</code> — {what} ({item.amount} б.) · {name}")
+    if len(items) > MAX_VISIBLE_CODES:
+        lines.append(f"\n… и ещё {len(items) - MAX_VISIBLE_CODES}")
+    return "\n".join(lines)
+
+
+cashier_queue = CashierQueue()
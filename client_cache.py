@@ -0,0 +1,112 @@
+import asyncio
+from collections import OrderedDict
+
+from repository import get_client, get_clients
+
+
+class ClientCache:
+    """
+    Ограниченный LRU-кэш профилей клиентов.
+
+    При промахе профиль читается из базы (read-through).
+    Обработчики кассира после изменения баланса сразу передают в кэш
+    новое значение вместе с версией строки (write-through);
+    значение с меньшей версией кэш игнорирует, поэтому запоздавшая запись
+    не может затереть более свежую.
+
+    Кэш используется только для показа баланса и предварительной проверки.
+    Само списание всегда выполняется условным UPDATE ... WHERE points >= ?,
+    поэтому устаревший кэш не может одобрить списание больше баланса.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._profiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def get(self, user_id):
+        """
+        Возвращает профиль клиента из кэша или из базы.
+
+        Args:
+            user_id (int): Telegram ID клиента
+
+        Returns:
+            Client or None: Профиль, или None, если клиент не найден
+        """
+        profile = self._profiles.get(user_id)
+        if profile is not None:
+            self._profiles.move_to_end(user_id)
+            self.hits += 1
+            return profile
+
+        self.misses += 1
+        profile = get_client(user_id)
+        if profile is None:
+            return None
+        self._put(profile)
+        return profile
+
+    def apply_balance(self, user_id, points, version):
+        """
+        Записывает в кэш новый баланс клиента сразу после изменения в базе.
+
+        Args:
+            user_id (int): Telegram ID клиента
+            points (int): Баланс после изменения (из RETURNING)
+            version (int): Версия строки после изменения (из RETURNING)
+        """
+        profile = self._profiles.get(user_id)
+        if profile is not None and version > profile.version:
+            profile.points = points
+            profile.version = version
+
+    def apply_names(self, user_id, username, full_name):
+        """
+        Обновляет имя клиента в кэше, не дожидаясь записи в базу
+        (имена пишутся пакетами, см. KnownUsers.flush)
+        """
+        profile = self._profiles.get(user_id)
+        if profile is not None:
+            profile.username = username
+            profile.full_name = full_name
+
+    def invalidate(self, user_id):
+        """Удаляет профиль из кэша (следующее чтение пойдёт в базу)"""
+        self._profiles.pop(user_id, None)
+
+    def clear(self):
+        """Очищает кэш целиком"""
+        self._profiles.clear()
+
+    async def refresh(self):
+        """
+        Перечитывает из базы все профили в кэше пакетными запросами
+        (после массового импорта): активные клиенты остаются в кэше
+        с новыми балансами, а не читаются из базы поодиночке при промахах.
+
+        Профиль, изменённый кассиром за время чтения (большая версия), не затирается.
+        """
+        user_ids = list(self._profiles)
+        fresh = await asyncio.to_thread(get_clients, user_ids)
+        for user_id in user_ids:
+            current = self._profiles.get(user_id)
+            if current is None:
+                continue
+            profile = fresh.get(user_id)
+            if profile is None:
+                del self._profiles[user_id]
+            elif profile.version >= current.version:
+                self._profiles[user_id] = profile
+
+    def _put(self, profile):
+        self._profiles[profile.user_id] = profile
+        if len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+
+
+client_cache = ClientCache()
@@ -27,3 +27,33 @@ CAFES = {
         "address": "пл. Вокзальная, 5"
     }
 }
+
+
+# Ключ подписи токенов QR-кодов (tokens.py); если не задан — выводится из BOT_TOKEN,
+# и смена токена бота делает недействительными все выданные QR-коды
+TOKEN_SECRET = os.getenv("TOKEN_SECRET")
+
+# Адрес Bot API (локальный telegram-bot-api или loadtest/fake_bot_api.py); по умолчанию — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Запись входящих апдейтов для воспроизведения (middlewares/capture.py): папка записи
+# и ключ псевдонимизации ID (без ключа — случайный, тогда ID в базе при воспроизведении не сопоставить)
+CAPTURE_DIR = os.getenv("CAPTURE_DIR")
+CAPTURE_KEY = os.getenv("CAPTURE_KEY")
+
+# Логирование (logging_setup.py): уровень, файл (необязательно) и формат — json или text
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = os.getenv("LOG_FILE")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+# Трассировка обработки апдейтов (tracing.py): файл трасс в формате OTLP JSON и доля трассируемых апдейтов
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "1"))
+
+# Сколько секунд остановка бота ждёт обработчики апдейтов и фоновые задачи (lifecycle.py)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+
+# Планировщик апдейтов (middlewares/scheduler.py): сколько обработчиков выполняются одновременно
+# и сколько полученных апдейтов может ждать обработки (дальше опрос Telegram приостанавливается)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "2000"))
@@ -1,5 +1,84 @@
 import sqlite3
 
+from tracing import tracer
+
+
+# Файл базы данных (им же пользуются обслуживание и резервные копии)
+DB_NAME = "cafe.db"
+
+# Запросы, которые также выполняются пакетно через очередь записи (write_queue)
+ADD_CLIENT_SQL = """
+    INSERT OR IGNORE INTO clients (user_id, username, full_name)
+    VALUES(?, ?, ?)"""
+
+SAVE_PURCHASE_CODE_SQL = """
+    INSERT INTO purchase_codes (user_id, cafe_id, code, created_at)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP)"""
+
+SAVE_SPEND_CODE_SQL = """
+    INSERT INTO spend_codes (user_id, code, cost, cafe_id, created_at)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)"""
+
+ADD_LEDGER_SQL = """
+    INSERT INTO ledger (user_id, cafe_id, staff_id, delta, reason, code)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+
+# Сколько минут невыкупленный код можно выдавать клиенту повторно
+PENDING_CODE_TTL_MINUTES = 30
+
+UPDATE_CLIENT_NAMES_SQL = "UPDATE clients SET username = ?, full_name = ? WHERE user_id = ?"
+
+SAVE_DASHBOARD_SQL = """
+    INSERT INTO cashier_dashboards (staff_id, message_id) VALUES (?, ?)
+    ON CONFLICT(staff_id) DO UPDATE SET message_id = excluded.message_id"""
+
+SET_CAFE_MODE_SQL = """
+    INSERT INTO cafe_settings (cafe_id, code_mode, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(cafe_id) DO UPDATE SET code_mode = excluded.code_mode,
+                                       updated_at = excluded.updated_at"""
+
+SET_BOT_STATE_SQL = """
+    INSERT INTO bot_state (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at"""
+
+DELETE_BOT_STATE_SQL = """
+    DELETE FROM bot_state WHERE key = ?"""
+
+
+class TracedCursor(sqlite3.Cursor):
+    """
+    Курсор, который пишет каждый запрос span-ом текущей трассы (см. tracing.py).
+    Вне трассы (фоновые задачи, поток очереди записи) — обычный курсор.
+    """
+
+    def execute(self, sql, parameters=()):
+        with tracer.span(_span_name(sql), **{"db.system": "sqlite", "db.statement": sql}):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with tracer.span(_span_name(sql), **{"db.system": "sqlite", "db.statement": sql}):
+            return super().executemany(sql, seq_of_parameters)
+
+
+class TracedConnection(sqlite3.Connection):
+    """
+    Соединение, все запросы которого идут через TracedCursor
+    (Connection.execute в sqlite3 не вызывает Cursor.execute, поэтому переопределён)
+    """
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _span_name(sql):
+    return "db " + sql.lstrip().split(None, 1)[0].upper()
+
 
 def connect():
     """
@@ -11,7 +90,7 @@ def connect():
     Returns:
         sqlite3.Connection: Активное соединение с базой данных          
     """
-    conn = sqlite3.connect('cafe.db')
+    conn = sqlite3.connect(DB_NAME, factory=TracedConnection)
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
@@ -25,14 +104,32 @@ def init_db():
     - staff — список кассиров
     - purchase_codes — коды для начисления баллов
     - spend_codes — коды для списания баллов
+    - ledger — журнал всех изменений баланса
+    - client_segments — RFM-сегменты клиентов для рассылок
+    - cashier_dashboards — сообщения-очереди кодов у кассиров
+    - cafe_settings — режим работы с кодами в каждом кафе (push/pull)
+    - bot_state — служебное состояние бота (offset апдейтов при перезапуске)
+
+    Добавляет недостающие колонки в таблицы, созданные старыми версиями бота.
 
     Также создаёт индексы для ускорения поиска:
     - idx_spend_codes_user_id
     - idx_purchase_codes_user_id
+    - idx_purchase_codes_pending, idx_spend_codes_pending
+    - idx_ledger_created_at, idx_ledger_user_id
+    - idx_client_segments_segment
     """
     with connect() as conn:
         cur = conn.cursor()
 
+        # Для новой базы: свободные страницы можно возвращать по частям
+        # (PRAGMA incremental_vacuum, см. maintenance.py). Для уже созданной
+        # базы это не действует — её один раз переводит `maintenance.py enable-auto-vacuum`
+        cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+        # WAL позволяет читать базу, пока очередь записи коммитит пакет
+        cur.execute("PRAGMA journal_mode=WAL")
+
         # 1. Таблица клиентов
         cur.execute("""
             CREATE TABLE IF NOT EXISTS clients(
@@ -40,7 +137,8 @@ def init_db():
                 username TEXT,
                 full_name TEXT,
                 points INTEGER DEFAULT 0,
-                total_purchases INTEGER DEFAULT 0
+                total_purchases INTEGER DEFAULT 0,
+                version INTEGER DEFAULT 0
             )""")
 
         # 2. Таблица сотрудников (кассиров)
@@ -62,6 +160,7 @@ def init_db():
                 cafe_id INTEGER NOT NULL,
                 code TEXT NOT NULL,
                 used BOOLEAN DEFAULT 0,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(user_id) REFERENCES clients(user_id)
             )
         """)
@@ -74,89 +173,95 @@ def init_db():
                 code TEXT NOT NULL,
                 cost INTEGER NOT NULL,
                 used BOOLEAN DEFAULT 0,
+                cafe_id INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(user_id) REFERENCES clients(user_id)
             )""")
 
-        # Теперь можно добавлять индексы
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_spend_codes_user_id ON spend_codes(user_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_purchase_codes_user_id ON purchase_codes(user_id)")
-
-        conn.commit()
-
-
-def save_purchase_code(user_id, cafe_id, code):
-    """
-    Сохраняет запись о начислении баллов для клиента.
-
-    Args:
-        user_id (int): Telegram ID клиента
-        cafe_id (int): ID кафе, где был получен код
-        code (str): Уникальный код для начисления баллов
-    """
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO purchase_codes (user_id, cafe_id, code) VALUES (?, ?, ?)",
-                     (user_id, cafe_id, code))
-        conn.commit()
-
+        # 5. Журнал изменений баланса (начисления, списания, начальные остатки)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                cafe_id INTEGER,
+                staff_id INTEGER,
+                delta INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                code TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )""")
 
-def add_client(user_id, username, full_name):
-    """
-    Добавляет нового клиента в базу данных, если он ещё не зарегистрирован.
+        # 6. Сегменты клиентов (RFM), пересчитываются целиком, см. segmentation.py
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS client_segments (
+                user_id INTEGER PRIMARY KEY,
+                segment TEXT NOT NULL,
+                recency INTEGER NOT NULL,
+                frequency INTEGER NOT NULL,
+                monetary INTEGER NOT NULL,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )""")
 
-    Args:
-        user_id (int): Telegram ID клиента
-        username (str): Никнейм клиента (может быть пустым)
-        full_name (str): Полное имя клиента
+        # 7. Закреплённые сообщения-очереди кассиров (см. cashier_queue.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS cashier_dashboards (
+                staff_id INTEGER PRIMARY KEY,
+                message_id INTEGER NOT NULL
+            )""")
 
-    Returns:
-        None: Запись добавляется в таблицу 'clients' или игнорируется,
-              если клиент уже существует
-    """
-    with connect() as conn:
-        cur = conn.cursor()
+        # 8. Настройки кафе: режим работы с кодами (см. cashier_queue.CODE_MODES)
         cur.execute("""
-            INSERT OR IGNORE INTO clients (user_id, username, full_name)
-            VALUES(?, ?, ?)""", (user_id, username, full_name))
-        conn.commit()
+            CREATE TABLE IF NOT EXISTS cafe_settings (
+                cafe_id INTEGER PRIMARY KEY,
+                code_mode TEXT NOT NULL DEFAULT 'push',
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )""")
 
+        # 9. Служебное состояние бота (ключ — значение)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS bot_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )""")
 
-def get_client(user_id):
-    """
-    Получает данные клиента из таблицы 'clients' по Telegram ID
+        # Миграция таблиц, созданных до появления этих колонок
+        add_column_if_missing(cur, "clients", "version", "INTEGER DEFAULT 0")
+        add_column_if_missing(cur, "purchase_codes", "created_at", "TEXT")
+        add_column_if_missing(cur, "spend_codes", "cafe_id", "INTEGER")
+        add_column_if_missing(cur, "spend_codes", "created_at", "TEXT")
 
-    Args:
-        user_id (int): Telegram ID клиента
+        # Теперь можно добавлять индексы
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_spend_codes_user_id ON spend_codes(user_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_purchase_codes_user_id ON purchase_codes(user_id)")
+        cur.execute("""CREATE INDEX IF NOT EXISTS idx_purchase_codes_pending
+                       ON purchase_codes(user_id, cafe_id, used)""")
+        cur.execute("""CREATE INDEX IF NOT EXISTS idx_spend_codes_pending
+                       ON spend_codes(user_id, cafe_id, used)""")
+        # Поиск кода, который ввёл кассир, и проверка уникальности нового кода
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_purchase_codes_code ON purchase_codes(code, used)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_spend_codes_code ON spend_codes(code, used)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_created_at ON ledger(created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_id ON ledger(user_id)")
+        # user_id — rowid таблицы, поэтому индекс покрывает выборку получателей рассылки
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_client_segments_segment ON client_segments(segment)")
 
-    Returns:
-        tuple or None: Данные клиента (user_id, username, full_name, points, total_purchases),
-                       или None, если клиент не найден
-    """
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-        SELECT * FROM clients WHERE user_id = ?""", (user_id,))
-        result = cur.fetchone()
-        return result
+        conn.commit()
 
 
-def update_points(user_id, points_change):
+def add_column_if_missing(cur, table, column, declaration):
     """
-    Начисляет баллы клиенту в таблице 'clients'
+    Добавляет колонку в существующую таблицу, если её там ещё нет.
 
     Args:
-        user_id (int): Telegram ID клиента
-        points_change (int): Количество баллов для добавления
-
-    Returns:
-        None: Баллы обновляются в базе данных.
+        cur (sqlite3.Cursor): Курсор открытого соединения
+        table (str): Имя таблицы
+        column (str): Имя колонки
+        declaration (str): Тип и ограничения колонки (например, "INTEGER")
     """
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            UPDATE clients SET points = points + ? WHERE user_id = ?""",
-                    (points_change, user_id))
-        conn.commit()
+    columns = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
 
 
 def add_staff(staff_id, cafe_id, cafe_name, username, full_name):
@@ -182,43 +287,29 @@ def add_staff(staff_id, cafe_id, cafe_name, username, full_name):
         conn.commit()
 
 
-def get_staff_by_id(staff_id):
+def upsert_staff_many(staff_rows):
     """
-    Получает данные кассира из таблицы 'staff' по его Telegram ID
+    Добавляет или обновляет сразу много кассиров одной транзакцией.
 
     Args:
-        staff_id (int): Telegram ID кассира
+        staff_rows (list[tuple]): Записи (staff_id, cafe_id, cafe_name, username, full_name)
 
     Returns:
-        tuple or None: Информация о кассире (staff_id, cafe_id, cafe_name, username, full_name),
-                       или None, если кассир не найден
+        int: Количество добавленных или обновлённых кассиров
     """
     with connect() as conn:
         cur = conn.cursor()
-        cur.execute("""
-        SELECT * FROM staff WHERE staff_id = ?""", (staff_id,))
-        result = cur.fetchone()
-        return result
-
-
-def get_staff_by_cafe(cafe_id):
-    """
-    Получает список кассиров, работающих в указанном кафе.
-
-    Args:
-        cafe_id (int): ID кафе, для которого нужно получить список кассиров
-
-    Returns:
-        list[tuple] or list: Список записей кассиров 
-                (staff_id, cafe_id, cafe_name, username, full_name)
-                             Если кассиров нет — возвращается пустой список.
-    """
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-        SELECT * FROM staff WHERE cafe_id = ?""", (cafe_id,))
-        result = cur.fetchall()
-        return result
+        cur.executemany("""
+            INSERT INTO staff (staff_id, cafe_id, cafe_name, username, full_name)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(staff_id) DO UPDATE SET
+                cafe_id = excluded.cafe_id,
+                cafe_name = excluded.cafe_name,
+                username = excluded.username,
+                full_name = excluded.full_name
+        """, staff_rows)
+        conn.commit()
+        return len(staff_rows)
 
 
 def remove_staff(staff_id):
@@ -239,89 +330,21 @@ def remove_staff(staff_id):
         conn.commit()
 
 
-def save_spend_code(user_id, code, cost):
-    """
-    Сохраняет запись о списании баллов в таблицу 'spend_codes'.
-
-    Args:
-        user_id (int): Telegram ID клиента
-        code (str): Уникальный код для списания баллов
-        cost (int): Количество баллов, которые будут списаны
-
-    Returns:
-        None: Данные добавляются в таблицу 'spend_codes'
-    """
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO spend_codes (user_id, code, cost) VALUES (?, ?, ?)", 
-                    (user_id, code, cost))
-        conn.commit()
-
-
-def get_purchase_code(code):
-    """
-    Получает запись о начислении баллов по уникальному коду из таблицы 'purchase_codes'.
-
-    Args:
-        code (str): Уникальный код, по которому ищется запись
-
-    Returns:
-        tuple or None: Возвращает кортеж вида (id, user_id, cafe_id, code, used),
-                       если запись найдена, иначе None
-    """
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM purchase_codes WHERE code = ?", (code,))
-        return cur.fetchone()
-
-
-def get_spend_code(code):
+def iter_client_names(batch_size=1000):
     """
-    Получает запись о списании баллов по уникальному коду из таблицы 'spend_codes'
+    Построчно отдаёт имена всех клиентов, не загружая таблицу в память целиком.
 
     Args:
-        code (str): Уникальный код, по которому ищется запись
-
-    Returns:
-        tuple or None: Возвращает кортеж вида (id, user_id, code, cost, used),
-                       если запись найдена, иначе None
-    """
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM spend_codes WHERE code = ?", (code,))
-        return cur.fetchone()
+        batch_size (int): Сколько строк читать из курсора за один раз
 
-
-def deduct_points(user_id, cost):
-    """
-    Списывает указанное количество баллов у клиента из таблицы 'clients'.
-
-    Args:
-        user_id (int): Telegram ID клиента
-        cost (int): Количество баллов, которые нужно списать
-
-    Returns:
-        None: Обновляет значение поля `points` в базе данных
-    """
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("UPDATE clients SET points = points - ? WHERE user_id = ?",
-                    (cost, user_id))
-        conn.commit()
-
-
-def code_exists_in_db(code):
-    """
-    Проверяет, существует ли указанный код в таблице 'purchase_codes'.
-
-    Args:
-        code (str): Код, который нужно проверить на наличие в базе данных
-
-    Returns:
-        bool: True, если код найден в таблице, иначе False
+    Yields:
+        tuple: (user_id, username, full_name)
     """
     with connect() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT 1 FROM purchase_codes WHERE code = ? OR code = ? LIMIT 1",
-                     (code, code))
-        return cur.fetchone() is not None
+        cur.execute("SELECT user_id, username, full_name FROM clients")
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
@@ -0,0 +1,185 @@
+import csv
+import gzip
+import json
+import os
+import tempfile
+from datetime import date
+
+from database import connect
+
+
+# Что можно выгрузить: запрос, колонки и поддерживаемые фильтры
+EXPORTS = {
+    "clients": {
+        "sql": "SELECT user_id, username, full_name, points, total_purchases FROM clients",
+        "columns": ("user_id", "username", "full_name", "points", "total_purchases"),
+        "date_column": None,
+        "cafe_column": None,
+    },
+    "purchases": {
+        "sql": "SELECT id, user_id, cafe_id, code, used, created_at FROM purchase_codes",
+        "columns": ("id", "user_id", "cafe_id", "code", "used", "created_at"),
+        "date_column": "created_at",
+        "cafe_column": "cafe_id",
+    },
+    "spends": {
+        "sql": "SELECT id, user_id, cafe_id, code, cost, used, created_at FROM spend_codes",
+        "columns": ("id", "user_id", "cafe_id", "code", "cost", "used", "created_at"),
+        "date_column": "created_at",
+        "cafe_column": "cafe_id",
+    },
+    "ledger": {
+        "sql": "SELECT id, user_id, cafe_id, staff_id, delta, reason, code, created_at FROM ledger",
+        "columns": ("id", "user_id", "cafe_id", "staff_id", "delta", "reason", "code", "created_at"),
+        "date_column": "created_at",
+        "cafe_column": "cafe_id",
+    },
+}
+
+FORMATS = ("csv", "jsonl")
+
+
+class ExportError(ValueError):
+    """Некорректные параметры выгрузки (показываются администратору как есть)"""
+
+
+def build_query(kind, date_from=None, date_to=None, cafe_id=None):
+    """
+    Собирает SQL-запрос выгрузки с фильтрами.
+
+    Args:
+        kind (str): Что выгружаем (ключ EXPORTS)
+        date_from (date): Начало периода включительно (необязательно)
+        date_to (date): Конец периода включительно (необязательно)
+        cafe_id (int): ID кафе (необязательно)
+
+    Returns:
+        tuple: (sql, params)
+    """
+    spec = EXPORTS.get(kind)
+    if spec is None:
+        raise ExportError(f"Неизвестный тип выгрузки: {kind}. Доступно: {', '.join(EXPORTS)}")
+
+    where, params = [], []
+    if date_from or date_to:
+        if not spec["date_column"]:
+            raise ExportError(f"Выгрузку {kind} нельзя фильтровать по дате")
+        if date_from:
+            where.append(f"{spec['date_column']} >= ?")
+            params.append(date_from.isoformat())
+        if date_to:
+            where.append(f"{spec['date_column']} < date(?, '+1 day')")
+            params.append(date_to.isoformat())
+    if cafe_id is not None:
+        if not spec["cafe_column"]:
+            raise ExportError(f"Выгрузку {kind} нельзя фильтровать по кафе")
+        where.append(f"{spec['cafe_column']} = ?")
+        params.append(cafe_id)
+
+    sql = spec["sql"]
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql, params
+
+
+def iter_rows(sql, params=(), batch_size=1000):
+    """
+    Построчно отдаёт результат запроса, читая курсор порциями через fetchmany.
+    Память не зависит от размера таблицы.
+
+    Yields:
+        tuple: Очередная строка результата
+    """
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+
+def write_export(kind, fmt="csv", date_from=None, date_to=None, cafe_id=None):
+    """
+    Выгружает данные во временный файл (CSV или JSONL, сжатый gzip).
+
+    Функция блокирующая — из обработчиков её нужно вызывать
+    через asyncio.to_thread, чтобы не останавливать цикл событий.
+
+    Args:
+        kind (str): Что выгружаем: clients, purchases, spends, ledger
+        fmt (str): Формат файла: csv или jsonl
+        date_from (date): Начало периода (необязательно)
+        date_to (date): Конец периода (необязательно)
+        cafe_id (int): ID кафе (необязательно)
+
+    Returns:
+        tuple: (путь к файлу, количество строк)
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"Неизвестный формат: {fmt}. Доступно: {', '.join(FORMATS)}")
+
+    sql, params = build_query(kind, date_from, date_to, cafe_id)
+    columns = EXPORTS[kind]["columns"]
+    suffix = ".csv" if fmt == "csv" else ".jsonl.gz"
+    fd, path = tempfile.mkstemp(prefix=f"export_{kind}_", suffix=suffix)
+    os.close(fd)
+
+    count = 0
+    try:
+        if fmt == "csv":
+            # utf-8-sig, чтобы Excel правильно открыл кириллицу
+            with open(path, "w", newline="", encoding="utf-8-sig") as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                for row in iter_rows(sql, params):
+                    writer.writerow(row)
+                    count += 1
+        else:
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                for row in iter_rows(sql, params):
+                    f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                    f.write("\n")
+                    count += 1
+    except Exception:
+        os.unlink(path)
+        raise
+    return path, count
+
+
+def parse_export_args(args):
+    """
+    Разбирает аргументы команды /export.
+
+    Пример: `/export ledger jsonl from=2025-01-01 to=2025-01-31 cafe=2`
+
+    Args:
+        args (list[str]): Аргументы команды после /export
+
+    Returns:
+        dict: Параметры для write_export
+    """
+    if not args:
+        raise ExportError("Укажите, что выгрузить: " + ", ".join(EXPORTS))
+
+    params = {"kind": args[0], "fmt": "csv"}
+    for arg in args[1:]:
+        if arg in FORMATS:
+            params["fmt"] = arg
+            continue
+        key, sep, value = arg.partition("=")
+        try:
+            if key == "from" and sep:
+                params["date_from"] = date.fromisoformat(value)
+            elif key == "to" and sep:
+                params["date_to"] = date.fromisoformat(value)
+            elif key == "cafe" and sep:
+                params["cafe_id"] = int(value)
+            else:
+                raise ExportError(f"Непонятный параметр: {arg}")
+        except ValueError as e:
+            if isinstance(e, ExportError):
+                raise
+            raise ExportError(f"Некорректное значение: {arg}")
+    return params
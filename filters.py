@@ -0,0 +1,25 @@
+from aiogram.filters import Filter
+from aiogram.types import Message
+
+
+class ExactText(Filter):
+    """
+    Фильтр точного совпадения текста сообщения (кнопки reply-клавиатуры или команды).
+
+    Работает как обычный фильтр aiogram, но его тексты известны заранее,
+    поэтому TextDispatchMiddleware может построить по ним хеш-таблицу
+    и находить обработчик одним обращением к словарю.
+    """
+
+    __slots__ = ("texts",)
+
+    def __init__(self, *texts: str):
+        if not texts:
+            raise ValueError("At least one text is required")
+        self.texts = frozenset(texts)
+
+    def __str__(self):
+        return self._signature_to_string(*sorted(self.texts))
+
+    async def __call__(self, message: Message) -> bool:
+        return message.text in self.texts
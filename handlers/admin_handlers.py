@@ -1,11 +1,39 @@
-from aiogram import Router, F
-from aiogram.types import Message
+import asyncio
+import os
+import tempfile
+from html import escape
+
+from aiogram import Router, F, Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery, FSInputFile, BufferedInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 from utils import get_user_role
-from keyboards.admin_kb import get_staff_main_menu, get_staff_management_menu
-from database import add_staff, remove_staff, get_staff_by_cafe
+from filters import ExactText
+from keyboards.admin_kb import (
+    get_staff_main_menu,
+    get_staff_management_menu,
+    get_staff_list_keyboard,
+    get_stats_keyboard,
+    get_mailing_keyboard,
+    get_mailing_cancel_keyboard
+)
+from database import add_staff, remove_staff, upsert_staff_many
+from repository import get_staff_page, get_segment_counts
+from exporter import write_export, parse_export_args, ExportError
+from importer import import_csv, read_staff_csv
+from config import CAFES
+from known_users import known_users
+from client_cache import client_cache
+from maintenance import maintenance
+from logging_setup import log_pipeline
+from profiling import profiler, format_result, ProfilerBusyError, MIN_WINDOW, MAX_WINDOW
+from analytics import analytics, REPORTS
+from background import background_tasks
+from mailing import send_mailing
+import segmentation
 
 admin_router = Router()
 
@@ -14,9 +42,15 @@ class AdminStates(StatesGroup):
     ADD_STAFF_ID = State()                   
     ADD_STAFF_CAFE = State()                 
     REMOVE_STAFF_CONFIRM = State() 
+    IMPORT_CLIENTS_FILE = State()
+    BULK_STAFF_FILE = State()
+    MAILING_TEXT = State()
+
+
+STAFF_PAGE_SIZE = 30
 
 
-@admin_router.message(F.text == "/admin")
+@admin_router.message(ExactText("/admin"))
 async def cmd_admin(message: Message):
     """
     Обрабатывает команду /admin — вход в админ-панель
@@ -35,7 +69,7 @@ async def cmd_admin(message: Message):
     await message.answer("👮‍♂️ Админ-панель", reply_markup=get_staff_main_menu())
 
 
-@admin_router.message(F.text == "👥 Управление персоналом")
+@admin_router.message(ExactText("👥 Управление персоналом"))
 async def staff_management(message: Message):
         """
         Показывает меню управления персоналом.
@@ -50,49 +84,137 @@ async def staff_management(message: Message):
         await message.answer("Управление персоналом:", reply_markup=get_staff_management_menu())
 
 
-@admin_router.message(F.text == "📊 Статистика")
+def cafe_names():
+    """Названия кафе по ID (для отчётов)"""
+    return {cafe_id: cafe["name"] for cafe_id, cafe in CAFES.items()}
+
+
+@admin_router.message(ExactText("📊 Статистика"))
 async def staticticks(message: Message):
     """
-    В будущем здесь будет отображаться статистика:
-    - Количество клиентов
+    Обработчик кнопки "📊 Статистика"
+    Показывает общую статистику и кнопки выбора отчёта:
+    - Количество клиентов и баллов на счетах
     - Активность по кафе
-    - Общее количество начисленных/потраченных баллов
-    
-    Сейчас — заглушка
+    - Топ клиентов и работа кассиров
+
+    Отчёт считается в отдельном процессе (analytics) и кэшируется
     """
-    await message.answer(
-        "📊 <b>Статистика</b>\n\n"
-        "🛠 Эта функция находится в разработке.\n"
-        "Скоро здесь будет:\n"
-        "👥 Количество клиентов\n"
-        "📈 Активность по точкам\n"
-        "🧮 Баланс баллов за месяц",
-        parse_mode="HTML"
-    )
+    if get_user_role(message.from_user.id) != "admin":
+        await message.answer("🚫 У вас нет доступа к админ-панели.")
+        return
+
+    text = await analytics.report("overview", cafe_names())
+    await message.answer(text, reply_markup=get_stats_keyboard("overview"), parse_mode="HTML")
+
 
+@admin_router.callback_query(F.data.startswith("stats:"))
+async def stats_report(callback: CallbackQuery):
+    """
+    Обработчик inline-кнопок выбора отчёта
+    Название отчёта берётся из callback_data, сообщение редактируется на месте
+    """
+    if get_user_role(callback.from_user.id) != "admin":
+        return
 
-@admin_router.message(F.text == "📢 Рассылка")
+    name = callback.data.split(":", 1)[1]
+    if name not in REPORTS:
+        return
+    text = await analytics.report(name, cafe_names())
+    try:
+        await callback.message.edit_text(text, reply_markup=get_stats_keyboard(name),
+                                         parse_mode="HTML")
+    except TelegramBadRequest:
+        # Отчёт из кэша не изменился — Telegram не даёт отредактировать на то же самое
+        pass
+
+
+def render_mailing_menu():
+    """
+    Собирает меню рассылки: количество клиентов в каждом сегменте
+
+    Returns:
+        tuple: (текст сообщения, inline-клавиатура)
+    """
+    counts = get_segment_counts()
+    if not counts:
+        text = ("📢 <b>Рассылка</b>\n\n"
+                "Сегменты клиентов ещё не посчитаны.\n"
+                "Они пересчитываются каждую ночь или по кнопке ниже.")
+    else:
+        lines = [f"{title}: {counts.get(segment, 0)}"
+                 for segment, title in segmentation.SEGMENTS.items()]
+        text = "📢 <b>Рассылка</b>\n\nВыберите сегмент получателей:\n\n" + "\n".join(lines)
+    return text, get_mailing_keyboard(segmentation.SEGMENTS, counts)
+
+
+@admin_router.message(ExactText("📢 Рассылка"))
 async def mailing_menu(message: Message):
     """
-    Меню рассылок (в разработке)
-    
-    Позволит отправлять массовые сообщения:
-    - О новых акциях
-    - О скидках
-    - О событиях в кафе
+    Меню рассылок по сегментам клиентов (RFM, см. segmentation.py)
+
+    Показывает размер каждого сегмента и кнопки выбора получателей:
+    - Лучшие и постоянные клиенты
+    - Уходящие ценные и давно не бывшие клиенты
+    - Новые клиенты и т.д.
     """
-    await message.answer(
-        "📢 <b>Рассылка</b>\n\n"
-        "🛠 Эта функция находится в разработке.\n"
-        "Скоро здесь можно будет:\n"
-        "📬 Отправлять уведомления всем клиентам\n"
-        "🎉 Анонсировать акции и спецпредложения\n"
-        "📊 Повышать лояльность через персональные предложения",
-        parse_mode="HTML"
+    if get_user_role(message.from_user.id) != "admin":
+        await message.answer("🚫 У вас нет доступа к админ-панели.")
+        return
+
+    text, keyboard = render_mailing_menu()
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
+@admin_router.callback_query(F.data == "mail_refresh")
+async def mailing_refresh(callback: CallbackQuery):
+    """
+    Обработчик кнопки '🔄 Пересчитать сегменты'
+    Пересчитывает сегменты в отдельном потоке и обновляет меню рассылки
+    """
+    if get_user_role(callback.from_user.id) != "admin":
+        return
+
+    await asyncio.to_thread(segmentation.run)
+    text, keyboard = render_mailing_menu()
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    except TelegramBadRequest:
+        # Размеры сегментов не изменились
+        pass
+
+
+@admin_router.callback_query(F.data.startswith("mail:"))
+async def mailing_choose_segment(callback: CallbackQuery, state: FSMContext):
+    """
+    Обработчик выбора сегмента
+    Сохраняет сегмент в состояние и ждёт текст рассылки (MAILING_TEXT)
+    """
+    if get_user_role(callback.from_user.id) != "admin":
+        return
+
+    segment = callback.data.split(":", 1)[1]
+    if segment not in segmentation.SEGMENTS:
+        return
+    await state.set_state(AdminStates.MAILING_TEXT)
+    await state.update_data(segment=segment)
+    await callback.message.edit_text(
+        f"Сегмент: {segmentation.SEGMENTS[segment]}\n\n"
+        "Отправьте текст рассылки одним сообщением (форматирование сохранится).",
+        reply_markup=get_mailing_cancel_keyboard()
     )
 
 
-@admin_router.message(F.text == "➕ Добавить кассира")
+@admin_router.callback_query(F.data == "mail_cancel")
+async def mailing_cancel(callback: CallbackQuery, state: FSMContext):
+    """
+    Обработчик кнопки отмены рассылки
+    """
+    await state.clear()
+    await callback.message.edit_text("❌ Рассылка отменена", reply_markup=None)
+
+
+@admin_router.message(ExactText("➕ Добавить кассира"))
 async def btn_add_staff(message: Message, state: FSMContext):
     """
     Обработчик кнопки '➕ Добавить кассира' в админ-панели.
@@ -143,7 +265,7 @@ async def process_cafe_id(message: Message, state: FSMContext):
         await message.answer("Введите корректный ID кафе")
 
 
-@admin_router.message(F.text == "➖ Удалить кассира")
+@admin_router.message(ExactText("➖ Удалить кассира"))
 async def btn_remove_staff(message: Message, state: FSMContext):
     """
     Обработчик кнопки '➖ Удалить кассира'
@@ -171,25 +293,380 @@ async def process_remove_staff(message: Message, state: FSMContext):
         await message.answer("Введите корректный ID кассира")
 
 
-@admin_router.message(F.text == "📋 Список кассиров")
+def render_staff_page(offset):
+    """
+    Формирует текст и клавиатуру одной страницы списка кассиров.
+    Кассиры сгруппированы по кафе, страница загружается одним запросом.
+
+    Args:
+        offset (int): Смещение страницы
+
+    Returns:
+        tuple: (текст сообщения, inline-клавиатура или None)
+    """
+    staff_list, total = get_staff_page(STAFF_PAGE_SIZE, offset)
+    if not staff_list:
+        return "Нет кассиров", None
+
+    lines = [f"📋 Кассиры {offset + 1}–{offset + len(staff_list)} из {total}"]
+    current_cafe = None
+    for staff in staff_list:
+        if staff.cafe_id != current_cafe:
+            current_cafe = staff.cafe_id
+            cafe_name = CAFES.get(current_cafe, {}).get("name", "")
+            lines.append(f"\n☕ Кафе #{current_cafe} {cafe_name}:")
+        name = f" @{escape(staff.username)}" if staff.username else ""
+        lines.append(f"id - {staff.staff_id}{name} {escape(staff.full_name or '')}".rstrip())
+    return "\n".join(lines), get_staff_list_keyboard(offset, total, STAFF_PAGE_SIZE)
+
+
+@admin_router.message(ExactText("📋 Список кассиров"))
 async def btn_list_staff(message: Message):
     """
     Обработчик кнопки "📋 Список кассиров"
-    Получает список кассиров в каждом кафе
-    Для каждого кафе выводит ID кассира и номер кафе
+    Показывает первую страницу списка кассиров одним сообщением,
+    сгруппированным по кафе, с кнопками листания
     Если кассиров нет — отображает соответствующее сообщение
     """
-    for cafe_id in [1, 2, 3]:
-        staff_list = get_staff_by_cafe(cafe_id)
-        names = '\n'.join([f"id - {s[0]}, - Кафе #{s[1]}" for s in staff_list]) if staff_list else "Нет кассиров"
-        await message.answer(f"☕ Кафе #{cafe_id}:\n{names}")
+    text, keyboard = render_staff_page(0)
+    await message.answer(text, reply_markup=keyboard)
 
 
-@admin_router.message(F.text == "◀️ Главное меню")
-async def main_menu(message: Message):
+@admin_router.callback_query(F.data.startswith("staff_page:"))
+async def staff_page(callback: CallbackQuery):
+    """
+    Обработчик inline-кнопок листания списка кассиров
+    Смещение страницы берётся из callback_data, сообщение редактируется на месте
+    """
+    if get_user_role(callback.from_user.id) != "admin":
+        return
+
+    try:
+        offset = max(int(callback.data.split(':')[1]), 0)
+    except ValueError:
+        return
+    text, keyboard = render_staff_page(offset)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+
+@admin_router.message(ExactText("📥 Загрузить кассиров"))
+async def btn_bulk_staff(message: Message, state: FSMContext):
+    """
+    Обработчик кнопки '📥 Загрузить кассиров'
+    Переводит бота в состояние ожидания CSV-файла со списком кассиров
+    """
+    if get_user_role(message.from_user.id) != "admin":
+        await message.answer("🚫 У вас нет доступа к админ-панели.")
+        return
+
+    await state.set_state(AdminStates.BULK_STAFF_FILE)
+    await message.answer(
+        "Отправьте CSV-файл с кассирами.\n"
+        "Колонки: <code>staff_id,cafe_id,username,full_name</code>\n"
+        "Существующие кассиры будут обновлены.",
+        parse_mode="HTML"
+    )
+
+
+@admin_router.message(AdminStates.BULK_STAFF_FILE, F.document)
+async def process_bulk_staff_file(message: Message, state: FSMContext, bot: Bot):
+    """
+    Обработчик состояния BULK_STAFF_FILE
+    Скачивает CSV-файл и добавляет или обновляет всех кассиров одной транзакцией
+    Завершает FSM после загрузки
+    """
+    if get_user_role(message.from_user.id) != "admin":
+        await state.clear()
+        return
+
+    fd, path = tempfile.mkstemp(prefix="staff_", suffix=".csv")
+    os.close(fd)
+    try:
+        await bot.download(message.document, destination=path)
+        staff_rows, errors = read_staff_csv(path, CAFES)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    finally:
+        os.unlink(path)
+
+    count = upsert_staff_many(staff_rows) if staff_rows else 0
+    await state.clear()
+
+    text = f"✅ Загружено кассиров: {count}"
+    if errors:
+        text += f"\n\n⚠️ Пропущено строк: {len(errors)}\n" + "\n".join(errors[:10])
+    await message.answer(text, reply_markup=get_staff_management_menu())
+
+
+EXPORT_HELP = (
+    "📤 <b>Выгрузка данных</b>\n\n"
+    "<code>/export тип [csv|jsonl] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] [cafe=N]</code>\n\n"
+    "Типы:\n"
+    "• clients — клиенты и их баллы\n"
+    "• purchases — коды начисления\n"
+    "• spends — коды списания\n"
+    "• ledger — журнал операций\n\n"
+    "jsonl выгружается сжатым (gzip)."
+)
+
+
+@admin_router.message(ExactText("📤 Выгрузка"))
+async def btn_export(message: Message):
+    """
+    Обработчик кнопки "📤 Выгрузка"
+    Показывает администратору, как пользоваться командой /export
+    """
+    if get_user_role(message.from_user.id) != "admin":
+        return
+    await message.answer(EXPORT_HELP, parse_mode="HTML")
+
+
+@admin_router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
+    """
+    Обработчик команды /export
+    Выгружает клиентов, коды или журнал операций в файл
+    и отправляет его администратору документом.
+
+    Строки читаются из базы порциями и сразу пишутся в файл,
+    а сама выгрузка выполняется в отдельном потоке —
+    большие выгрузки не блокируют бота и не раздувают память.
+    """
+    if get_user_role(message.from_user.id) != "admin":
+        await message.answer("🚫 У вас нет доступа к админ-панели.")
+        return
+
+    try:
+        params = parse_export_args((command.args or "").split())
+    except ExportError as e:
+        await message.answer(f"❌ {e}\n\n{EXPORT_HELP}", parse_mode="HTML")
+        return
+
+    await message.answer("⏳ Готовлю выгрузку...")
+    try:
+        path, count = await asyncio.to_thread(write_export, **params)
+    except ExportError as e:
+        await message.answer(f"❌ {e}")
+        return
+
+    try:
+        extension = ".csv" if params["fmt"] == "csv" else ".jsonl.gz"
+        await message.answer_document(
+            FSInputFile(path, filename=params["kind"] + extension),
+            caption=f"📤 {params['kind']}: {count} строк"
+        )
+    finally:
+        os.unlink(path)
+
+
+@admin_router.message(Command("import"))
+async def cmd_import(message: Message, state: FSMContext):
+    """
+    Обработчик команды /import
+    Переводит бота в состояние ожидания CSV-файла с клиентами
+    из старой системы лояльности
+    """
+    if get_user_role(message.from_user.id) != "admin":
+        await message.answer("🚫 У вас нет доступа к админ-панели.")
+        return
+
+    await state.set_state(AdminStates.IMPORT_CLIENTS_FILE)
+    await message.answer(
+        "📥 Отправьте CSV-файл с клиентами (до 20 МБ).\n"
+        "Колонки: <code>user_id,username,full_name,points</code>\n\n"
+        "Если импорт прервётся, отправьте тот же файл ещё раз — "
+        "загрузка продолжится с места остановки.",
+        parse_mode="HTML"
+    )
+
+
+@admin_router.message(AdminStates.IMPORT_CLIENTS_FILE, F.document)
+async def process_import_file(message: Message, state: FSMContext, bot: Bot):
+    """
+    Обработчик состояния IMPORT_CLIENTS_FILE
+    Скачивает CSV-файл и импортирует клиентов с балансами
+    большими транзакциями в отдельном потоке
+    Завершает FSM после импорта
+    """
+    fd, path = tempfile.mkstemp(prefix="import_", suffix=".csv")
+    os.close(fd)
+    try:
+        await bot.download(message.document, destination=path)
+        await message.answer("⏳ Импортирую...")
+        result = await asyncio.to_thread(import_csv, path)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    finally:
+        os.unlink(path)
+
+    await state.clear()
+    # Импортированные клиенты больше не должны писать в базу при /start,
+    # а их балансы в кэше профилей устарели
+    await asyncio.to_thread(known_users.load)
+    await client_cache.refresh()
+
+    errors = "\n".join(result.errors[:10])
+    await message.answer(
+        f"✅ Импорт завершён\n"
+        f"Загружено: {result.imported}\n"
+        f"Отклонено: {result.rejected}\n"
+        f"Пропущено (уже загружено ранее): {result.skipped}\n"
+        f"Скорость: {result.rows_per_second:.0f} строк/с"
+        + (f"\n\n⚠️ Ошибки:\n{errors}" if errors else "")
+    )
+
+
+@admin_router.message(Command("maintenance"))
+async def cmd_maintenance(message: Message, command: CommandObject):
+    """
+    Обработчик команды /maintenance
+    Показывает длительность и результат последних шагов обслуживания базы.
+    `/maintenance run` — выполнить суточное обслуживание сейчас
+    (vacuum, optimize, backup, checkpoint) не дожидаясь тихих часов
+    """
+    if get_user_role(message.from_user.id) != "admin":
+        await message.answer("🚫 У вас нет доступа к админ-панели.")
+        return
+
+    if (command.args or "").strip() == "run":
+        await message.answer("⏳ Обслуживание базы...")
+        reports = await maintenance.run_nightly()
+    else:
+        reports = list(maintenance.reports.values())
+
+    if not reports:
+        await message.answer("Обслуживание ещё не выполнялось.\n"
+                             "<code>/maintenance run</code> — запустить сейчас",
+                             parse_mode="HTML")
+        return
+    lines = [f"{report.started_at:%d.%m %H:%M} {escape(str(report))}" for report in reports]
+    await message.answer("🛠 Обслуживание базы:\n" + "\n".join(lines))
+
+
+@admin_router.message(Command("loglevel"))
+async def cmd_loglevel(message: Message, command: CommandObject):
+    """
+    Обработчик команды /loglevel
+    Показывает уровни логгеров и меняет их без перезапуска бота:
+    `/loglevel DEBUG` — корневой логгер,
+    `/loglevel handlers.client_handlers DEBUG` — один логгер
+    """
+    if get_user_role(message.from_user.id) != "admin":
+        await message.answer("🚫 У вас нет доступа к админ-панели.")
+        return
+
+    args = (command.args or "").split()
+    if args:
+        name, level = (None, args[0]) if len(args) == 1 else (args[0], args[1])
+        try:
+            log_pipeline.set_level(level, name)
+        except ValueError:
+            await message.answer("❌ Уровень: DEBUG, INFO, WARNING, ERROR или NOTSET")
+            return
+
+    lines = [f"{escape(name)}: {level}" for name, level in log_pipeline.levels().items()]
+    lines.append(f"\nПрорежено: {log_pipeline.sampler.dropped}, "
+                 f"отброшено (очередь переполнена): {log_pipeline.dropped}")
+    await message.answer("📝 Уровни логов:\n" + "\n".join(lines))
+
+
+PROFILE_HELP = (
+    "🔬 <b>Профилирование</b>\n"
+    "<code>/profile cpu 30</code> — cProfile за 30 с (таблица + файл .prof)\n"
+    "<code>/profile mem 60</code> — прирост памяти за 60 с (tracemalloc)\n"
+    "<code>/profile loop 10</code> — задержка event loop и задачи asyncio\n\n"
+    f"Окно — от {MIN_WINDOW} до {MAX_WINDOW} с, по умолчанию 10."
+)
+
+
+@admin_router.message(Command("profile"))
+async def cmd_profile(message: Message, command: CommandObject, bot: Bot):
+    """
+    Обработчик команды /profile
+    Запускает профилирование работающего бота фоновой задачей
+    и по окончании окна присылает администратору результат
+    """
+    if get_user_role(message.from_user.id) != "admin":
+        await message.answer("🚫 У вас нет доступа к админ-панели.")
+        return
+
+    args = (command.args or "").split()
+    runs = {"cpu": profiler.cpu, "mem": profiler.memory, "loop": profiler.loop}
+    if not args or args[0] not in runs:
+        await message.answer(PROFILE_HELP, parse_mode="HTML")
+        return
+    try:
+        seconds = int(args[1]) if len(args) > 1 else 10
+    except ValueError:
+        seconds = 0
+    if not MIN_WINDOW <= seconds <= MAX_WINDOW:
+        await message.answer(PROFILE_HELP, parse_mode="HTML")
+        return
+    if profiler.running is not None:
+        await message.answer(f"⏳ Уже идёт профилирование ({profiler.running})")
+        return
+
+    chat_id = message.chat.id
+
+    async def run():
+        try:
+            result = await runs[args[0]](seconds)
+        except ProfilerBusyError as e:
+            await bot.send_message(chat_id, f"⏳ Уже идёт профилирование ({e})")
+            return
+        await bot.send_message(chat_id, format_result(result), parse_mode="HTML")
+        if result.data is not None:
+            await bot.send_document(chat_id, BufferedInputFile(result.data, filename=result.filename),
+                                    caption="python -m pstats " + result.filename)
+
+    background_tasks.spawn(run(), name=f"profile-{args[0]}")
+    await message.answer(f"⏳ Профилирование {args[0]} на {seconds} с, по окончании пришлю результат.")
+
+
+@admin_router.message(ExactText("◀️ Главное меню"))
+async def main_menu(message: Message, state: FSMContext):
     """
     ОБработчик кнопки "◀️ Главное меню"
     Возвращает в главное меню админ-панели
+    и сбрасывает незавершённый ввод (например, текст рассылки)
     """
+    await state.clear()
     await message.answer('Главное меню', reply_markup=get_staff_main_menu())
 
+
+# Регистрируется последним: кнопки меню админа обрабатываются раньше,
+# а не уходят клиентам как текст рассылки
+@admin_router.message(AdminStates.MAILING_TEXT, F.text)
+async def process_mailing_text(message: Message, state: FSMContext, bot: Bot):
+    """
+    Обработчик состояния MAILING_TEXT
+    Запускает рассылку фоновой задачей (с ограничением скорости отправки)
+    и по окончании присылает администратору итог
+    Завершает FSM
+    """
+    data = await state.get_data()
+    segment = data.get("segment")
+    await state.clear()
+    if segment not in segmentation.SEGMENTS:
+        await message.answer("❌ Сегмент не выбран")
+        return
+
+    text = message.html_text
+    admin_chat_id = message.chat.id
+
+    async def run():
+        result = await send_mailing(bot, segment, text)
+        await bot.send_message(
+            admin_chat_id,
+            f"📢 Рассылка «{segmentation.SEGMENTS[segment]}» завершена\n"
+            f"Отправлено: {result.sent}\n"
+            f"Заблокировали бота: {result.blocked}\n"
+            f"Ошибок: {result.failed}\n"
+            f"Время: {result.seconds:.0f} с"
+        )
+
+    background_tasks.spawn(run(), name=f"mailing-{segment}")
+    await message.answer("⏳ Рассылка запущена, по окончании пришлю итог.",
+                         reply_markup=get_staff_main_menu())
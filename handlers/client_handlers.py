@@ -1,5 +1,5 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram import Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -13,18 +13,29 @@ from keyboards.client_kb import (
     get_confirmation_keyboard
 )
 
-from keyboards.staff_kb import (
-    get_confirmation_keyboard_for_spend,
-    get_confirmation_keyboard_for_purchase
-)
 
 from keyboards.admin_kb import get_staff_main_menu
-from database import add_client, get_client, save_purchase_code, save_spend_code, get_staff_by_cafe, connect
-from utils import generate_purchase_code, get_user_role
+from repository import (
+    get_cafe_staff_ids,
+    get_pending_purchase_code,
+    get_pending_spend_code,
+    save_purchase_code,
+    save_spend_code,
+    PendingCode
+)
+from cashier_queue import cashier_queue
+import tokens
+from keyboards.callbacks import CodeKind
+from known_users import known_users
+from client_cache import client_cache
+from utils import get_user_role
+from filters import ExactText
 from config import CAFES
 import logging
+import time
 
-logging.basicConfig(level=logging.INFO)
+
+logger = logging.getLogger(__name__)
 
 
 class ClientStates(StatesGroup):
@@ -42,13 +53,13 @@ ERROR_MESSAGE = "⚠️ Ошибка сервера. Попробуйте поз
 client_router = Router()
 
 
-@client_router.message(F.text == "/start")
+@client_router.message(ExactText("/start"))
 async def cmd_start(message: Message, state: FSMContext):
     """
     Обрабатывает команду /start — начало работы с ботом
     
     1. Получает данные пользователя
-    2. Добавляет его в базу (если он новый)
+    2. Добавляет его в базу (если он новый — по данным known_users)
     3. Определяет роль: клиент, кассир или админ
     4. Показывает соответствующее меню
     """
@@ -81,7 +92,8 @@ async def cmd_start(message: Message, state: FSMContext):
 """
 
         # Регистрируем клиента, если его ещё нет в базе
-        add_client(user_id, username, full_name)
+        # (известные клиенты пропускаются без записи, смена имени сбрасывается пачкой)
+        await known_users.register(user_id, username, full_name)
 
         # Определяем роль пользователя
         role = get_user_role(user_id)
@@ -97,24 +109,24 @@ async def cmd_start(message: Message, state: FSMContext):
                 reply_markup=get_client_menu()
             )
     except Exception as e:
-        logging.error(f"Error in /start: {e}")
+        logger.exception("Error in /start: %r", e)
         await message.answer(ERROR_MESSAGE)
         await state.set_state(ClientStates.selecting_action)
 
 
-@client_router.message(F.text == "➕ Получить баллы")
+@client_router.message(ExactText("➕ Получить баллы"))
 async def btn_choose_cafe(message: Message, state: FSMContext):
     """
     - Нажатие кнопки "Получить баллы"
     - Переводит в состояние выбора кафе
     - Показывает клавиатуру с адресами
     """
-    logging.info(f"User {message.from_user.id} clicked 'Earn points'")
+    logger.info("User %s clicked 'Earn points'", message.from_user.id)
     await state.set_state(ClientStates.earning_points)
     await message.answer("Выберите кафе:", reply_markup=get_cafe_selection_keyboard())
 
 
-@client_router.message(F.text == "💸 Потратить баллы")
+@client_router.message(ExactText("💸 Потратить баллы"))
 async def ask_cafe_for_spend(message: Message, state: FSMContext):
     """
     - Нажатие кнопки "Потратить баллы"
@@ -128,9 +140,9 @@ async def ask_cafe_for_spend(message: Message, state: FSMContext):
 
 @client_router.message(
     ClientStates.earning_points,
-    F.text.in_(["Центральная кофейня",
-                "Кофейня в ТЦ «Галерея»",
-                "Кофейня на Вокзале"])
+    ExactText("Центральная кофейня",
+              "Кофейня в ТЦ «Галерея»",
+              "Кофейня на Вокзале")
 )
 async def handle_cafe_selection(message: Message, state: FSMContext):
     """
@@ -160,16 +172,51 @@ async def handle_cafe_selection(message: Message, state: FSMContext):
     await state.set_state(ClientStates.confirming_code_request) 
 
 
+async def send_code_qr(bot: Bot, item: PendingCode):
+    """
+    Отправляет клиенту QR-код (или ссылку, если qrcode не установлен)
+    с подписанным токеном выданного кода: кассир сканирует его вместо ввода кода.
+    Ошибка здесь не мешает клиенту — цифровой код уже отправлен.
+    """
+    try:
+        link = await tokens.create_link(bot, tokens.issue(item))
+        image = tokens.render_qr(link)
+        if image is None:
+            await bot.send_message(item.user_id, f"📷 Или дайте кассиру открыть ссылку:\n{link}")
+        else:
+            await bot.send_photo(item.user_id, BufferedInputFile(image, "code.png"),
+                                 caption="📷 Или дайте кассиру отсканировать QR-код")
+    except Exception as e:
+        logger.warning("Не удалось отправить QR-код: %r", e)
+
+
+async def send_pending_code(callback: CallbackQuery, bot: Bot, code: str, hint: str):
+    """
+    Повторно показывает клиенту уже выданный и ещё не использованный код.
+    Очередь кассиров не меняется — этот код в ней уже есть.
+    """
+    await callback.message.edit_text(
+        f"🔢 Ваш код: `{code}` (выдан ранее и ещё действует)\n{hint}",
+        reply_markup=None,
+        parse_mode="Markdown"
+    )
+    await bot.send_message(callback.from_user.id, "Главное меню:", reply_markup=get_client_menu())
+
+
 @client_router.callback_query(F.data == "confirm_earn",
-                              ClientStates.confirming_code_request)
+                              ClientStates.confirming_code_request,
+                              flags={"issues_code": True})
 async def handle_inline_confirm(callback: CallbackQuery,
                                 state: FSMContext,
                                 bot: Bot):
     """
     Когда клиент подтверждает генерацию кода:
     - Получает данные из FSM
-    - Генерирует код
-    - Отправляет его кассиру и клиенту
+    - Если у клиента уже есть невыкупленный код в этом кафе — повторно
+      отправляет его только клиенту (без записи в базу и без изменения очереди кассиров)
+    - Иначе генерирует код
+    - Добавляет его в очередь кассиров кафе и отправляет клиенту
+      (вместе с QR-кодом для сканирования кассиром)
     
     Если всё ок — очищает состояние
     """
@@ -179,43 +226,46 @@ async def handle_inline_confirm(callback: CallbackQuery,
         cafe_name = data.get("cafe_name")
 
         if not cafe_id or not cafe_name:
-            await callback.answer("❌ Ошибка: данные кафе не найдены")
+            await callback.message.edit_text("❌ Ошибка: данные кафе не найдены",
+                                             reply_markup=None)
             await state.clear()
             return
 
-        code = generate_purchase_code()
         user_id = callback.from_user.id
-        save_purchase_code(user_id, cafe_id, code)
+
+        # Клиент уже получал код в этом кафе — кассиры его уже видели
+        pending_code = get_pending_purchase_code(user_id, cafe_id)
+        if pending_code:
+            await send_pending_code(callback, bot, pending_code,
+                                    f"Покажите его кассиру в {cafe_name}.")
+            return
+
+        code = cashier_queue.new_code(cafe_id)
+        code_id = await save_purchase_code(user_id, cafe_id, code)
         
-        staff_list = get_staff_by_cafe(cafe_id)
+        staff_ids = get_cafe_staff_ids(cafe_id)
         
-        if not staff_list:
-            logging.warning("❌ В этом кафе нет кассиров")
+        if not staff_ids:
+            logger.warning("❌ В кафе %s нет кассиров", cafe_id)
             await callback.message.edit_text(
                 '❌ Нет доступных кассиров.',
                 reply_markup=get_client_menu()
             )
             await state.clear()
             return
-        # Отправляем всем кассирам
-        for staff in staff_list:
-            staff_id = staff[0]
-            try:
-                await bot.send_message(
-                    staff_id,
-                    f"🆔 Код для начисления: `{code}`\n"
-                    f"👤 Клиент: {callback.from_user.full_name}",
-                    reply_markup=get_confirmation_keyboard_for_purchase(code),
-                    parse_mode="Markdown"
-                )
-            except Exception as e:
-                logging.error(f"❌ Ошибка отправки кассиру {staff_id}: {e}")
+        # Добавляем код в очередь кассиров кафе (их сообщения обновятся с задержкой)
+        item = PendingCode(
+            CodeKind.purchase.value, code_id, code, 0, cafe_id, user_id,
+            callback.from_user.full_name, None, time.time()
+        )
+        cashier_queue.add(item)
 
         await callback.message.edit_text(
             f"🔢 Ваш код: `{code}`\n"
             f"Покажите его кассиру в {cafe_name}.",
             parse_mode="Markdown")
-        
+        await send_code_qr(bot, item)
+
         await bot.send_message(
             callback.from_user.id,
             "☕️",
@@ -223,8 +273,8 @@ async def handle_inline_confirm(callback: CallbackQuery,
         )
 
     except Exception as e:
-        logging.error(f"Ошибка при подтверждении получения баллов: {e}")
-        await callback.answer("⚠️ Ошибка сервера.")
+        logger.exception("Ошибка при подтверждении получения баллов: %r", e)
+        await callback.message.answer(ERROR_MESSAGE)
 
     finally:
         await state.clear()
@@ -250,9 +300,9 @@ async def handle_inline_cancel(callback: CallbackQuery, state: FSMContext):
 
 @client_router.message(
     ClientStates.spending_points, 
-    F.text.in_([ "Центральная кофейня",
-                "Кофейня в ТЦ «Галерея»",
-                "Кофейня на Вокзале"]) 
+    ExactText("Центральная кофейня",
+              "Кофейня в ТЦ «Галерея»",
+              "Кофейня на Вокзале")
 )
 async def handle_spend_points(message: Message, state: FSMContext):
     """
@@ -271,8 +321,8 @@ async def handle_spend_points(message: Message, state: FSMContext):
         )
         
         # 2. Проверяем, есть ли кассиры в этом кафе
-        staff_list = get_staff_by_cafe(cafe_id)
-        if not staff_list:
+        staff_ids = get_cafe_staff_ids(cafe_id)
+        if not staff_ids:
             await message.answer(
                 "❌ В этом кафе сейчас нет кассиров. Попробуйте позже.",
                 reply_markup=get_client_menu()
@@ -296,13 +346,15 @@ async def handle_spend_points(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        logging.error(f"Ошибка в handle_spend_points: {e}")
+        logger.exception("Ошибка в handle_spend_points: %r", e)
         await message.answer(ERROR_MESSAGE)
         await state.clear()
     
 
 @client_router.message(ClientStates.choosing_product,
-                        F.text.startswith(("🍪", "🧋", "🥐"))) 
+                        ExactText("🍪 Печенье (30 баллов)",
+                                  "🧋 Капучино (50 баллов)",
+                                  "🥐 Круассан (70 баллов)"))
 async def handle_product_selection(message: Message,
                                     bot: Bot,
                                       state: FSMContext):
@@ -334,8 +386,8 @@ async def handle_product_selection(message: Message,
         return
 
     # Проверяем, есть ли кассиры в этом кафе
-    staff_list = get_staff_by_cafe(cafe_id)
-    if not staff_list:
+    staff_ids = get_cafe_staff_ids(cafe_id)
+    if not staff_ids:
         await message.answer("❌ В этом кафе сейчас нет кассиров.",
                               reply_markup=get_client_menu())
         await state.clear()
@@ -359,7 +411,8 @@ async def handle_product_selection(message: Message,
 
 
 @client_router.callback_query(F.data == 'confirm_spend',
-                               ClientStates.confirming_spend_request)
+                               ClientStates.confirming_spend_request,
+                               flags={"issues_code": True})
 async def handle_confirm_spend(callback: CallbackQuery,
                                 bot: Bot,
                                state: FSMContext):
@@ -367,8 +420,9 @@ async def handle_confirm_spend(callback: CallbackQuery,
     Клиент подтверждает списание баллов:
     - Получение данных из FSM 
     - Проверка баланса 
+    - Повторная выдача невыкупленного кода на тот же товар (без рассылки)
     - Генерация кода 
-    - Отправляем его кассиру
+    - Добавляем его в очередь кассиров кафе
     - Информируем клиента и возвращаем в главное меню
     """
     try:
@@ -380,32 +434,30 @@ async def handle_confirm_spend(callback: CallbackQuery,
         cost = data['cost']
 
         # Проверяем баланс
-        client = get_client(user_id)
-        if not client or client[3] < cost:
-            await callback.answer("❌ Недостаточно баллов!")
+        client = client_cache.get(user_id)
+        if not client or client.points < cost:
             await callback.message.edit_text("❌ Недостаточно баллов.", reply_markup=None)
             await state.clear()
             return
         
+        # Код на этот товар уже выдан и ещё не выкуплен — повторяем его только клиенту
+        pending_code = get_pending_spend_code(user_id, cafe_id, cost)
+        if pending_code:
+            await send_pending_code(callback, bot, pending_code,
+                                    f"Покажите его кассиру для получения {product_name}.")
+            return
+
         # Генерируем и сохраняем код
-        code = generate_purchase_code()
-        save_spend_code(user_id, code, cost)
-
-
-        # Отправляем код кассирам
-        staff_list = get_staff_by_cafe(cafe_id)
-        for staff in staff_list:
-            try:
-                await bot.send_message(
-                    staff[0],
-                    f"🆔 Код: `{code}`\n"
-                    f"🍽 Товар: {product_name} ({cost} баллов)\n"
-                    f"👤 Клиент: {callback.from_user.full_name}",
-                    reply_markup=get_confirmation_keyboard_for_spend(code, cost),
-                    parse_mode="Markdown"
-                )
-            except Exception as e:
-                logging.error(f"Ошибка отправки кассиру {staff[0]}: {e}")
+        code = cashier_queue.new_code(cafe_id)
+        code_id = await save_spend_code(user_id, code, cost, cafe_id)
+
+
+        # Добавляем код в очередь кассиров кафе
+        item = PendingCode(
+            CodeKind.spend.value, code_id, code, cost, cafe_id, user_id,
+            callback.from_user.full_name, product_name, time.time()
+        )
+        cashier_queue.add(item)
 
         # Сообщение клиенту
         await callback.message.edit_text(
@@ -414,13 +466,14 @@ async def handle_confirm_spend(callback: CallbackQuery,
             reply_markup=None,
             parse_mode="Markdown"
         )
+        await send_code_qr(bot, item)
 
         # Возврат в главное меню
         await bot.send_message(user_id, "Главное меню:", reply_markup=get_client_menu())
 
     except Exception as e:
-        logging.error(f"Ошибка при подтверждении списания: {e}")
-        await callback.answer("⚠️ Ошибка сервера.")
+        logger.exception("Ошибка при подтверждении списания: %r", e)
+        await callback.message.answer(ERROR_MESSAGE)
     finally:
         await state.clear()
 
@@ -450,8 +503,8 @@ async def generate_and_send_code(
     """
     Генерирует код для списания баллов и выполняет:
     - Сохранение в базе данных
-    - Отправку кассиру с inline-кнопкой
-    - Уведомление клиента
+    - Добавление в очередь кассиров кафе (cashier_queue)
+    - Уведомление клиента (код и QR-код с подписанным токеном)
 
     Если всё прошло успешно — очищает состояние
     """
@@ -464,27 +517,24 @@ async def generate_and_send_code(
         product_name = data["product_name"]
         cost = data["cost"]
 
-        code = generate_purchase_code()
+        code = cashier_queue.new_code(cafe_id)
 
         # Сохраняем код в БД (для списания баллов)
-        save_spend_code(user_id, code, cost)
+        code_id = await save_spend_code(user_id, code, cost, cafe_id)
         
-        staff_list = get_staff_by_cafe(cafe_id)
+        staff_ids = get_cafe_staff_ids(cafe_id)
         
         # Проверяем наличие кассиров
-        if not staff_list:
+        if not staff_ids:
             await bot.send_message(user_id, "❌ В этом кафе нет кассиров.")
             return
         
-         # Отправляем код кассирам       
-        for staff in staff_list:
-            await bot.send_message(
-                staff[0],  
-                f"🆔 Код: `{code}`\n"
-                f"🍽 Товар: {product_name} ({cost} баллов)\n",
-                reply_markup=get_confirmation_keyboard_for_spend(code, cost),
-                parse_mode="Markdown"
-            )
+        # Добавляем код в очередь кассиров кафе
+        item = PendingCode(
+            CodeKind.spend.value, code_id, code, cost, cafe_id, user_id,
+            None, product_name, time.time()
+        )
+        cashier_queue.add(item)
         
         # Отправляем код клиенту
         await bot.send_message(
@@ -494,31 +544,32 @@ async def generate_and_send_code(
             reply_markup=get_client_menu(),
             parse_mode="Markdown"
         )
+        await send_code_qr(bot, item)
         await state.clear()  
     
     except Exception as e:
-        logging.error(f"Ошибка при генерации кода: {e}")
+        logger.exception("Ошибка при генерации кода: %r", e)
         await bot.send_message(user_id, "⚠️ Ошибка сервера. Попробуйте позже.")
             
 
-@client_router.message(F.text == "💰 Мои баллы")
+@client_router.message(ExactText("💰 Мои баллы"))
 async def btn_my_points(message: Message):
     """
-    Показывает количество баллов клинета.
+    Показывает количество баллов клинета (из кэша профилей).
     Проверяет наличии регистрации клиента.
     """
     user_id = message.from_user.id
-    client = get_client(user_id)
+    client = client_cache.get(user_id)
 
     if client:
-        points = client[3]
+        points = client.points
         await message.answer(f"На вашем счёте: {points} баллов.",
                               reply_markup=get_client_menu())
     else:
         await message.answer("Вы ещё не зарегистрированы. Напишите /start")
 
 
-@client_router.message(F.text == "Главное меню")
+@client_router.message(ExactText("Главное меню"))
 async def btn_main_menu(message: Message):
     """
     Возвращает клиента в главное меню
@@ -526,7 +577,7 @@ async def btn_main_menu(message: Message):
     await message.answer("Главное меню:", reply_markup=get_client_menu())
 
 
-@client_router.message(F.text == 'ℹ️ О программе')
+@client_router.message(ExactText('ℹ️ О программе'))
 async def about_cafe(message: Message):
     """
     Показывает описание вымышленного кафе.
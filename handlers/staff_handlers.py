@@ -1,146 +1,291 @@
+import logging
+import re
+
 from aiogram import Router, F
-from aiogram.types import CallbackQuery
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
+from aiogram.types import CallbackQuery, Message
 from aiogram import Bot
-from database import connect
+from repository import use_purchase_code, use_spend_code, cancel_code, get_staff, find_pending_code
+from client_cache import client_cache
+from cashier_queue import cashier_queue, CODE_MODES
+import tokens
 
 from keyboards.client_kb import get_client_menu
+from keyboards.staff_kb import get_queue_keyboard
+from keyboards.callbacks import CodeCallback, CodeKind, CodeAction, LEGACY_PREFIXES
+
+logger = logging.getLogger(__name__)
 
 staff_router = Router()
 
-@staff_router.callback_query(F.data.startswith("purchase_confirm:"))
-async def confirm_purchase(callback: CallbackQuery, bot: Bot):
+# Код, который ввёл кассир: `123` или `123 14` (код и баллы к начислению)
+TYPED_CODE_RE = re.compile(r"^\s*(\d{3,8})(?:\s+(\d{1,4}))?\s*$")
+
+# Больше баллов за один код кассир начислить не может
+MAX_CODE_POINTS = 700
+
+# Таблица кодов для каждого типа операции (не зависит от содержимого callback_data)
+CODE_TABLES = {
+    CodeKind.purchase: "purchase_codes",
+    CodeKind.spend: "spend_codes",
+}
+
+
+async def show_result(callback: CallbackQuery, text: str):
+    """
+    Показывает кассиру результат действия с кодом.
+
+    Если кнопка нажата в сообщении-очереди — результат выводится строкой
+    в этом сообщении (очередь перерисуется сама), иначе (старые сообщения
+    с одним кодом) сообщение редактируется, а кнопки убираются.
+    """
+    if cashier_queue.is_dashboard(callback.from_user.id, callback.message.message_id):
+        cashier_queue.set_status(callback.from_user.id, text)
+    else:
+        await callback.message.edit_text(text, reply_markup=None)
+
+
+async def redeem_purchase(bot: Bot, staff, code, code_id, points):
     """
-    Обработчик inline-кнопки 'Подтвердить покупку' (purchase_confirm).
-    Получает код и количество баллов из callback_data.
-    Проверяет, существует ли такой код и не был ли он уже использован.
-    Если всё в порядке:
+    Начисляет баллы по коду (кнопкой в очереди или кодом, введённым кассиром).
+
+    Баллы проверяются здесь, а не только на клавиатуре: callback_data
+    присылает клиент Telegram, и её можно подделать. Код ищется только
+    среди кодов кафе кассира (staff.cafe_id).
+
+    Если код существует и ещё не использован:
     - Помечает код как использованный
-    - Начисляет баллы клиенту
+    - Начисляет баллы клиенту и записывает операцию в журнал (ledger)
+    - Обновляет баланс в кэше профилей (client_cache)
     - Отправляет уведомление клиенту
-    - Редактирует сообщение кассира
-    """
-    _, code, points = callback.data.split(':')
-    staff_id = callback.from_user.id
-
-    with connect() as conn:
-        cur = conn.cursor()
-        
-        # Проверяем, не использован ли код
-        cur.execute("""
-            SELECT used, user_id 
-            FROM purchase_codes 
-            WHERE code = ?
-        """, (code,))
-        result = cur.fetchone()
-        
-        if not result:
-            await callback.answer("❌ Код не найден!")
-            return
-            
-        is_used, client_id = result
-        if is_used:
-            await callback.answer("⚠️ Этот код уже использован!")
-            return
-            
-        # Помечаем код как использованный
-        cur.execute("""
-            UPDATE purchase_codes 
-            SET used = 1 
-            WHERE code = ?
-        """, (code,))
-        
-        # Начисляем баллы клиенту
-        cur.execute("""
-            UPDATE clients 
-            SET points = points + ? 
-            WHERE user_id = ?
-        """, (int(points), client_id))
-        
-        conn.commit()
+    Код в любом случае убирается из очереди кассиров.
+
+    Returns:
+        str: Результат для кассира
+    """
+    if not 0 < points <= MAX_CODE_POINTS:
+        return f"❌ Можно начислить от 1 до {MAX_CODE_POINTS} баллов"
+
+    result = use_purchase_code(code, code_id, points, staff.staff_id, staff.cafe_id)
+    cashier_queue.remove(CodeKind.purchase, code_id, code)
+    if result is None:
+        return f"❌ Код {code} не найден!"
+    if result.already_used:
+        return f"⚠️ Код {code} уже использован!"
+
+    # Обновляем кэш профилей тем же значением, что записали в базу
+    if result.version is not None:
+        client_cache.apply_balance(result.user_id, result.points, result.version)
 
     # Уведомляем клиента
     await bot.send_message(
-        client_id,
+        result.user_id,
         f"✅ Вам начислено {points} баллов!",
         reply_markup=get_client_menu()
     )
-    
-    await callback.message.edit_text(
-        f"🟢 Код {code} подтверждён!",
-        reply_markup=None
-    )
+    return f"🟢 Код {code} подтверждён: +{points}"
+
+
+async def redeem_spend(bot: Bot, staff, code, code_id, cost):
+    """
+    Списывает баллы по коду (кнопкой в очереди или кодом, введённым кассиром).
+    Код ищется среди кодов кафе кассира и должен быть выдан ровно на cost баллов.
+    Если баллов не хватает, код не сгорает, а кассир и клиент видят отказ.
+    Уведомляет клиента и убирает код из очереди кассиров.
+
+    Returns:
+        str: Результат для кассира
+    """
+    # Баланс проверяется самим UPDATE — кэш здесь не участвует
+    result = use_spend_code(code, code_id, cost, staff.staff_id, staff.cafe_id)
+    cashier_queue.remove(CodeKind.spend, code_id, code)
+    if result is None:
+        return f"❌ Код {code} не найден или уже использован"
+    if result.points is None:
+        # Баланс в кэше оказался устаревшим — перечитаем его из базы
+        client_cache.invalidate(result.user_id)
+        await bot.send_message(result.user_id, "❌ Недостаточно баллов")
+        return f"❌ Недостаточно баллов для списания {code}"
+
+    client_cache.apply_balance(result.user_id, result.points, result.version)
+    await bot.send_message(result.user_id, f"💸 Списано {cost} баллов")
+    return f"✅ Списание {code} подтверждено: −{cost}"
+
+
+async def confirm_purchase(callback: CallbackQuery, callback_data: CodeCallback, bot: Bot, staff):
+    """
+    Обработчик inline-кнопки 'Подтвердить покупку'.
+    Получает код и количество баллов из callback_data,
+    начисляет баллы (redeem_purchase) и показывает кассиру результат
+    """
+    text = await redeem_purchase(bot, staff, callback_data.code,
+                                 callback_data.code_id, callback_data.amount)
+    await show_result(callback, text)
+
+
+async def confirm_spend(callback: CallbackQuery, callback_data: CodeCallback, bot: Bot, staff):
+    """
+    Обработчик inline-кнопки 'Подтвердить списание'
+    Получает код и стоимость из callback_data,
+    списывает баллы (redeem_spend) и показывает кассиру результат
+    """
+    text = await redeem_spend(bot, staff, callback_data.code,
+                              callback_data.code_id, callback_data.amount)
+    await show_result(callback, text)
+
 
-@staff_router.callback_query(F.data.startswith("spend_confirm:"))
-async def confirm_spend(callback: CallbackQuery, bot: Bot):
-    """
-    Обработчик inline-кнопки 'Подтвердить списание' (spend_confirm:)
-    Получает код и стоимость из callback_data
-    Проверяет, не был ли уже использован этот код
-    Если всё в порядке — списывает баллы у клиента
-    Уведомляет клиента и редактирует сообщение кассира
-    """
-    _, code, cost = callback.data.split(':')
-    cost = int(cost)
-
-    # Помечаем код как использованный, если он ещё не использован
-    with connect() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            UPDATE spend_codes 
-            SET used = 1 
-            WHERE code = ? AND used = 0
-            RETURNING user_id
-        """, (code,))
-        result = cur.fetchone()
-
-        if result:
-            user_id = result[0]
-            cur.execute("UPDATE clients SET points = points - ? WHERE user_id = ? AND points >= ?", 
-                       (cost, user_id, cost))
-            conn.commit()
-            await bot.send_message(user_id, f"💸 Списано {cost} баллов")
-            await callback.message.edit_text("✅ Списание подтверждено", reply_markup=None)
-        else:
-            await callback.message.edit_text("❌ Код уже использован")
-
-
-@staff_router.callback_query(F.data.startswith(("purchase_reject:", "spend_reject:")))
-async def reject_code(callback: CallbackQuery, bot: Bot):
+async def reject_code(callback: CallbackQuery, callback_data: CodeCallback, bot: Bot, staff):
     """
     Обработчик inline-кнопки 'Отменить' для подтверждения покупки или списания
-    Поддерживает два типа событий: purchase_reject и spend_reject
-    Определяет тип операции, находит клиента и уведомляет его об отмене
-    Помечает код как использованный, чтобы он не мог быть использован повторно
-    """
-    # Получаем код из callback_data
-    _, code = callback.data.split(':')  
-    
-    # Определяем, с какой таблицей работаем — начисление или списание
-    table = "purchase_codes" if "purchase" in callback.data else "spend_codes"
-    
-    # Защита от неизвестных команд
-    if table not in ["purchase_codes", "spend_codes"]:
-        await callback.answer("❌ Не выйдет! 🕵️")
+    Таблица выбирается по типу кода из callback_data (CODE_TABLES)
+    Помечает код как использованный, чтобы он не мог быть использован повторно,
+    и уведомляет клиента, если код действительно был отменён
+    """
+    user_id = cancel_code(CODE_TABLES[callback_data.kind], callback_data.code,
+                          callback_data.code_id, staff.cafe_id)
+    cashier_queue.remove(callback_data.kind, callback_data.code_id, callback_data.code)
+
+    # Если пользователь найден — отправляем ему уведомление
+    if user_id is not None:
+        await bot.send_message(user_id, "❌ Кассир отменил операцию.")
+
+    await show_result(callback, f"❌ Код {callback_data.code} отменён")
+
+
+# Обработчик для каждой пары (тип кода, действие)
+CODE_HANDLERS = {
+    (CodeKind.purchase, CodeAction.confirm): confirm_purchase,
+    (CodeKind.purchase, CodeAction.reject): reject_code,
+    (CodeKind.spend, CodeAction.confirm): confirm_spend,
+    (CodeKind.spend, CodeAction.reject): reject_code,
+}
+
+
+@staff_router.callback_query(CodeCallback.filter())
+async def handle_code_callback(callback: CallbackQuery, callback_data: CodeCallback, bot: Bot):
+    """
+    Единая точка входа для кнопок кассира (CodeCallback).
+    callback_data разбирается один раз фильтром,
+    а обработчик выбирается по словарю CODE_HANDLERS.
+
+    Кассир определяется по отправителю нажатия (его подтверждает Telegram),
+    а не по полям callback_data: нажатия не кассиров игнорируются
+    """
+    staff = get_staff(callback.from_user.id)
+    if staff is None:
+        logger.warning("Кнопка кода от не кассира %s: %s", callback.from_user.id, callback.data)
+        return
+    handler = CODE_HANDLERS[(callback_data.kind, callback_data.action)]
+    await handler(callback, callback_data, bot, staff)
+
+
+@staff_router.callback_query(F.data.startswith(LEGACY_PREFIXES))
+async def handle_legacy_code_callback(callback: CallbackQuery, bot: Bot):
+    """
+    Обработчик кнопок старого формата (purchase_confirm:, spend_reject: и т.п.),
+    отправленных кассирам до перехода на CodeCallback
+    """
+    try:
+        callback_data = CodeCallback.from_legacy(callback.data)
+    except ValueError:
+        await callback.message.edit_text("❌ Не выйдет! 🕵️", reply_markup=None)
+        return
+    await handle_code_callback(callback, callback_data, bot)
+
+
+@staff_router.message(Command("mode"))
+async def cmd_mode(message: Message, command: CommandObject):
+    """
+    Обработчик команды /mode для кассира
+
+    `/mode` — показать режим работы с кодами в кафе кассира
+    `/mode push` — коды приходят в закреплённое сообщение с кнопками
+    `/mode pull` — кассир сам вводит код клиента (для загруженного кафе)
+    """
+    staff = get_staff(message.from_user.id)
+    if staff is None:
+        raise SkipHandler()
+
+    modes = "\n".join(f"<code>/mode {mode}</code> — {description}"
+                      for mode, description in CODE_MODES.items())
+    mode = (command.args or "").strip().lower()
+    if not mode:
+        current = cashier_queue.mode(staff.cafe_id)
+        await message.answer(f"Режим кафе: <b>{current}</b>\n\n{modes}")
         return
+    if mode not in CODE_MODES:
+        await message.answer(f"❌ Неизвестный режим\n\n{modes}")
+        return
+
+    await cashier_queue.set_mode(staff.cafe_id, mode)
+    await message.answer(f"✅ Режим кафе: <b>{mode}</b> — {CODE_MODES[mode]}")
+
+
+@staff_router.message(StateFilter(None), F.text.regexp(TYPED_CODE_RE).as_("match"))
+async def redeem_typed_code(message: Message, match: re.Match, bot: Bot):
+    """
+    Кассир ввёл код, который показал клиент (режим PULL, работает и в PUSH).
 
-    # Подключаемся к базе данных
-    with connect() as conn:
-        cur = conn.cursor()
-
-        # Находим пользователя, которому принадлежит этот код
-        cur.execute(f"SELECT user_id FROM {table} WHERE code = ?", (code,))
-        result = cur.fetchone() 
-        
-        # Если пользователь найден — отправляем ему уведомление
-        if result:
-            user_id = result[0] 
-            await bot.send_message(user_id, "❌ Кассир отменил операцию.")
-            
-            # Помечаем код как использованный
-            cur.execute(f"UPDATE {table} SET used = 1 WHERE code = ?", (code,))
-            conn.commit()
-    
-    await callback.message.edit_text(
-        "❌ Операция отменена",
-        reply_markup=None
-    )
\ No newline at end of file
+    Код ищется среди невыкупленных кодов кафе кассира — сначала в очереди
+    в памяти, затем по индексу в базе — и подтверждается одной транзакцией,
+    без рассылки сообщений другим кассирам:
+    - `123` для кода списания — списать его стоимость
+    - `123` для кода начисления — показать кнопки выбора баллов
+    - `123 14` — начислить 14 баллов
+    """
+    staff = get_staff(message.from_user.id)
+    if staff is None:
+        raise SkipHandler()
+
+    code, amount = match.group(1), match.group(2)
+    item = cashier_queue.find(staff.cafe_id, code) or find_pending_code(staff.cafe_id, code)
+    if item is None:
+        await message.reply(f"❌ Код {code} не найден среди невыкупленных кодов кафе")
+        return
+
+    await redeem_item(message, bot, staff, item, amount)
+
+
+@staff_router.message(CommandStart(deep_link=True, magic=F.args.startswith(tokens.START_PREFIX)))
+async def redeem_token(message: Message, command: CommandObject, bot: Bot):
+    """
+    Кассир отсканировал QR-код клиента (открыл ссылку /start r_<токен>).
+
+    Подпись и срок действия токена проверяются в памяти (tokens.verify),
+    клиент, кафе и сумма берутся из токена — поиска кода в базе нет,
+    база используется только для отметки кода использованным
+    """
+    staff = get_staff(message.from_user.id)
+    if staff is None:
+        await message.answer("Этот QR-код нужно показать кассиру 🙂")
+        return
+
+    try:
+        item = tokens.verify(command.args[len(tokens.START_PREFIX):])
+    except tokens.TokenError as e:
+        await message.answer(f"❌ {e}")
+        return
+    if item.cafe_id != staff.cafe_id:
+        await message.answer("❌ Код выдан для другого кафе")
+        return
+
+    await redeem_item(message, bot, staff, item)
+
+
+async def redeem_item(message: Message, bot: Bot, staff, item, amount=None):
+    """
+    Выкупает найденный код (введённый кассиром или из QR-кода):
+    - код списания — списывает его стоимость
+    - код начисления без баллов — показывает кнопки выбора баллов
+    - код начисления с баллами — начисляет их
+    """
+    if item.kind == CodeKind.spend.value:
+        text = await redeem_spend(bot, staff, item.code, item.code_id, item.amount)
+    elif amount is None:
+        await message.reply(f"Сколько баллов начислить по коду {item.code}?",
+                            reply_markup=get_queue_keyboard([item]))
+        return
+    else:
+        text = await redeem_purchase(bot, staff, item.code, item.code_id, int(amount))
+    await message.reply(text)
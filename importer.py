@@ -0,0 +1,287 @@
+"""
+Импорт клиентской базы и балансов из старой системы лояльности.
+
+Читает CSV потоково, проверяет строки и записывает их большими транзакциями
+через executemany. Для каждого клиента с ненулевым балансом в журнал (ledger)
+пишется запись начального остатка (reason = "opening").
+
+Прогресс сохраняется в таблицу import_jobs в той же транзакции, что и данные,
+поэтому после падения повторный запуск с тем же файлом продолжит с места остановки
+без дублей.
+
+Формат CSV (первая строка — заголовок):
+    user_id,username,full_name,points
+
+Запуск:
+    python importer.py legacy.csv [--batch-size 5000] [--delimiter ";"]
+"""
+
+import argparse
+import csv
+import hashlib
+import logging
+import time
+
+from database import connect, init_db, ADD_LEDGER_SQL
+
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ("user_id", "points")
+
+UPSERT_CLIENT_SQL = """
+    INSERT INTO clients (user_id, username, full_name, points)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        points = clients.points + excluded.points,
+        version = clients.version + 1,
+        username = COALESCE(NULLIF(clients.username, ''), excluded.username),
+        full_name = COALESCE(NULLIF(clients.full_name, ''), excluded.full_name)"""
+
+
+class ImportResult:
+    """Итог импорта одного файла"""
+
+    __slots__ = ("job_id", "imported", "rejected", "skipped", "seconds", "errors")
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.imported = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.seconds = 0.0
+        self.errors = []
+
+    @property
+    def rows_per_second(self):
+        return (self.imported + self.rejected) / self.seconds if self.seconds else 0.0
+
+
+def file_job_id(path):
+    """
+    Вычисляет идентификатор задачи импорта — SHA-256 содержимого файла.
+    Один и тот же файл всегда продолжает одну и ту же задачу.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ensure_import_table(cur):
+    """
+    Создаёт таблицу с прогрессом импорта, если её ещё нет
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            job_id TEXT PRIMARY KEY,
+            source TEXT,
+            rows_done INTEGER DEFAULT 0,
+            rows_imported INTEGER DEFAULT 0,
+            rows_rejected INTEGER DEFAULT 0,
+            started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT
+        )""")
+
+
+def validate_row(row):
+    """
+    Проверяет и нормализует строку CSV.
+
+    Args:
+        row (dict): Строка из csv.DictReader
+
+    Returns:
+        tuple: (user_id, username, full_name, points)
+
+    Raises:
+        ValueError: Если строка некорректна
+    """
+    try:
+        user_id = int(str(row.get("user_id", "")).strip())
+    except ValueError:
+        raise ValueError(f"некорректный user_id: {row.get('user_id')!r}")
+    if user_id <= 0:
+        raise ValueError(f"некорректный user_id: {user_id}")
+
+    try:
+        points = int(str(row.get("points", "")).strip() or 0)
+    except ValueError:
+        raise ValueError(f"некорректный баланс: {row.get('points')!r}")
+    if points < 0:
+        raise ValueError(f"отрицательный баланс: {points}")
+
+    username = (row.get("username") or "").strip().lstrip("@")
+    full_name = (row.get("full_name") or "").strip()
+    return user_id, username, full_name, points
+
+
+def import_csv(path, batch_size=5000, delimiter=",", progress=None, max_errors=100):
+    """
+    Импортирует клиентов и балансы из CSV-файла.
+
+    Функция блокирующая — из обработчиков её нужно вызывать
+    через asyncio.to_thread.
+
+    Args:
+        path (str): Путь к CSV-файлу
+        batch_size (int): Сколько строк записывать в одной транзакции
+        delimiter (str): Разделитель CSV
+        progress (callable): Вызывается после каждой транзакции
+                             как progress(rows_done, rows_per_second)
+        max_errors (int): Сколько сообщений об ошибках сохранять в результате
+
+    Returns:
+        ImportResult: Итог импорта
+    """
+    result = ImportResult(file_job_id(path))
+    started = time.perf_counter()
+
+    with connect() as conn, open(path, newline="", encoding="utf-8-sig") as f:
+        cur = conn.cursor()
+        ensure_import_table(cur)
+        cur.execute("INSERT OR IGNORE INTO import_jobs (job_id, source) VALUES (?, ?)",
+                    (result.job_id, str(path)))
+        cur.execute("SELECT rows_done, finished_at FROM import_jobs WHERE job_id = ?",
+                    (result.job_id,))
+        rows_done, finished_at = cur.fetchone()
+        conn.commit()
+
+        if finished_at:
+            logger.info("Файл %s уже импортирован (%s)", path, finished_at)
+            result.skipped = rows_done
+            return result
+
+        reader = csv.DictReader(f, delimiter=delimiter)
+        missing = [c for c in REQUIRED_COLUMNS if c not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"В CSV нет колонок: {', '.join(missing)}")
+
+        clients, ledger = [], []
+        batch_rejected = 0
+        line = 0
+        for row in reader:
+            line += 1
+            if line <= rows_done:
+                # Эти строки уже записаны до падения
+                result.skipped += 1
+                continue
+            try:
+                client = validate_row(row)
+            except ValueError as e:
+                batch_rejected += 1
+                if len(result.errors) < max_errors:
+                    result.errors.append(f"строка {line + 1}: {e}")
+            else:
+                clients.append(client)
+                if client[3]:
+                    ledger.append((client[0], None, None, client[3], "opening", None))
+
+            if line % batch_size == 0:
+                _write_batch(conn, cur, result, clients, ledger, batch_rejected, line)
+                clients, ledger = [], []
+                batch_rejected = 0
+                if progress:
+                    progress(line, _rate(line - rows_done, started))
+
+        _write_batch(conn, cur, result, clients, ledger, batch_rejected, line, finished=True)
+
+    result.seconds = time.perf_counter() - started
+    if progress:
+        progress(line, result.rows_per_second)
+    return result
+
+
+def _rate(rows, started):
+    elapsed = time.perf_counter() - started
+    return rows / elapsed if elapsed else 0.0
+
+
+def _write_batch(conn, cur, result, clients, ledger, rejected, rows_done, finished=False):
+    """
+    Записывает пачку клиентов, начальные остатки и прогресс одной транзакцией
+    """
+    if clients:
+        cur.executemany(UPSERT_CLIENT_SQL, clients)
+    if ledger:
+        cur.executemany(ADD_LEDGER_SQL, ledger)
+    cur.execute("""
+        UPDATE import_jobs
+        SET rows_done = ?,
+            rows_imported = rows_imported + ?,
+            rows_rejected = rows_rejected + ?,
+            finished_at = CASE WHEN ? THEN CURRENT_TIMESTAMP END
+        WHERE job_id = ?""",
+                (rows_done, len(clients), rejected, finished, result.job_id))
+    conn.commit()
+    result.imported += len(clients)
+    result.rejected += rejected
+
+
+def read_staff_csv(path, cafes, delimiter=","):
+    """
+    Читает CSV со списком кассиров для массовой загрузки.
+
+    Формат (первая строка — заголовок):
+        staff_id,cafe_id,username,full_name
+
+    Args:
+        path (str): Путь к CSV-файлу
+        cafes (dict): Конфиг точек (CAFES) для проверки cafe_id и названий
+        delimiter (str): Разделитель CSV
+
+    Returns:
+        tuple: (записи для upsert_staff_many, список ошибок)
+    """
+    rows, errors = {}, []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        missing = [c for c in ("staff_id", "cafe_id") if c not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"В CSV нет колонок: {', '.join(missing)}")
+
+        for line, row in enumerate(reader, start=2):
+            try:
+                staff_id = int(str(row["staff_id"]).strip())
+                cafe_id = int(str(row["cafe_id"]).strip())
+            except ValueError:
+                errors.append(f"строка {line}: некорректный staff_id или cafe_id")
+                continue
+            if cafe_id not in cafes:
+                errors.append(f"строка {line}: неизвестное кафе {cafe_id}")
+                continue
+            # Повторная строка с тем же staff_id перезаписывает предыдущую
+            rows[staff_id] = (
+                staff_id,
+                cafe_id,
+                cafes[cafe_id]["name"],
+                (row.get("username") or "").strip().lstrip("@"),
+                (row.get("full_name") or "").strip(),
+            )
+    return list(rows.values()), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт клиентов и балансов из CSV")
+    parser.add_argument("path", help="CSV-файл: user_id,username,full_name,points")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--delimiter", default=",")
+    args = parser.parse_args()
+
+    init_db()
+    result = import_csv(
+        args.path,
+        batch_size=args.batch_size,
+        delimiter=args.delimiter,
+        progress=lambda done, rate: print(f"  {done} строк, {rate:.0f} строк/с"),
+    )
+    for error in result.errors:
+        print(f"⚠️ {error}")
+    print(f"✅ Импортировано: {result.imported}, отклонено: {result.rejected}, "
+          f"пропущено (уже загружено): {result.skipped}, "
+          f"{result.rows_per_second:.0f} строк/с")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 
 def get_staff_management_menu():
@@ -9,6 +10,7 @@ def get_staff_management_menu():
     - Добавить кассира
     - Удалить кассира
     - Посмотреть список кассиров
+    - Загрузить кассиров списком из CSV
     - Вернуться в главное меню
 
     Returns:
@@ -16,6 +18,7 @@ def get_staff_management_menu():
             - ➕ Добавить кассира
             - ➖ Удалить кассира
             - 📋 Список кассиров
+            - 📥 Загрузить кассиров
             - ◀️ Главное меню
     """
     builder = ReplyKeyboardBuilder()
@@ -23,8 +26,9 @@ def get_staff_management_menu():
     builder.button(text="➕ Добавить кассира")
     builder.button(text="➖ Удалить кассира")
     builder.button(text="📋 Список кассиров")
+    builder.button(text="📥 Загрузить кассиров")
     builder.button(text="◀️ Главное меню")
-    builder.adjust(2, 1, 1)
+    builder.adjust(2, 2, 1)
     return builder.as_markup(resize_keyboard=True)
 
 
@@ -34,20 +38,106 @@ def get_staff_main_menu():
 
     Предоставляет доступ к следующим действиям:
     - Управление персоналом (добавление/удаление кассиров)
-    - Рассылка сообщений клиентам
-    - Просмотр статистики (в разработке)
+    - Рассылка сообщений клиентам по сегментам
+    - Просмотр статистики
+    - Выгрузка данных в файл
 
     Returns:
         ReplyKeyboardMarkup: Клавиатура с кнопками:
             - 👥 Управление персоналом
             - 📢 Рассылка
             - 📊 Статистика
+            - 📤 Выгрузка
     """
     builder = ReplyKeyboardBuilder()
 
     builder.button(text="👥 Управление персоналом")
     builder.button(text="📢 Рассылка")
     builder.button(text="📊 Статистика")
-    builder.adjust(2, 1)
+    builder.button(text="📤 Выгрузка")
+    builder.adjust(2, 2)
     return builder.as_markup(resize_keyboard=True)
 
+
+def get_staff_list_keyboard(offset: int, total: int, page_size: int):
+    """
+    Возвращает inline-клавиатуру для листания списка кассиров.
+
+    Смещение страницы хранится прямо в callback_data,
+    поэтому состояние между нажатиями не нужно.
+
+    Args:
+        offset (int): Смещение текущей страницы
+        total (int): Всего кассиров
+        page_size (int): Размер страницы
+
+    Returns:
+        InlineKeyboardMarkup or None: Клавиатура с кнопками:
+            - ◀️ (callback_data="staff_page:{offset - page_size}")
+            - ▶️ (callback_data="staff_page:{offset + page_size}")
+            None, если весь список помещается на одной странице
+    """
+    builder = InlineKeyboardBuilder()
+    if offset > 0:
+        builder.button(text="◀️", callback_data=f"staff_page:{max(offset - page_size, 0)}")
+    if offset + page_size < total:
+        builder.button(text="▶️", callback_data=f"staff_page:{offset + page_size}")
+    if not list(builder.buttons):
+        return None
+    builder.adjust(2)
+    return builder.as_markup()
+
+
+def get_stats_keyboard(current: str):
+    """
+    Возвращает inline-клавиатуру выбора отчёта статистики.
+
+    Args:
+        current (str): Отчёт, который показан сейчас (его кнопка помечается)
+
+    Returns:
+        InlineKeyboardMarkup: Клавиатура с кнопками отчётов
+            (callback_data="stats:{название отчёта}")
+    """
+    builder = InlineKeyboardBuilder()
+    for name, label in (("overview", "📊 Общая"), ("cafes", "📈 По кафе"),
+                        ("top", "🏆 Клиенты"), ("cashiers", "🧾 Кассиры")):
+        builder.button(text=f"• {label}" if name == current else label,
+                       callback_data=f"stats:{name}")
+    builder.adjust(2, 2)
+    return builder.as_markup()
+
+
+def get_mailing_keyboard(segments: dict, counts: dict):
+    """
+    Возвращает inline-клавиатуру выбора сегмента для рассылки.
+
+    Args:
+        segments (dict[str, str]): Названия сегментов по ключу
+        counts (dict[str, int]): Количество клиентов в сегментах
+
+    Returns:
+        InlineKeyboardMarkup: Клавиатура с кнопками:
+            - по кнопке на каждый непустой сегмент (callback_data="mail:{сегмент}")
+            - 🔄 Пересчитать сегменты (callback_data="mail_refresh")
+    """
+    builder = InlineKeyboardBuilder()
+    for segment, title in segments.items():
+        if counts.get(segment):
+            builder.button(text=f"{title} ({counts[segment]})", callback_data=f"mail:{segment}")
+    builder.button(text="🔄 Пересчитать сегменты", callback_data="mail_refresh")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def get_mailing_cancel_keyboard():
+    """
+    Возвращает inline-клавиатуру с кнопкой отмены рассылки
+
+    Returns:
+        InlineKeyboardMarkup: Клавиатура с кнопкой:
+            - ❌ Отмена (callback_data="mail_cancel")
+    """
+    builder = InlineKeyboardBuilder()
+    builder.button(text="❌ Отмена", callback_data="mail_cancel")
+    return builder.as_markup()
@@ -0,0 +1,120 @@
+import re
+from enum import Enum
+
+from aiogram.filters.callback_data import CallbackData
+
+
+class CodeKind(str, Enum):
+    """Тип кода: начисление или списание баллов"""
+    purchase = "p"
+    spend = "s"
+
+
+class CodeAction(str, Enum):
+    """Действие кассира с кодом"""
+    confirm = "c"
+    reject = "r"
+
+
+def to_base36(number: int) -> str:
+    """Компактно кодирует неотрицательное число в base36 (0-9a-z)"""
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    if number == 0:
+        return "0"
+    result = []
+    while number:
+        number, rest = divmod(number, 36)
+        result.append(digits[rest])
+    return "".join(reversed(result))
+
+
+class CodeCallback(CallbackData, prefix="k1"):
+    """
+    callback_data кнопок кассира для кодов начисления и списания.
+
+    Формат: `k1:{kind}:{action}:{code}:{amount}:{cafe}:{nonce}`,
+    например `k1:p:c:123:14:1:2s` — около 20 байт из 64 доступных.
+    Префикс содержит версию формата: при изменении полей
+    нужно завести новый класс с префиксом `k2`, а старые кнопки
+    в чатах продолжат разбираться этим.
+
+    Поля:
+        kind: начисление (p) или списание (s)
+        action: подтвердить (c) или отменить (r)
+        code: код, который видит клиент
+        amount: баллы к начислению или стоимость списания
+        cafe: ID кафе
+        nonce: ID записи кода в базе (base36) — точно указывает
+               на конкретную выдачу, даже если короткий код повторится
+
+    callback_data присылает клиент Telegram, поэтому её поля не проверены:
+    баллы, кафе и стоимость сверяются при подтверждении (staff_handlers).
+    Поля кассира нет: нажавший кассир — это callback.from_user,
+    его подтверждает Telegram, а поле в callback_data можно подделать.
+    """
+
+    kind: CodeKind
+    action: CodeAction
+    code: str
+    amount: int = 0
+    cafe: int = 0
+    nonce: str = ""
+
+    @classmethod
+    def unpack(cls, value: str) -> "CodeCallback":
+        """
+        Разбирает callback_data одним предкомпилированным регулярным выражением
+        (без поэлементной проверки pydantic)
+
+        Raises:
+            ValueError: Если строка не в формате k1
+        """
+        match = _CODE_CALLBACK_RE.fullmatch(value)
+        if match is None:
+            raise ValueError(f"Bad callback data {value!r}")
+        kind, action, code, amount, cafe, nonce = match.groups()
+        return cls.model_construct(
+            kind=CodeKind(kind),
+            action=CodeAction(action),
+            code=code,
+            amount=int(amount),
+            cafe=int(cafe),
+            nonce=nonce,
+        )
+
+    @property
+    def code_id(self) -> int:
+        """ID записи кода в базе (0, если неизвестен)"""
+        return int(self.nonce, 36) if self.nonce else 0
+
+    @classmethod
+    def from_legacy(cls, value: str) -> "CodeCallback":
+        """
+        Разбирает callback_data старого формата
+        (`purchase_confirm:{code}:{points}`, `spend_reject:{code}` и т.п.),
+        чтобы кнопки, отправленные до обновления, продолжали работать.
+
+        Raises:
+            ValueError: Если строка не в старом формате
+        """
+        match = _LEGACY_RE.fullmatch(value)
+        if match is None:
+            raise ValueError(f"Bad legacy callback data {value!r}")
+        kind, action, code, amount = match.groups()
+        return cls.model_construct(
+            kind=CodeKind.purchase if kind == "purchase" else CodeKind.spend,
+            action=CodeAction.confirm if action == "confirm" else CodeAction.reject,
+            code=code,
+            amount=int(amount or 0),
+            cafe=0,
+            nonce="",
+        )
+
+
+_CODE_CALLBACK_RE = re.compile(
+    re.escape(CodeCallback.__prefix__) + r":([ps]):([cr]):(\d{1,8}):(\d{1,6}):(\d{1,6}):([0-9a-z]{0,12})"
+)
+
+_LEGACY_RE = re.compile(r"(purchase|spend)_(confirm|reject):(\d{1,8})(?::(\d{1,6}))?")
+
+LEGACY_PREFIXES = ("purchase_confirm:", "purchase_reject:", "spend_confirm:", "spend_reject:")
@@ -1,52 +1,53 @@
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from keyboards.callbacks import CodeCallback, CodeKind, CodeAction, to_base36
 
-def get_confirmation_keyboard_for_purchase(code: str):
-    """
-    Возвращает inline-клавиатуру для кассира с вариантами начисления баллов клиенту.
-
-    Используется при подтверждении покупки по коду.
-    
-    Args:
-        code (str): Код начисления баллов, который будет использоваться в callback_data
 
-    Returns:
-        InlineKeyboardMarkup: Клавиатура с кнопками:
-            - 7️⃣ +7 баллов (callback_data="purchase_confirm:{code}:7")
-            - 1️⃣4️⃣ +14 баллов (callback_data="purchase_confirm:{code}:14")
-            - 2️⃣1️⃣ +21 баллов (callback_data="purchase_confirm:{code}:21")
-            - ❌ Отменить (callback_data="purchase_reject:{code}")
-    """
-    builder = InlineKeyboardBuilder()
-    builder.button(text="7️⃣ +7 баллов", callback_data=f"purchase_confirm:{code}:7")
-    builder.button(text="1️⃣4️⃣ +14 баллов", callback_data=f"purchase_confirm:{code}:14")
-    builder.button(text="2️⃣1️⃣ +21 баллов", callback_data=f"purchase_confirm:{code}:21")
-    builder.button(text="❌ Отменить", callback_data=f"purchase_reject:{code}")
-    builder.adjust(2, 1)
-    return builder.as_markup()
+# Баллы, которые кассир может начислить по коду
+PURCHASE_POINTS = (7, 14, 21)
 
 
-def get_confirmation_keyboard_for_spend(code: str, cost: int):
+def get_queue_keyboard(items):
     """
-    Возвращает inline-клавиатуру для кассира с подтверждением или отменой списания баллов.
+    Возвращает inline-клавиатуру очереди кодов кассира:
+    по одной строке кнопок на каждый невыкупленный код.
 
     Args:
-        code (str): Код списания баллов
-        cost (int): Количество баллов, которые будут списаны
+        items (list[PendingCode]): Коды очереди (см. repository.PendingCode)
 
     Returns:
-        InlineKeyboardMarkup: Клавиатура с кнопками:
-            - ✅ Подтвердить {cost} баллов (callback_data="spend_confirm:{code}:{cost}")
-            - ❌ Отменить (callback_data="spend_reject:{code}")
+        InlineKeyboardMarkup or None: Клавиатура с кнопками (callback_data — CodeCallback):
+            - для начисления: ✅ {code} +7 | +14 | +21 | ❌ (k1:p:c:{code}:{баллы}:..., k1:p:r:...)
+            - для списания: ✅ {code} −{cost} | ❌ (k1:s:c:{code}:{cost}:..., k1:s:r:...)
+            None, если очередь пуста
     """
+    if not items:
+        return None
+
     builder = InlineKeyboardBuilder()
-    builder.button(
-        text=f"✅ Подтвердить {cost} баллов",
-        callback_data=f"spend_confirm:{code}:{cost}"
-    )
-    builder.button(
-        text="❌ Отменить",
-        callback_data=f"spend_reject:{code}"
-    )
-    builder.adjust(1)
+    sizes = []
+    for item in items:
+        kind = CodeKind(item.kind)
+        nonce = to_base36(item.code_id) if item.code_id else ""
+        cafe = item.cafe_id or 0
+        if kind is CodeKind.purchase:
+            for i, points in enumerate(PURCHASE_POINTS):
+                builder.button(
+                    text=f"✅ {item.code} +{points}" if i == 0 else f"+{points}",
+                    callback_data=CodeCallback(kind=kind, action=CodeAction.confirm,
+                                               code=item.code, amount=points, cafe=cafe, nonce=nonce)
+                )
+        else:
+            builder.button(
+                text=f"✅ {item.code} −{item.amount}",
+                callback_data=CodeCallback(kind=kind, action=CodeAction.confirm,
+                                           code=item.code, amount=item.amount, cafe=cafe, nonce=nonce)
+            )
+        builder.button(
+            text="❌",
+            callback_data=CodeCallback(kind=kind, action=CodeAction.reject,
+                                       code=item.code, amount=item.amount, cafe=cafe, nonce=nonce)
+        )
+        sizes.append(len(PURCHASE_POINTS) + 1 if kind is CodeKind.purchase else 2)
+    builder.adjust(*sizes)
     return builder.as_markup()
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+
+from database import ADD_CLIENT_SQL, UPDATE_CLIENT_NAMES_SQL, iter_client_names
+from write_queue import write_queue
+from client_cache import client_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+def _fingerprint(username, full_name):
+    return hash((username or '', full_name or ''))
+
+
+class KnownUsers:
+    """
+    Множество уже зарегистрированных клиентов в памяти.
+
+    Для каждого user_id хранится только отпечаток (hash) пары username/full_name,
+    поэтому повторный /start не пишет в базу вовсе.
+    Новые клиенты сразу добавляются через очередь записи,
+    а изменившиеся имена копятся и сбрасываются в базу пачками.
+
+    Если пользователя нет в памяти, запись всё равно идёт через
+    INSERT OR IGNORE — база остаётся источником истины.
+    """
+
+    def __init__(self, flush_interval=5.0, flush_batch=500):
+        """
+        Args:
+            flush_interval (float): Как часто (сек) сбрасывать изменённые имена
+            flush_batch (int): Сколько изменений накопить для внеочередного сброса
+        """
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._fingerprints = {}
+        self._pending = {}
+        self._flusher = None
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    def __contains__(self, user_id):
+        return user_id in self._fingerprints
+
+    def load(self):
+        """
+        Загружает отпечатки всех клиентов из базы (вызывается при старте бота)
+        """
+        self._fingerprints = {
+            user_id: _fingerprint(username, full_name)
+            for user_id, username, full_name in iter_client_names()
+        }
+        logger.info("Загружено %d известных клиентов", len(self._fingerprints))
+
+    async def register(self, user_id, username, full_name):
+        """
+        Регистрирует клиента при /start, избегая лишних записей в базу.
+
+        Args:
+            user_id (int): Telegram ID клиента
+            username (str): Никнейм клиента
+            full_name (str): Полное имя клиента
+
+        Returns:
+            bool: True, если клиент новый и был добавлен в базу
+        """
+        fingerprint = _fingerprint(username, full_name)
+        known = self._fingerprints.get(user_id)
+
+        if known is None:
+            await write_queue.execute(ADD_CLIENT_SQL, (user_id, username, full_name))
+            self._fingerprints[user_id] = fingerprint
+            return True
+
+        if known != fingerprint:
+            self._fingerprints[user_id] = fingerprint
+            self._pending[user_id] = (username, full_name)
+            client_cache.apply_names(user_id, username, full_name)
+            if len(self._pending) >= self.flush_batch:
+                await self.flush()
+        return False
+
+    async def flush(self):
+        """
+        Сбрасывает накопленные изменения имён в базу одним executemany
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            rows = [(username, full_name, user_id)
+                    for user_id, (username, full_name) in pending.items()]
+            try:
+                await write_queue.executemany(UPDATE_CLIENT_NAMES_SQL, rows)
+            except Exception:
+                # Возвращаем изменения в очередь, не затирая более свежие
+                for user_id, names in pending.items():
+                    self._pending.setdefault(user_id, names)
+                raise
+            logger.debug("Обновлены имена %d клиентов", len(rows))
+
+    def start(self):
+        """
+        Запускает периодический сброс изменённых имён
+        """
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run(), name="known-users-flush")
+
+    async def stop(self):
+        """
+        Останавливает периодический сброс и дописывает оставшиеся изменения
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка сброса имён клиентов: %r", e)
+
+
+known_users = KnownUsers()
@@ -0,0 +1,227 @@
+"""
+Остановка и перезапуск бота без потери апдейтов и без их повторной обработки.
+
+Остановка (SIGTERM/SIGINT, см. main.on_shutdown):
+1. aiogram перестаёт запрашивать новые апдейты
+2. бот дожидается обработчиков уже полученных апдейтов (с общим дедлайном),
+   фоновых задач и уведомлений кассирам
+3. подтверждает Telegram offset (ID последнего полученного апдейта + 1),
+   чтобы эти апдейты не пришли ещё раз; если подтвердить не удалось —
+   сохраняет offset в базу
+4. дописывает очередь записи и переносит WAL в основной файл базы
+
+Один экземпляр бота на базу обеспечивает блокировка файла `cafe.db.lock`
+(flock). Перезапуск без простоя:
+    python main.py --handoff
+Новый процесс заранее импортирует модули и подключается к Bot API,
+затем отправляет старому SIGTERM и, как только старый отпустил блокировку
+(сразу после подтверждения offset), выполняет миграции базы и начинает опрос.
+Апдейты, пришедшие за время передачи, ждут в Telegram и не теряются.
+Если подтвердить offset не удалось, следующий экземпляр пропускает апдейты
+с ID меньше сохранённого — но только до первого принятого апдейта и только
+если offset сохранён не раньше OFFSET_TTL_MINUTES назад: после недели без
+апдейтов Telegram может начать нумерацию заново с меньшего ID.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: блокировки экземпляра нет
+
+from config import SHUTDOWN_TIMEOUT
+from database import DB_NAME, SET_BOT_STATE_SQL, DELETE_BOT_STATE_SQL
+from maintenance import checkpoint
+from repository import get_bot_state
+from write_queue import write_queue
+
+
+logger = logging.getLogger(__name__)
+
+OFFSET_KEY = "update_offset"
+
+# Сохранённый offset старше этого не применяется: он нужен только при перезапуске
+OFFSET_TTL_MINUTES = 60
+LOCK_FILE = DB_NAME + ".lock"
+
+
+class InstanceLockError(RuntimeError):
+    """С этой базой уже работает другой экземпляр бота"""
+
+
+class Lifecycle:
+    """
+    Учёт обрабатываемых апдейтов, offset и блокировка экземпляра бота.
+    """
+
+    def __init__(self, lock_path=LOCK_FILE, shutdown_timeout=SHUTDOWN_TIMEOUT):
+        """
+        Args:
+            lock_path (str): Файл блокировки экземпляра
+            shutdown_timeout (float): Сколько секунд остановка ждёт обработчики и задачи
+        """
+        self.lock_path = lock_path
+        self.shutdown_timeout = shutdown_timeout
+        self.in_flight = 0
+        self.last_update_id = None
+        self.offset = 0
+        self.skipped = 0
+        self._deadline = None
+        self._idle = None
+        self._lock_file = None
+
+    # --- Апдейты ---
+
+    def load_offset(self):
+        """Загружает offset, сохранённый предыдущим экземпляром (если он свежий)"""
+        self.offset = int(get_bot_state(OFFSET_KEY, OFFSET_TTL_MINUTES) or 0)
+
+    def begin(self, update_id):
+        """
+        Апдейт начал обрабатываться
+
+        Returns:
+            bool: False, если апдейт уже обработан предыдущим экземпляром
+        """
+        if update_id < self.offset:
+            self.skipped += 1
+            return False
+        # Апдейты приходят по возрастанию ID: после первого принятого
+        # старые уже не придут, а меньший ID означает новую нумерацию
+        self.offset = 0
+        self.in_flight += 1
+        if self.last_update_id is None or update_id > self.last_update_id:
+            self.last_update_id = update_id
+        return True
+
+    def end(self):
+        """Обработка апдейта завершена (успешно или с ошибкой)"""
+        self.in_flight -= 1
+        if not self.in_flight and self._idle is not None and not self._idle.done():
+            self._idle.set_result(None)
+
+    def remaining(self):
+        """Сколько секунд осталось до дедлайна остановки (не меньше секунды)"""
+        if self._deadline is None:
+            return self.shutdown_timeout
+        return max(1.0, self._deadline - time.monotonic())
+
+    async def drain(self):
+        """
+        Начинает остановку: ждёт обработчики полученных апдейтов до дедлайна
+
+        Returns:
+            int: Сколько обработчиков не успело завершиться
+        """
+        self._deadline = time.monotonic() + self.shutdown_timeout
+        if self.in_flight:
+            logger.info("Остановка: ждём %d обработчиков", self.in_flight)
+            self._idle = asyncio.get_running_loop().create_future()
+            await asyncio.wait((self._idle,), timeout=self.shutdown_timeout)
+            if self.in_flight:
+                logger.warning("Остановка: %d обработчиков не завершились за %s с",
+                               self.in_flight, self.shutdown_timeout)
+        return self.in_flight
+
+    async def save_offset(self, bot):
+        """
+        Подтверждает полученные апдейты Telegram (иначе последняя пачка
+        апдейтов придёт следующему экземпляру ещё раз).
+        Если подтвердить не удалось — сохраняет offset в базу,
+        иначе удаляет сохранённый ранее
+        """
+        if self.last_update_id is None:
+            return
+        offset = self.last_update_id + 1
+        try:
+            await bot.get_updates(offset=offset, limit=1, timeout=0)
+        except Exception as e:
+            logger.warning("Не удалось подтвердить offset %s, сохраняем его в базу: %r", offset, e)
+            await write_queue.execute(SET_BOT_STATE_SQL, (OFFSET_KEY, str(offset)))
+            return
+        await write_queue.execute(DELETE_BOT_STATE_SQL, (OFFSET_KEY,))
+        logger.info("Offset %s подтверждён", offset)
+
+    async def checkpoint(self):
+        """Переносит WAL в основной файл базы (после остановки очереди записи)"""
+        try:
+            result = await asyncio.to_thread(checkpoint, "TRUNCATE")
+        except Exception as e:
+            logger.warning("WAL checkpoint при остановке не выполнен: %r", e)
+            return
+        logger.info("WAL checkpoint при остановке: %s", result)
+
+    # --- Экземпляр ---
+
+    async def acquire(self, handoff=False):
+        """
+        Захватывает блокировку экземпляра.
+
+        Args:
+            handoff (bool): Остановить работающий экземпляр и дождаться его блокировки
+
+        Raises:
+            InstanceLockError: Если бот уже запущен (без handoff)
+                               или не остановился вовремя (с handoff)
+        """
+        if fcntl is None:
+            logger.warning("Блокировка экземпляра недоступна на этой платформе")
+            return
+        self._lock_file = open(self.lock_path, "a+")
+        if self._try_lock():
+            return
+
+        pid = self._read_pid()
+        if not handoff:
+            self._close()
+            raise InstanceLockError(f"Бот уже запущен (PID {pid}). "
+                                    "Перезапуск без простоя: python main.py --handoff")
+        logger.info("Передача опроса: останавливаем экземпляр PID %s", pid)
+        if pid:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.shutdown_timeout + 15
+        while not self._try_lock():
+            if time.monotonic() > deadline:
+                self._close()
+                raise InstanceLockError(f"Экземпляр PID {pid} не остановился вовремя")
+            await asyncio.sleep(0.05)
+        logger.info("Передача опроса: блокировка получена")
+
+    def release(self):
+        """Отпускает блокировку экземпляра (файл не удаляется)"""
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._close()
+
+    def _try_lock(self):
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self._lock_file.seek(0)
+        self._lock_file.truncate()
+        self._lock_file.write(str(os.getpid()))
+        self._lock_file.flush()
+        return True
+
+    def _read_pid(self):
+        self._lock_file.seek(0)
+        try:
+            return int(self._lock_file.read().strip() or 0)
+        except ValueError:
+            return 0
+
+    def _close(self):
+        self._lock_file.close()
+        self._lock_file = None
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,271 @@
+"""
+Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Реализует методы, которыми пользуется бот: getUpdates (long polling),
+sendMessage, editMessageText, answerCallbackQuery, а также служебные
+getMe, deleteWebhook, pinChatMessage, sendPhoto, sendDocument.
+Ответы можно замедлять (latency ± jitter), часть запросов —
+отклонять ошибкой 400 или 429 (Too Many Requests с retry_after).
+
+Генератор нагрузки кладёт апдейты через push_update()
+и ждёт ответов бота через expect() — заранее, до отправки апдейта.
+
+Запуск отдельно (бот подключается к нему через TelegramAPIServer):
+    python loadtest/fake_bot_api.py --port 8081 --latency 0.03 --rate-429 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Fake", "username": "fake_bonus_bot"}
+
+# Поля, которые aiogram передаёт JSON-строкой в multipart-запросе
+JSON_FIELDS = frozenset(("reply_markup", "entities", "caption_entities", "allowed_updates"))
+
+# Методы, к которым применяются задержка и ошибки (служебные всегда отвечают сразу)
+OUTGOING_METHODS = frozenset((
+    "sendmessage", "editmessagetext", "answercallbackquery",
+    "pinchatmessage", "sendphoto", "senddocument",
+))
+
+
+class FakeBotAPI:
+    """
+    Сервер, отвечающий как Bot API, с настраиваемыми задержками и ошибками.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_429=0.0, retry_after=1,
+                 seed=None):
+        """
+        Args:
+            latency (float): Средняя задержка ответа на исходящие методы (сек)
+            jitter (float): Случайное отклонение задержки (± сек)
+            error_rate (float): Доля исходящих запросов, отклоняемых ошибкой 400
+            rate_429 (float): Доля исходящих запросов, отклоняемых ошибкой 429
+            retry_after (int): retry_after в ответах 429 (сек)
+            seed (int): Seed генератора случайных чисел (для повторяемости)
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+        self.calls = Counter()
+        self.errors = Counter()
+        self.delivered = 0
+        self._updates = []
+        self._update_id = 0
+        self._new_updates = asyncio.Event()
+        self._message_id = 0
+        self._waiters = defaultdict(list)
+        self._runner = None
+
+    # --- Генератор нагрузки ---
+
+    def push_update(self, update):
+        """
+        Кладёт апдейт в очередь getUpdates.
+
+        Args:
+            update (dict): Апдейт без update_id (например, {"message": {...}})
+
+        Returns:
+            int: Присвоенный update_id
+        """
+        self._update_id += 1
+        update = dict(update, update_id=self._update_id)
+        self._updates.append(update)
+        self._new_updates.set()
+        return self._update_id
+
+    def next_message_id(self):
+        self._message_id += 1
+        return self._message_id
+
+    def expect(self, chat_id, predicate):
+        """
+        Регистрирует ожидание ответа бота в чат.
+
+        Ожидание нужно регистрировать до отправки апдейта,
+        иначе быстрый ответ может прийти раньше.
+
+        Args:
+            chat_id (int): Чат
+            predicate (callable): Проверка параметров вызова (dict) -> bool
+
+        Returns:
+            asyncio.Future: Параметры первого подходящего сообщения в чат
+                            (с message_id отправленного или изменённого сообщения)
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((predicate, future))
+        return future
+
+    def stats(self):
+        """Сколько вызовов каждого метода получено и сколько ошибок отдано"""
+        return {
+            "calls": dict(self.calls),
+            "errors": dict(self.errors),
+            "updates_pushed": self._update_id,
+            "updates_delivered": self.delivered,
+        }
+
+    # --- Сервер ---
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        Запускает сервер.
+
+        Returns:
+            str: Базовый адрес сервера (для TelegramAPIServer.from_base)
+        """
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        method = request.match_info["method"].lower()
+        params = await _read_params(request)
+        self.calls[method] += 1
+
+        if method in OUTGOING_METHODS:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            roll = self.random.random()
+            if roll < self.rate_429:
+                self.errors["429"] += 1
+                return _error(429, f"Too Many Requests: retry after {self.retry_after}",
+                              parameters={"retry_after": self.retry_after})
+            if roll < self.rate_429 + self.error_rate:
+                self.errors["400"] += 1
+                return _error(400, "Bad Request: injected error")
+
+        handler = getattr(self, f"_api_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _api_getupdates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        if offset:
+            # Подтверждённые апдейты больше не нужны
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+
+        deadline = time.monotonic() + timeout
+        while not self._updates:
+            self._new_updates.clear()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), remaining)
+            except asyncio.TimeoutError:
+                return []
+        batch = self._updates[:limit]
+        self.delivered += len(batch)
+        return batch
+
+    async def _api_getme(self, params):
+        return BOT_USER
+
+    async def _api_sendmessage(self, params):
+        return self._message(params, self.next_message_id())
+
+    async def _api_sendphoto(self, params):
+        return self._message(params, self.next_message_id())
+
+    async def _api_senddocument(self, params):
+        return self._message(params, self.next_message_id())
+
+    async def _api_editmessagetext(self, params):
+        return self._message(params, int(params.get("message_id") or 0))
+
+    def _message(self, params, message_id):
+        chat_id = int(params.get("chat_id") or 0)
+        self._notify(chat_id, dict(params, message_id=message_id))
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text") or params.get("caption") or "",
+        }
+
+    def _notify(self, chat_id, params):
+        waiters = self._waiters.get(chat_id)
+        if not waiters:
+            return
+        for i, (predicate, future) in enumerate(waiters):
+            if future.done():
+                continue
+            if predicate(params):
+                future.set_result(params)
+                del waiters[i]
+                break
+        # Отменённые по таймауту ожидания больше не нужны
+        waiters[:] = [w for w in waiters if not w[1].done()]
+
+
+async def _read_params(request):
+    if request.content_type == "application/json":
+        return await request.json()
+    params = {}
+    for key, value in (await request.post()).items():
+        params[key] = json.loads(value) if key in JSON_FIELDS and isinstance(value, str) else value
+    return params
+
+
+def _error(code, description, **extra):
+    return web.json_response({"ok": False, "error_code": code, "description": description, **extra})
+
+
+async def _serve(args):
+    api = FakeBotAPI(args.latency, args.jitter, args.error_rate, args.rate_429, args.retry_after)
+    base = await api.start(args.host, args.port)
+    print(f"Fake Bot API: {base}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(api.stats())
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    asyncio.run(_serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Воспроизведение записанных апдейтов (middlewares/capture.py) через Dispatcher.
+
+Апдейты из файлов записи подаются в тот же Dispatcher, что и в боте
+(create_dispatcher), на копии базы; исходящие запросы уходят
+в loadtest/fake_bot_api.py. Скорость:
+- --speed 1 — с исходными паузами между апдейтами
+- --speed 10 — в 10 раз быстрее
+- --speed 0 — без пауз, строго по одному апдейту (детерминированный порядок)
+
+ADMIN_ID берётся из заголовка записи (псевдоним). Если передан --key
+(CAPTURE_KEY, с которым велась запись), ID клиентов и кассиров в копии
+базы заменяются теми же псевдонимами, и кассиры остаются кассирами.
+
+Отчёт (пропускная способность, задержки обработки, ошибки) можно
+сохранить в JSON (--report) и сравнить между версиями бота.
+
+Запуск (из корня репозитория):
+    python loadtest/replay.py capture/updates-20260101.jsonl.gz --db cafe.db --key "$CAPTURE_KEY" --speed 0
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Таблицы и колонки с Telegram ID, которые псевдонимизируются в копии базы
+ID_COLUMNS = {
+    "clients": ("user_id",),
+    "staff": ("staff_id",),
+    "purchase_codes": ("user_id",),
+    "spend_codes": ("user_id",),
+    "ledger": ("user_id", "staff_id"),
+    "client_segments": ("user_id",),
+    "cashier_dashboards": ("staff_id",),
+}
+
+
+def read_capture(paths):
+    """
+    Читает файлы записи по порядку.
+
+    Время каждого запуска бота отсчитывается заново, поэтому записи
+    склеиваются: паузы между запусками выбрасываются.
+
+    Returns:
+        tuple: (псевдоним ADMIN_ID или None, список (t, апдейт))
+    """
+    admin = None
+    records = []
+    offset = last = 0.0
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                item = json.loads(line)
+                if "capture" in item:
+                    admin = item.get("admin", admin)
+                    offset, last = last, None
+                    continue
+                if last is None:
+                    # Первый апдейт запуска идёт сразу за последним апдейтом предыдущего
+                    offset -= item["t"]
+                last = offset + item["t"]
+                records.append((last, item["update"]))
+    if records:
+        start = records[0][0]
+        records = [(t - start, update) for t, update in records]
+    return admin, records
+
+
+def copy_db(source, target, key):
+    """Копирует базу (backup API) и при заданном ключе псевдонимизирует ID"""
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+    if key is None:
+        return
+    from middlewares.capture import pseudonym_id
+
+    with sqlite3.connect(target) as conn:
+        conn.create_function("pseudonym", 1, lambda value: pseudonym_id(value, key),
+                             deterministic=True)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table, columns in ID_COLUMNS.items():
+            if table in tables:
+                sets = ", ".join(f"{column} = pseudonym({column})" for column in columns)
+                conn.execute(f"UPDATE {table} SET {sets}")
+        conn.commit()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def replay(records, speed):
+    """
+    Подаёт апдейты в Dispatcher и замеряет время обработки каждого.
+
+    Returns:
+        dict: Отчёт
+    """
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+    from aiogram.types import Update
+
+    from background import background_tasks
+    from lifecycle import lifecycle
+    from database import init_db
+    from main import create_dispatcher
+    from fake_bot_api import FakeBotAPI
+
+    init_db()
+    api = FakeBotAPI()
+    base = await api.start()
+    bot = Bot("42:replay", session=AiohttpSession(api=TelegramAPIServer.from_base(base)),
+              default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    dp = create_dispatcher()
+    await dp.emit_startup(bot=bot)
+    # ID апдейтов записи меньше offset, сохранённого ботом в копии базы
+    lifecycle.offset = 0
+
+    latency = defaultdict(list)
+    errors = Counter()
+
+    async def feed(data):
+        update = Update.model_validate(data, context={"bot": bot})
+        kind = update.event_type
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        latency[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    tasks = []
+    for t, data in records:
+        if speed > 0:
+            delay = started + t / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(feed(data)))
+        else:
+            await feed(data)
+    await asyncio.gather(*tasks)
+    await background_tasks.drain()
+    elapsed = time.perf_counter() - started
+
+    await dp.emit_shutdown(bot=bot)
+    await bot.session.close()
+    await api.stop()
+
+    report = {
+        "updates": len(records),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(records) / elapsed, 1) if elapsed else 0,
+        "errors": dict(errors),
+        "api_calls": dict(api.calls),
+        "latency_ms": {},
+    }
+    for kind, values in sorted(latency.items()):
+        values.sort()
+        report["latency_ms"][kind] = {
+            "n": len(values),
+            **{name: round(percentile(values, q) * 1000, 2)
+               for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+            "max": round(values[-1] * 1000, 2),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"Апдейтов: {report['updates']} за {report['seconds']} с "
+          f"({report['updates_per_second']}/с), ошибок: {sum(report['errors'].values())}")
+    print(f"{'тип':<16} {'n':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for kind, row in report["latency_ms"].items():
+        print(f"{kind:<16} {row['n']:>7} " + " ".join(
+            f"{row[name]:>7.1f}мс" for name in ("p50", "p95", "p99", "max")))
+    print(f"вызовы API: {report['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("captures", nargs="+", help="файлы записи по порядку")
+    parser.add_argument("--db", help="база, копия которой используется (по умолчанию — пустая)")
+    parser.add_argument("--key", default=os.getenv("CAPTURE_KEY"), help="ключ псевдонимизации записи")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 — исходная скорость, 0 — без пауз")
+    parser.add_argument("--limit", type=int, default=None, help="воспроизвести только первые N апдейтов")
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора кодов")
+    parser.add_argument("--report", help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    admin, records = read_capture(args.captures)
+    records = records[:args.limit]
+    # Админ в записи — псевдоним; config читает ADMIN_ID при импорте
+    os.environ["ADMIN_ID"] = str(admin or 1)
+    os.environ.setdefault("BOT_TOKEN", "42:replay")
+    os.environ.pop("CAPTURE_DIR", None)
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix="bonuslink-replay-") as tmp:
+        if args.db:
+            copy_db(args.db, os.path.join(tmp, "cafe.db"), args.key.encode() if args.key else None)
+        # База бота — cafe.db в текущей папке
+        os.chdir(tmp)
+        random.seed(args.seed)
+        report = asyncio.run(replay(records, args.speed))
+
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Нагрузочный (soak) тест всего бота на локальном фейковом Bot API.
+
+Бот запускается целиком, отдельным процессом `python main.py`
+(polling, middleware, роутеры, SQLite во временной папке, исходящие
+запросы через aiohttp) с TELEGRAM_API_URL, указывающим на
+loadtest/fake_bot_api.py в этом процессе. Тысячи клиентов проходят
+настоящие сценарии (получить код на начисление, код на списание),
+кассиры вводят их коды.
+
+В конце печатается:
+- пропускная способность (апдейтов в секунду) и число сценариев
+- задержка ответа бота по шагам (p50/p95/p99/max) и таймауты
+- ожидание блокировки записи SQLite: отдельный поток раз в 100 мс
+  выполняет BEGIN IMMEDIATE и замеряет, сколько он ждал
+- статистика фейкового API (вызовы, 400/429) и число ошибок в логе бота
+
+Запуск (из корня репозитория):
+    python loadtest/soak.py --customers 2000 --cashiers 10 --duration 60
+    python loadtest/soak.py --mode push --latency 0.05 --jitter 0.02 --rate-429 0.01
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import re
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "42:soak")
+os.environ.setdefault("ADMIN_ID", "1")
+
+import database  # noqa: E402
+from config import CAFES  # noqa: E402
+from fake_bot_api import FakeBotAPI, BOT_USER  # noqa: E402
+
+
+CUSTOMER_ID_BASE = 20_000_000
+CASHIER_ID_BASE = 10_000_000
+START_POINTS = 100
+
+PRODUCTS = {
+    "🍪 Печенье (30 баллов)": 30,
+    "🧋 Капучино (50 баллов)": 50,
+    "🥐 Круассан (70 баллов)": 70,
+}
+
+CODE_RE = re.compile(r"`(\d+)`")
+
+
+def has(text):
+    """Предикат ожидания: в тексте ответа есть подстрока"""
+    return lambda params: text in (params.get("text") or "")
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Stats:
+    """Задержки ответов по шагам, таймауты и итоги сценариев"""
+
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.timeouts = Counter()
+        self.flows = Counter()
+
+    def record(self, step, seconds):
+        self.latency[step].append(seconds)
+
+    def report(self):
+        lines = [f"{'шаг':<10} {'n':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'таймаут':>8}"]
+        for step in sorted(set(self.latency) | set(self.timeouts)):
+            values = sorted(self.latency[step])
+            cells = [percentile(values, q) * 1000 for q in (0.5, 0.95, 0.99)]
+            cells.append((values[-1] if values else 0) * 1000)
+            lines.append(f"{step:<10} {len(values):>7} " + " ".join(f"{c:>6.0f}мс" for c in cells)
+                         + f" {self.timeouts[step]:>8}")
+        return "\n".join(lines)
+
+
+class LockProbe:
+    """
+    Замеряет ожидание блокировки записи SQLite: раз в interval секунд
+    выполняет BEGIN IMMEDIATE + ROLLBACK в отдельном потоке.
+    """
+
+    def __init__(self, db_name, interval=0.1):
+        self.interval = interval
+        self.waits = []
+        self._conn = sqlite3.connect(db_name, timeout=30, isolation_level=None,
+                                     check_same_thread=False)
+
+    def _probe(self):
+        started = time.perf_counter()
+        self._conn.execute("BEGIN IMMEDIATE")
+        waited = time.perf_counter() - started
+        self._conn.execute("ROLLBACK")
+        return waited
+
+    async def run(self):
+        while True:
+            self.waits.append(await asyncio.to_thread(self._probe))
+            await asyncio.sleep(self.interval)
+
+    def report(self):
+        values = sorted(self.waits)
+        return (f"ожидание блокировки записи SQLite ({len(values)} проб): "
+                f"p50 {percentile(values, 0.5) * 1000:.1f} мс, "
+                f"p99 {percentile(values, 0.99) * 1000:.1f} мс, "
+                f"max {(values[-1] if values else 0) * 1000:.1f} мс")
+
+
+class Cashier:
+    """Кассир: вводит коды клиентов не быстрее anti-flood лимита бота"""
+
+    def __init__(self, user_id, cafe_id, rate):
+        self.id = user_id
+        self.cafe_id = cafe_id
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def pace(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            wait = self._next - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next = loop.time() + self.interval
+
+
+class Soak:
+    """Клиенты и кассиры, которые общаются с ботом через фейковый API"""
+
+    def __init__(self, api, args, cashiers):
+        self.api = api
+        self.args = args
+        self.cashiers = cashiers
+        self.stats = Stats()
+        self.random = random.Random(args.seed)
+        self._callback_ids = itertools.count(1)
+
+    def message(self, user_id, text):
+        return {"message": {
+            "message_id": self.api.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+            "text": text,
+        }}
+
+    def callback(self, user_id, message_id, data):
+        return {"callback_query": {
+            "id": str(next(self._callback_ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+            "chat_instance": "soak",
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "…",
+            },
+        }}
+
+    async def step(self, name, chat_id, update, predicate):
+        """
+        Отправляет апдейт и ждёт ответа бота в чат.
+
+        Returns:
+            dict or None: Параметры ответа или None по таймауту
+        """
+        future = self.api.expect(chat_id, predicate)
+        started = time.perf_counter()
+        self.api.push_update(update)
+        # asyncio.wait, а не wait_for: wait_for в Python < 3.12 может
+        # проглотить отмену задачи, если ответ пришёл одновременно с ней
+        done, _ = await asyncio.wait((future,), timeout=self.args.timeout)
+        if not done:
+            future.cancel()
+            self.stats.timeouts[name] += 1
+            return None
+        self.stats.record(name, time.perf_counter() - started)
+        return future.result()
+
+    async def pause(self):
+        """Пауза между нажатиями клиента"""
+        await asyncio.sleep(self.random.uniform(0.3, 1.0))
+
+    async def redeem(self, cafe_id, text, code, success):
+        cashier = self.random.choice(self.cashiers[cafe_id])
+        await cashier.pace()
+        reply = await self.step("cashier", cashier.id, self.message(cashier.id, text), has(code))
+        return reply is not None and success in reply["text"]
+
+    async def earn(self, user_id, cafe_id):
+        cafe = CAFES[cafe_id]["name"]
+        if not await self.step("menu", user_id, self.message(user_id, "➕ Получить баллы"),
+                               has("Выберите кафе")):
+            return False
+        await self.pause()
+        reply = await self.step("cafe", user_id, self.message(user_id, cafe), has("Подтвердить"))
+        if reply is None:
+            return False
+        await self.pause()
+        reply = await self.step("code", user_id,
+                                self.callback(user_id, reply["message_id"], "confirm_earn"),
+                                has("Ваш код"))
+        if reply is None:
+            return False
+        code = CODE_RE.search(reply["text"]).group(1)
+        await asyncio.sleep(self.random.uniform(1.0, 5.0))
+        return await self.redeem(cafe_id, f"{code} 14", code, "подтверждён")
+
+    async def spend(self, user_id, cafe_id):
+        cafe = CAFES[cafe_id]["name"]
+        product = self.random.choice(list(PRODUCTS))
+        if not await self.step("menu", user_id, self.message(user_id, "💸 Потратить баллы"),
+                               has("Выберите кафе")):
+            return False
+        await self.pause()
+        if not await self.step("cafe", user_id, self.message(user_id, cafe), has("Выберите товар")):
+            return False
+        await self.pause()
+        reply = await self.step("product", user_id, self.message(user_id, product),
+                                has("Подтвердите"))
+        if reply is None:
+            return False
+        await self.pause()
+        reply = await self.step("code", user_id,
+                                self.callback(user_id, reply["message_id"], "confirm_spend"),
+                                has("Ваш код"))
+        if reply is None:
+            return False
+        code = CODE_RE.search(reply["text"]).group(1)
+        await asyncio.sleep(self.random.uniform(1.0, 5.0))
+        return await self.redeem(cafe_id, code, code, "подтверждено")
+
+    async def customer(self, user_id):
+        await asyncio.sleep(self.random.uniform(0, self.args.ramp))
+        await self.step("start", user_id, self.message(user_id, "/start"), has("Добро пожаловать"))
+        points = START_POINTS
+        while True:
+            await asyncio.sleep(self.random.expovariate(1 / self.args.think))
+            cafe_id = self.random.choice(list(CAFES))
+            if points >= max(PRODUCTS.values()) and self.random.random() < self.args.spend_share:
+                flow, ok = "spend", await self.spend(user_id, cafe_id)
+            else:
+                flow, ok = "earn", await self.earn(user_id, cafe_id)
+            self.stats.flows[(flow, ok)] += 1
+            if ok:
+                points += 14 if flow == "earn" else -max(PRODUCTS.values())
+            else:
+                points = 0  # баланс неизвестен — дальше только начисления
+
+
+def seed_db(args):
+    """Создаёт базу с кассирами, клиентами (со стартовым балансом) и режимом кафе"""
+    database.init_db()
+    cashiers = {}
+    with database.connect() as conn:
+        for cafe_id, cafe in CAFES.items():
+            cashiers[cafe_id] = []
+            for i in range(args.cashiers):
+                staff_id = CASHIER_ID_BASE + cafe_id * 1000 + i
+                conn.execute("INSERT INTO staff (staff_id, cafe_id, cafe_name, username, full_name) "
+                             "VALUES (?, ?, ?, '', ?)", (staff_id, cafe_id, cafe["name"], f"K{i}"))
+                cashiers[cafe_id].append(Cashier(staff_id, cafe_id, args.cashier_rate))
+            conn.execute(database.SET_CAFE_MODE_SQL, (cafe_id, args.mode))
+        conn.executemany(
+            "INSERT INTO clients (user_id, username, full_name, points) VALUES (?, '', ?, ?)",
+            ((CUSTOMER_ID_BASE + i, f"U{CUSTOMER_ID_BASE + i}", START_POINTS)
+             for i in range(args.customers)))
+        conn.commit()
+    return cashiers
+
+
+def count_errors(log_path):
+    """
+    Считает ошибки в логе бота
+
+    Returns:
+        tuple: (строк ERROR, из них с 'database is locked')
+    """
+    errors = locked = 0
+    with open(log_path, encoding="utf-8", errors="replace") as log:
+        for line in log:
+            # Лог бота — JSON Lines (LOG_FORMAT=json) или текст
+            if line.startswith("ERROR") or " ERROR " in line or '"level": "ERROR"' in line:
+                errors += 1
+                locked += "database is locked" in line
+    return errors, locked
+
+
+async def run(args):
+    api = FakeBotAPI(args.latency, args.jitter, args.error_rate, args.rate_429, args.retry_after,
+                     seed=args.seed)
+    base = await api.start()
+    cashiers = seed_db(args)
+
+    log_path = os.path.abspath("bot.log")
+    with open(log_path, "w") as log:
+        bot = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "main.py")],
+            env=dict(os.environ, TELEGRAM_API_URL=base), stdout=log, stderr=subprocess.STDOUT,
+        )
+    try:
+        # Бот готов, когда начал получать апдейты
+        while not api.calls["getupdates"]:
+            if bot.poll() is not None:
+                raise RuntimeError(f"Бот не запустился, см. {log_path}")
+            await asyncio.sleep(0.1)
+
+        soak = Soak(api, args, cashiers)
+        probe = LockProbe(database.DB_NAME)
+        tasks = [asyncio.create_task(probe.run())]
+        tasks += [asyncio.create_task(soak.customer(CUSTOMER_ID_BASE + i))
+                  for i in range(args.customers)]
+
+        print(f"Клиентов: {args.customers}, кассиров: {args.cashiers} × {len(CAFES)} кафе, "
+              f"режим {args.mode}, {args.duration:.0f} с...")
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        elapsed = time.perf_counter() - started
+        delivered = api.delivered
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        # SIGINT — штатная остановка aiogram (дописывается очередь записи)
+        bot.send_signal(signal.SIGINT)
+        while bot.poll() is None:
+            await asyncio.sleep(0.1)
+        await api.stop()
+
+    errors, locked = count_errors(log_path)
+    flows = soak.stats.flows
+    print(f"\nАпдейтов обработано: {delivered} ({delivered / elapsed:.0f}/с)")
+    print("Сценариев: " + ", ".join(
+        f"{flow} {flows[(flow, True)]} ок / {flows[(flow, False)]} неудачно" for flow in ("earn", "spend")))
+    print()
+    print(soak.stats.report())
+    print()
+    print(probe.report())
+    print(f"фейковый API: {api.stats()}")
+    print(f"ошибок в логе бота: {errors} (database is locked: {locked})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--cashiers", type=int, default=10, help="кассиров в каждом кафе")
+    parser.add_argument("--duration", type=float, default=60.0, help="секунд нагрузки")
+    parser.add_argument("--ramp", type=float, default=10.0, help="за сколько секунд подключаются клиенты")
+    parser.add_argument("--think", type=float, default=30.0, help="средняя пауза клиента между сценариями")
+    parser.add_argument("--spend-share", type=float, default=0.3, help="доля сценариев списания")
+    parser.add_argument("--mode", choices=("push", "pull"), default="pull", help="режим кафе")
+    parser.add_argument("--cashier-rate", type=float, default=1.9, help="сообщений кассира в секунду")
+    parser.add_argument("--timeout", type=float, default=10.0, help="ожидание ответа бота")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--db-dir", default=None, help="папка для базы (по умолчанию временная)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bonuslink-soak-") as tmp:
+        # База бота — cafe.db в текущей папке
+        os.chdir(args.db_dir or tmp)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
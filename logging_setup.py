@@ -0,0 +1,226 @@
+"""
+Логирование без задержек для обработчиков.
+
+Обработчики только кладут LogRecord в очередь (QueueHandler);
+форматирование и запись в файл/консоль выполняет отдельный поток
+(QueueListener). Сообщение собирается из шаблона и аргументов уже в потоке
+записи, поэтому в обработчиках логируем шаблоном:
+    logger.info("Клиент %s запросил код", user_id)
+а не f-строкой.
+
+Формат — JSON Lines (LOG_FORMAT=json, по умолчанию) или обычный текст:
+    {"ts": "...", "level": "INFO", "logger": "...", "msg": "...", <поля extra>}
+Записи, сделанные во время обработки апдейта, получают поле trace_id (см. tracing.py).
+
+Частые INFO/DEBUG-сообщения прореживаются: одно и то же сообщение
+(логгер + шаблон) пропускается не больше `burst` раз за `window` секунд,
+число пропущенных добавляется полем "sampled_out" к следующему.
+Предупреждения и ошибки не прореживаются никогда.
+
+Если поток записи не успевает и очередь заполнена, новые записи
+отбрасываются (и считаются), а обработчики не ждут.
+
+Уровни логгеров меняются без перезапуска — log_pipeline.set_level()
+(у администратора — команда /loglevel).
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import traceback
+from datetime import datetime, timezone
+
+from config import LOG_LEVEL, LOG_FILE, LOG_FORMAT
+from tracing import current_trace_id
+
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Атрибуты LogRecord, которые не считаются полями extra
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирует запись одной JSON-строкой: время (UTC), уровень, логгер,
+    сообщение, поля из extra и трассировку исключения.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживание частых сообщений уровня INFO и ниже.
+    """
+
+    def __init__(self, burst=20, window=10.0):
+        """
+        Args:
+            burst (int): Сколько одинаковых сообщений пропускать за окно
+            window (float): Длина окна в секундах
+        """
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.dropped = 0
+        self._counters = {}
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or self.burst <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        started, passed, dropped = self._counters.get(key, (now, 0, 0))
+        if now - started >= self.window:
+            started, passed = now, 0
+        if passed >= self.burst:
+            self._counters[key] = (started, passed, dropped + 1)
+            self.dropped += 1
+            return False
+        if dropped:
+            record.sampled_out = dropped
+        self._counters[key] = (started, passed + 1, 0)
+        if len(self._counters) > 10000:
+            # Шаблоны с уникальным текстом (f-строки) не должны копиться бесконечно
+            self._counters.clear()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler без форматирования в потоке обработчика
+    и без ожидания, если очередь заполнена.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Очередь внутри процесса: запись передаётся как есть,
+        # сообщение собирается в потоке записи.
+        # ID трассы известен только здесь — в потоке записи contextvar другой
+        trace_id = current_trace_id()
+        if trace_id is not None:
+            record.trace_id = trace_id
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Подключает очередь логов к корневому логгеру и запускает поток записи.
+    """
+
+    def __init__(self, max_queue=10000, burst=20, window=10.0):
+        """
+        Args:
+            max_queue (int): Сколько записей может ждать потока записи
+            burst (int): См. SamplingFilter
+            window (float): См. SamplingFilter
+        """
+        self.max_queue = max_queue
+        self.sampler = SamplingFilter(burst, window)
+        self._handler = None
+        self._listener = None
+
+    def start(self, level=LOG_LEVEL, path=LOG_FILE, fmt=LOG_FORMAT):
+        """
+        Заменяет обработчики корневого логгера очередью и запускает поток записи
+
+        Args:
+            level (str): Уровень корневого логгера
+            path (str): Файл лога (ротация по 10 МБ); без файла — только stderr
+            fmt (str): "json" или "text"
+        """
+        if self._listener is not None:
+            return
+        formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+        targets = [logging.StreamHandler(sys.stderr)]
+        if path:
+            targets.append(logging.handlers.RotatingFileHandler(
+                path, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8"))
+        for target in targets:
+            target.setFormatter(formatter)
+
+        log_queue = queue.Queue(self.max_queue)
+        self._handler = _QueueHandler(log_queue)
+        self._handler.addFilter(self.sampler)
+        self._listener = logging.handlers.QueueListener(log_queue, *targets, respect_handler_level=True)
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self._handler)
+        root.setLevel(level.upper())
+        self._listener.start()
+
+    def stop(self):
+        """Дописывает оставшиеся в очереди записи и останавливает поток записи"""
+        if self._listener is None:
+            return
+        logging.getLogger().removeHandler(self._handler)
+        self._listener.stop()
+        for target in self._listener.handlers:
+            target.close()
+        self._listener = None
+
+    @property
+    def dropped(self):
+        """Сколько записей отброшено переполненной очередью"""
+        return self._handler.dropped if self._handler else 0
+
+    def set_level(self, level, name=None):
+        """
+        Меняет уровень логгера без перезапуска
+
+        Args:
+            level (str): DEBUG, INFO, WARNING, ERROR или NOTSET (наследовать уровень)
+            name (str): Имя логгера (например, handlers.client_handlers); None — корневой
+
+        Raises:
+            ValueError: Если уровень неизвестен
+        """
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level {level!r}")
+        logging.getLogger(name).setLevel(level)
+
+    def levels(self):
+        """
+        Уровни корневого логгера и логгеров, у которых уровень задан явно
+
+        Returns:
+            dict: {имя логгера: уровень}
+        """
+        result = {"root": logging.getLevelName(logging.getLogger().level)}
+        for name, item in sorted(logging.root.manager.loggerDict.items()):
+            if isinstance(item, logging.Logger) and item.level != logging.NOTSET:
+                result[name] = logging.getLevelName(item.level)
+        return result
+
+
+log_pipeline = LogPipeline()
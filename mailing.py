@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+
+from repository import get_segment_user_ids
+
+
+logger = logging.getLogger(__name__)
+
+# Telegram разрешает около 30 сообщений в секунду в разные чаты
+MAILING_RATE = 25.0
+
+
+class MailingResult:
+    """Итог рассылки"""
+
+    __slots__ = ("sent", "blocked", "failed", "seconds")
+
+    def __init__(self):
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+
+async def send_mailing(bot: Bot, segment, text, rate=MAILING_RATE, batch_size=1000):
+    """
+    Отправляет сообщение всем клиентам сегмента.
+
+    Получатели читаются из client_segments порциями по индексу,
+    сообщения отправляются не быстрее rate в секунду;
+    при TelegramRetryAfter рассылка ждёт указанное время и повторяет отправку.
+
+    Args:
+        bot (Bot): Бот
+        segment (str): Сегмент получателей (ключ segmentation.SEGMENTS)
+        text (str): Текст сообщения (HTML)
+        rate (float): Сообщений в секунду
+        batch_size (int): Сколько получателей читать из базы за раз
+
+    Returns:
+        MailingResult: Сколько отправлено, сколько клиентов заблокировали бота и сколько ошибок
+    """
+    result = MailingResult()
+    started = time.perf_counter()
+    interval = 1.0 / rate
+    last_user_id = 0
+
+    while True:
+        user_ids = get_segment_user_ids(segment, last_user_id, batch_size)
+        if not user_ids:
+            break
+        last_user_id = user_ids[-1]
+
+        for user_id in user_ids:
+            for attempt in range(2):
+                try:
+                    await bot.send_message(user_id, text)
+                    result.sent += 1
+                except TelegramRetryAfter as e:
+                    if attempt == 0:
+                        await asyncio.sleep(e.retry_after)
+                        continue
+                    result.failed += 1
+                except TelegramForbiddenError:
+                    result.blocked += 1
+                except TelegramAPIError as e:
+                    logger.warning("Рассылка: не удалось отправить %s: %r", user_id, e)
+                    result.failed += 1
+                break
+            await asyncio.sleep(interval)
+
+    result.seconds = time.perf_counter() - started
+    logger.info("Рассылка %s: отправлено %d, заблокировали %d, ошибок %d за %.0f с",
+                segment, result.sent, result.blocked, result.failed, result.seconds)
+    return result
@@ -3,7 +3,7 @@
 
 Запускает бота, инициализирует базу данных,
 подключает роутеры (роутеры обработчиков клиента, кассира и админа),
-а также выводит информацию о запуске в консоль.
+а также пишет информацию о запуске в лог (см. logging_setup.py).
 
 Использует:
 - aiogram 3.x
@@ -14,41 +14,187 @@
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
 from handlers.client_handlers import client_router
 from handlers.staff_handlers import staff_router
 from handlers.admin_handlers import admin_router
 
-from config import BOT_TOKEN
+from config import (BOT_TOKEN, TOKEN_SECRET, TELEGRAM_API_URL, CAPTURE_DIR, CAPTURE_KEY,
+                    MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES)
 from database import init_db
+from background import background_tasks
+from write_queue import write_queue
+from known_users import known_users
+from maintenance import maintenance
+from cashier_queue import cashier_queue
+from analytics import analytics
+from middlewares.fast_ack import FastAckMiddleware
+from middlewares.throttling import ThrottlingMiddleware, CodeIssueLimitMiddleware
+from middlewares.text_dispatch import TextIndex, TextDispatchMiddleware
+from middlewares.capture import UpdateCaptureMiddleware
+from middlewares.inflight import InFlightMiddleware
+from middlewares.scheduler import UpdateScheduler
+from keyboards.callbacks import CodeCallback, LEGACY_PREFIXES
+from lifecycle import lifecycle
+from logging_setup import log_pipeline
+from tracing import tracer
+from middlewares.tracing import UpdateTracingMiddleware, HandlerTracingMiddleware, BotApiTracingMiddleware
 
+import argparse
 import asyncio
-from importlib import reload
+import logging
 from config import ADMIN_ID
 
-print(f"CURRENT ADMIN_ID: {ADMIN_ID} (type: {type(ADMIN_ID)})")
 
+logger = logging.getLogger(__name__)
 
-async def main():
+
+# Всплывающие подсказки, которые кассир и клиент видят сразу после нажатия
+CALLBACK_TOASTS = {
+    "k1:p:c:": "⏳ Начисляем баллы...",
+    "k1:s:c:": "⏳ Списываем баллы...",
+    "purchase_confirm:": "⏳ Начисляем баллы...",
+    "spend_confirm:": "⏳ Списываем баллы...",
+    "confirm_earn": "⏳ Генерируем код...",
+    "confirm_spend": "⏳ Генерируем код...",
+}
+
+
+async def on_startup(bot: Bot):
+    """
+    Загружает offset апдейтов, сохранённый предыдущим экземпляром,
+    запускает очередь пакетной записи в базу данных,
+    загружает множество уже зарегистрированных клиентов,
+    восстанавливает очереди кодов кассиров
+    и запускает планировщик обслуживания базы и запись трасс
+    """
+    lifecycle.load_offset()
+    write_queue.start()
+    known_users.load()
+    known_users.start()
+    cashier_queue.load()
+    cashier_queue.start(bot)
+    maintenance.start()
+    tracer.start()
+
+
+async def on_shutdown(bot: Bot):
+    """
+    Дожидается обработчиков полученных апдейтов и фоновых задач
+    (обработчиков callback-ов) перед остановкой бота — с общим дедлайном,
+    применяет последние изменения очередей кассиров,
+    останавливает обслуживание базы и пул процессов отчётов,
+    сохраняет и подтверждает offset апдейтов,
+    затем дописывает в базу всё, что осталось в очереди записи,
+    переносит WAL в основной файл базы и дописывает последние трассы
+    """
+    await lifecycle.drain()
+    await background_tasks.drain(timeout=lifecycle.remaining())
+    await cashier_queue.stop()
+    await maintenance.stop()
+    analytics.shutdown()
+    await known_users.stop()
+    await lifecycle.save_offset(bot)
+    await write_queue.stop()
+    await lifecycle.checkpoint()
+    await tracer.stop()
+
+
+def create_dispatcher():
+    """
+    Создаёт диспетчер со всеми роутерами и middleware.
+
+    Что делает:
+    - Подключает учёт обрабатываемых апдейтов (для остановки без потерь)
+    - Подключает трассировку апдейтов и обработчиков, если задан TRACE_FILE
+    - Подключает запись апдейтов, если задан CAPTURE_DIR
+    - Подключает планировщик: общий лимит обработчиков, очередь каждого
+      пользователя, приоритет кнопок кассиров и отбрасывание под перегрузкой
+    - Подключает anti-flood и лимит выдачи кодов
+    - Подключает middleware быстрого ответа на callback-запросы
+    - Подключает роутеры клиента, кассира и админа
+    - Строит индекс «текст кнопки → обработчик» для сообщений
+
+    Returns:
+        Dispatcher: Готовый диспетчер
+    """
+    dp = Dispatcher()
+    dp.update.outer_middleware(InFlightMiddleware(lifecycle))
+    if tracer.enabled:
+        dp.update.outer_middleware(UpdateTracingMiddleware())
+        dp.message.middleware(HandlerTracingMiddleware())
+        dp.callback_query.middleware(HandlerTracingMiddleware())
+    if CAPTURE_DIR:
+        capture = UpdateCaptureMiddleware(CAPTURE_DIR, CAPTURE_KEY)
+        dp.update.outer_middleware(capture)
+        dp.shutdown.register(capture.stop)
+    dp.update.outer_middleware(UpdateScheduler(
+        MAX_CONCURRENT_UPDATES,
+        priority_prefixes=(f"{CodeCallback.__prefix__}:",) + LEGACY_PREFIXES,
+    ))
+    throttling = ThrottlingMiddleware()
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(FastAckMiddleware(background_tasks, CALLBACK_TOASTS))
+    dp.callback_query.middleware(CodeIssueLimitMiddleware())
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    dp.include_router(client_router)
+    dp.include_router(staff_router)
+    dp.include_router(admin_router)
+
+    # Индекс строится после подключения всех роутеров и подключается последним
+    dp.message.outer_middleware(TextDispatchMiddleware(TextIndex.build(dp)))
+    return dp
+
+
+async def main(handoff=False):
     """
     Основная асинхронная функция запуска бота.
     
     Что делает:
-    - Инициализирует базу данных
+    - Запускает неблокирующее логирование
     - Создаёт диспетчер и подключает роутеры
+    - Захватывает блокировку экземпляра (с handoff — останавливает работающий
+      экземпляр и ждёт, пока он подтвердит offset, см. lifecycle.py)
+    - Инициализирует базу данных (миграции — только под блокировкой,
+      когда старый экземпляр уже не пишет в базу)
     - Запускает polling режим получения обновлений
+      (через TELEGRAM_API_URL, если задан другой адрес Bot API)
+
+    Args:
+        handoff (bool): Перезапуск без простоя: сменить работающий экземпляр
     """
-    init_db()
+    log_pipeline.start()
+    logger.info("ADMIN_ID: %s", ADMIN_ID)
+    if not TOKEN_SECRET:
+        logger.warning("TOKEN_SECRET не задан: QR-коды подписываются ключом из BOT_TOKEN, "
+                       "смена токена бота сделает все выданные QR-коды недействительными")
     default = DefaultBotProperties(parse_mode=ParseMode.HTML)
-    bot = Bot(token=BOT_TOKEN, default=default)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    bot = Bot(token=BOT_TOKEN, default=default, session=session)
+    if tracer.enabled:
+        bot.session.middleware(BotApiTracingMiddleware())
 
-    dp = Dispatcher()
-    dp.include_router(client_router)
-    dp.include_router(staff_router)
-    dp.include_router(admin_router)
-    print("🤖 Бот запущен...")
-    await dp.start_polling(bot)
+    dp = create_dispatcher()
+    try:
+        # Всё, что можно, готово до остановки старого экземпляра — передача занимает меньше
+        await bot.me()
+        await lifecycle.acquire(handoff)
+        init_db()
+        logger.info("🤖 Бот запущен...")
+        # Сверх MAX_PENDING_UPDATES полученных апдейтов опрос ждёт, а апдейты остаются в Telegram
+        await dp.start_polling(bot, tasks_concurrency_limit=MAX_PENDING_UPDATES)
+    finally:
+        await bot.session.close()
+        lifecycle.release()
+        log_pipeline.stop()
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Бот системы лояльности для кафе")
+    parser.add_argument("--handoff", action="store_true",
+                        help="перезапуск без простоя: остановить работающий экземпляр и продолжить за ним")
+    asyncio.run(main(parser.parse_args().handoff))
\ No newline at end of file
@@ -0,0 +1,355 @@
+"""
+Обслуживание базы данных без остановки бота.
+
+Шаги:
+- checkpoint — перенос WAL в основной файл (PASSIVE: не ждёт читателей и писателей)
+- vacuum — возврат свободных страниц частями через PRAGMA incremental_vacuum
+- optimize — обновление статистики планировщика (PRAGMA optimize с analysis_limit)
+- backup — онлайн-копия через backup API SQLite небольшими порциями страниц
+
+Каждый шаг работает на отдельном соединении с коротким busy_timeout:
+если база занята ботом, шаг откладывается, а не ждёт блокировку.
+Транзакция каждого шага ограничена несколькими десятками страниц,
+поэтому очередь записи бота не ждёт дольше нескольких миллисекунд.
+
+В боте checkpoint выполняется периодически, остальные шаги (и пересчёт
+сегментов клиентов, см. segmentation.py) — раз в сутки в «тихие часы»
+(MaintenanceScheduler). Длительность каждого шага пишется в лог
+и доступна администратору командой /maintenance.
+
+Запуск вручную:
+    python maintenance.py [checkpoint|vacuum|optimize|backup|all] [--backup-dir backups]
+    python maintenance.py enable-auto-vacuum   # один раз для старой базы, при остановленном боте
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from database import connect, DB_NAME
+import segmentation
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько миллисекунд шаг обслуживания ждёт блокировку, прежде чем уступить боту
+BUSY_TIMEOUT_MS = 50
+
+# Размер одной порции vacuum/backup (страниц по 4 КБ) и пауза между порциями
+STEP_PAGES = 64
+STEP_SLEEP = 0.005
+
+# Страниц на ANALYZE одного индекса (ограничивает время PRAGMA optimize)
+ANALYSIS_LIMIT = 400
+
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 7
+
+
+class StepReport:
+    """Результат одного шага обслуживания"""
+
+    __slots__ = ("step", "started_at", "seconds", "detail", "ok")
+
+    def __init__(self, step, started_at, seconds, detail, ok=True):
+        self.step = step
+        self.started_at = started_at
+        self.seconds = seconds
+        self.detail = detail
+        self.ok = ok
+
+    def __str__(self):
+        mark = "✅" if self.ok else "⚠️"
+        return f"{mark} {self.step}: {self.seconds * 1000:.0f} мс — {self.detail}"
+
+
+def maintenance_connect():
+    """
+    Соединение для обслуживания: в режиме autocommit и с коротким busy_timeout,
+    чтобы шаг уступал боту, а не держал его в очереди на блокировку
+    """
+    conn = connect()
+    conn.isolation_level = None
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def checkpoint(mode="PASSIVE"):
+    """
+    Переносит страницы из WAL в основной файл базы.
+
+    Args:
+        mode (str): PASSIVE (не ждёт никого) или TRUNCATE (ещё и обрезает WAL,
+                    получится только если в этот момент нет читателей)
+
+    Returns:
+        str: Описание результата для отчёта
+    """
+    with maintenance_connect() as conn:
+        busy, wal_pages, done = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    if wal_pages < 0:
+        return "база не в режиме WAL"
+    return f"{mode}: {done}/{wal_pages} страниц WAL" + (" (база занята)" if busy else "")
+
+
+def incremental_vacuum(step_pages=STEP_PAGES, step_sleep=STEP_SLEEP, max_seconds=30.0):
+    """
+    Возвращает свободные страницы файлу порциями по step_pages.
+
+    Каждая порция — отдельная короткая транзакция; между порциями
+    пауза, чтобы очередь записи бота успевала закоммитить свои пакеты.
+
+    Returns:
+        str: Описание результата для отчёта
+    """
+    with maintenance_connect() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return "auto_vacuum не INCREMENTAL — запустите `maintenance.py enable-auto-vacuum`"
+
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        deadline = time.monotonic() + max_seconds
+        slowest = 0.0
+        free = free_before
+        while free and time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                # execute() в Python освобождает только одну страницу за вызов,
+                # executescript доводит PRAGMA до конца
+                conn.executescript(f"PRAGMA incremental_vacuum({int(step_pages)});")
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                # База занята ботом — пробуем следующую порцию позже
+            slowest = max(slowest, time.perf_counter() - started)
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            time.sleep(step_sleep)
+    return (f"свободных страниц {free_before} → {free}, "
+            f"самая долгая порция {slowest * 1000:.1f} мс")
+
+
+def optimize(analysis_limit=ANALYSIS_LIMIT):
+    """
+    Обновляет статистику планировщика запросов.
+
+    PRAGMA optimize сам решает, каким таблицам нужен ANALYZE,
+    а analysis_limit ограничивает число читаемых страниц на индекс.
+
+    Returns:
+        str: Описание результата для отчёта
+    """
+    with maintenance_connect() as conn:
+        conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+        first_run = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None
+        if first_run:
+            # Статистики ещё нет: PRAGMA optimize её не создаст
+            conn.execute("ANALYZE")
+        else:
+            conn.execute("PRAGMA optimize")
+    return "ANALYZE (первый запуск)" if first_run else "PRAGMA optimize"
+
+
+def backup(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP, step_pages=STEP_PAGES, step_sleep=STEP_SLEEP):
+    """
+    Делает онлайн-копию базы через backup API порциями по step_pages.
+
+    Между порциями блокировка отпускается, и бот продолжает писать.
+    Если бот изменил базу во время копирования, SQLite начинает копирование
+    заново, поэтому копия всегда согласована (и поэтому её лучше делать
+    в тихие часы). Копия пишется во временный файл и переименовывается
+    только после завершения.
+
+    Args:
+        backup_dir (str): Каталог для копий
+        keep (int): Сколько последних копий хранить
+
+    Returns:
+        str: Описание результата для отчёта
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{os.path.splitext(os.path.basename(DB_NAME))[0]}-{datetime.now():%Y%m%d-%H%M%S}.db"
+    path = os.path.join(backup_dir, name)
+    tmp_path = path + ".part"
+
+    steps = restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal steps, restarts, last_remaining
+        steps += 1
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+        last_remaining = remaining
+
+    source = maintenance_connect()
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target, pages=step_pages, progress=progress, sleep=step_sleep)
+    finally:
+        target.close()
+        source.close()
+    os.replace(tmp_path, path)
+
+    removed = _rotate_backups(backup_dir, keep)
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    return (f"{path} ({size_mb:.1f} МБ, {steps} порций, перезапусков: {restarts}, "
+            f"удалено старых: {removed})")
+
+
+def _rotate_backups(backup_dir, keep):
+    prefix = os.path.splitext(os.path.basename(DB_NAME))[0] + "-"
+    backups = sorted(f for f in os.listdir(backup_dir) if f.startswith(prefix) and f.endswith(".db"))
+    old = backups[:-keep] if keep else backups
+    for filename in old:
+        os.remove(os.path.join(backup_dir, filename))
+    return len(old)
+
+
+def enable_auto_vacuum():
+    """
+    Переводит существующую базу в режим auto_vacuum = INCREMENTAL.
+    Требует полного VACUUM — запускать при остановленном боте.
+    """
+    with maintenance_connect() as conn:
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return f"auto_vacuum = {conn.execute('PRAGMA auto_vacuum').fetchone()[0]}"
+
+
+def run_step(step, func, *args):
+    """
+    Выполняет шаг обслуживания и замеряет его длительность.
+
+    Returns:
+        StepReport: Отчёт о шаге (ошибка тоже попадает в отчёт)
+    """
+    started_at = datetime.now()
+    started = time.perf_counter()
+    try:
+        report = StepReport(step, started_at, 0.0, func(*args))
+    except Exception as e:
+        report = StepReport(step, started_at, 0.0, repr(e), ok=False)
+    report.seconds = time.perf_counter() - started
+    log = logger.info if report.ok else logger.error
+    log("Обслуживание базы: %s", report)
+    return report
+
+
+NIGHTLY_STEPS = (
+    ("segments", segmentation.run),
+    ("vacuum", incremental_vacuum),
+    ("optimize", optimize),
+    ("backup", backup),
+    ("checkpoint", lambda: checkpoint("TRUNCATE")),
+)
+
+
+class MaintenanceScheduler:
+    """
+    Планировщик обслуживания базы внутри бота.
+
+    Каждые checkpoint_interval секунд выполняет PASSIVE checkpoint,
+    а в «тихие часы» (quiet_hours — [начало, конец) по местному времени)
+    один раз за сутки — пересчёт RFM-сегментов, vacuum, optimize, backup
+    и TRUNCATE checkpoint.
+    Шаги выполняются в отдельном потоке и не блокируют event loop.
+    """
+
+    def __init__(self, quiet_hours=(3, 5), checkpoint_interval=300.0):
+        self.quiet_hours = quiet_hours
+        self.checkpoint_interval = checkpoint_interval
+        self.reports = {}
+        self._last_nightly = None
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def in_quiet_hours(self, now=None):
+        start, end = self.quiet_hours
+        hour = (now or datetime.now()).hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    async def run(self, step, func, *args):
+        """
+        Выполняет шаг в отдельном потоке (шаги не пересекаются друг с другом)
+
+        Returns:
+            StepReport: Отчёт о шаге
+        """
+        async with self._lock:
+            report = await asyncio.to_thread(run_step, step, func, *args)
+        self.reports[step] = report
+        return report
+
+    async def run_nightly(self):
+        """
+        Выполняет все суточные шаги подряд
+
+        Returns:
+            list[StepReport]: Отчёты о шагах
+        """
+        self._last_nightly = datetime.now().date()
+        return [await self.run(step, func) for step, func in NIGHTLY_STEPS]
+
+    def start(self):
+        """
+        Запускает периодическое обслуживание
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="db-maintenance")
+
+    async def stop(self):
+        """
+        Останавливает периодическое обслуживание
+        (текущий шаг в потоке доработает до конца)
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            now = datetime.now()
+            if self.in_quiet_hours(now) and self._last_nightly != now.date():
+                await self.run_nightly()
+            else:
+                await self.run("checkpoint", checkpoint)
+
+
+maintenance = MaintenanceScheduler()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных бота")
+    parser.add_argument("step", nargs="?", default="all",
+                        choices=("checkpoint", "vacuum", "optimize", "backup", "all",
+                                 "enable-auto-vacuum"))
+    parser.add_argument("--backup-dir", default=BACKUP_DIR)
+    parser.add_argument("--keep", type=int, default=BACKUP_KEEP)
+    args = parser.parse_args()
+
+    steps = {
+        "checkpoint": [("checkpoint", checkpoint)],
+        "vacuum": [("vacuum", incremental_vacuum)],
+        "optimize": [("optimize", optimize)],
+        "backup": [("backup", lambda: backup(args.backup_dir, args.keep))],
+        "enable-auto-vacuum": [("enable-auto-vacuum", enable_auto_vacuum)],
+    }
+    steps["all"] = steps["vacuum"] + steps["optimize"] + steps["backup"] + steps["checkpoint"]
+
+    for step, func in steps[args.step]:
+        print(run_step(step, func))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,193 @@
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from datetime import date
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from config import ADMIN_ID
+from tokens import START_PREFIX
+
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_VERSION = 1
+
+# Объекты с ID и именами пользователей/чатов
+PERSON_KEYS = frozenset(("from", "chat", "user", "sender_chat", "forward_from", "via_bot"))
+NAME_FIELDS = ("username", "first_name", "last_name", "title")
+
+# Даты в записи отсчитываются от этого момента (2020-01-01), а не от настоящего времени
+PSEUDO_EPOCH = 1577836800
+
+# /start r_<токен>: токен кода (tokens.py) содержит настоящий user_id клиента
+_START_TOKEN_RE = re.compile(r"^(/start(?:@\w+)?\s+" + re.escape(START_PREFIX) + r")\S+")
+REDACTED_TOKEN = "redacted"
+
+
+def pseudonym_id(value, key):
+    """
+    Псевдоним Telegram ID: HMAC-SHA256 от ID, 48 бит (знак сохраняется — ID групп отрицательные).
+    Один и тот же ID с одним ключом всегда даёт один и тот же псевдоним.
+
+    Args:
+        value (int): Telegram ID
+        key (bytes): Ключ псевдонимизации
+
+    Returns:
+        int: Псевдоним
+    """
+    digest = hmac.new(key, str(abs(value)).encode(), hashlib.sha256).digest()
+    pseudonym = int.from_bytes(digest[:6], "big") or 1
+    return -pseudonym if value < 0 else pseudonym
+
+
+def pseudonymise(obj, key, date_shift):
+    """
+    Копия апдейта (в формате Bot API) без персональных данных:
+    ID пользователей и чатов заменены псевдонимами, имена — условными,
+    даты сдвинуты так, что запись начинается с PSEUDO_EPOCH.
+    Тексты сообщений и callback_data сохраняются — по ним идёт обработка,
+    кроме токенов кодов в `/start r_<токен>`: они заменяются на REDACTED_TOKEN
+    (при воспроизведении такой токен отклоняется как повреждённый).
+    """
+    if isinstance(obj, list):
+        return [pseudonymise(item, key, date_shift) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+
+    result = {}
+    for name, value in obj.items():
+        if name in PERSON_KEYS and isinstance(value, dict):
+            value = pseudonymise(value, key, date_shift)
+            if isinstance(value.get("id"), int):
+                value["id"] = pseudonym_id(value["id"], key)
+            for field in NAME_FIELDS:
+                if field in value:
+                    value[field] = f"u{abs(value.get('id', 0)) % 1000000}"
+        elif name in ("date", "edit_date") and isinstance(value, int):
+            value = value - date_shift
+        elif name == "text" and isinstance(value, str):
+            value = _START_TOKEN_RE.sub(r"\g<1>" + REDACTED_TOKEN, value)
+        elif name == "chat_instance":
+            value = str(pseudonym_id(int(hashlib.sha256(value.encode()).hexdigest()[:12], 16), key))
+        else:
+            value = pseudonymise(value, key, date_shift)
+        result[name] = value
+    return result
+
+
+class UpdateCaptureMiddleware(BaseMiddleware):
+    """
+    Записывает входящие апдейты для воспроизведения (loadtest/replay.py).
+
+    Подключается outer-middleware на update и только если задан CAPTURE_DIR.
+    Апдейты псевдонимизируются (pseudonymise), копятся в памяти
+    и раз в flush_interval секунд дописываются в файл
+    `{directory}/updates-ГГГГММДД.jsonl.gz` отдельным gzip-блоком —
+    файл только дописывается, и после падения бота в нём остаются
+    все сброшенные блоки.
+
+    Формат — JSON Lines: в начале каждого файла и после каждого запуска
+    заголовок {"capture": 1, "admin": <псевдоним ADMIN_ID>},
+    затем записи {"t": <секунды от запуска>, "update": {...}}.
+    """
+
+    def __init__(self, directory, key=None, flush_interval=5.0, max_buffer=1000):
+        """
+        Args:
+            directory (str): Папка для файлов записи
+            key (str): Ключ псевдонимизации ID (по умолчанию — случайный на каждый запуск)
+            flush_interval (float): Как часто (сек) дописывать накопленное в файл
+            max_buffer (int): Сколько апдейтов накопить, прежде чем дописать досрочно
+        """
+        self.directory = directory
+        self.key = (key or secrets.token_hex(16)).encode()
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.captured = 0
+        self._buffer = []
+        self._started = None
+        self._date_shift = 0
+        self._path = None
+        self._lock = asyncio.Lock()
+        self._flusher = None
+        self._early_flush = None
+
+    async def __call__(self, handler, event: Update, data):
+        try:
+            self.record(event)
+        except Exception as e:
+            # Запись не должна мешать обработке апдейта
+            logger.error("Не удалось записать апдейт %s: %r", event.update_id, e)
+        return await handler(event, data)
+
+    def record(self, update: Update):
+        """Кладёт псевдонимизированный апдейт в буфер записи"""
+        if self._started is None:
+            self.start()
+        payload = pseudonymise(update.model_dump(mode="json", exclude_none=True, by_alias=True),
+                               self.key, self._date_shift)
+        self._buffer.append(json.dumps(
+            {"t": round(time.monotonic() - self._started, 4), "update": payload},
+            ensure_ascii=False,
+        ))
+        self.captured += 1
+        if len(self._buffer) >= self.max_buffer and self._flusher is not None:
+            # Досрочная запись; ссылка на задачу хранится, чтобы её не собрал GC
+            self._early_flush = asyncio.create_task(self.flush())
+
+    def start(self):
+        """Запускает периодическую запись на диск"""
+        if self._started is None:
+            self._started = time.monotonic()
+            self._date_shift = int(time.time()) - PSEUDO_EPOCH
+            self._path = None
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop(), name="update-capture")
+
+    async def stop(self):
+        """Останавливает периодическую запись и дописывает остаток буфера"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def flush(self):
+        """Дописывает накопленные апдейты в файл отдельным gzip-блоком"""
+        async with self._lock:
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"updates-{date.today():%Y%m%d}.jsonl.gz")
+        if path != self._path:
+            # Новый файл (или новый запуск) начинается с заголовка
+            header = {"capture": CAPTURE_VERSION, "admin": pseudonym_id(ADMIN_ID, self.key)}
+            lines.insert(0, json.dumps(header))
+            self._path = path
+        with gzip.open(path, "at", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.error("Не удалось дописать запись апдейтов: %r", e)
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from background import BackgroundTasks
+
+
+logger = logging.getLogger(__name__)
+
+
+class FastAckMiddleware(BaseMiddleware):
+    """
+    Мгновенно отвечает на каждый callback-запрос.
+
+    Ответ (answerCallbackQuery) отправляется сразу, до работы с базой данных,
+    поэтому кнопка у кассира и клиента перестаёт «крутиться» почти мгновенно.
+    Сам обработчик выполняется после ответа как отслеживаемая задача:
+    при остановке бота её можно дождаться через `BackgroundTasks.drain()`.
+
+    Обработчики, за которыми стоит эта middleware, не должны сами вызывать
+    `callback.answer()` — на запрос уже ответили.
+    """
+
+    def __init__(self, tasks: BackgroundTasks, toasts=None):
+        """
+        Args:
+            tasks (BackgroundTasks): Реестр, в котором отслеживаются задачи
+            toasts (dict): Всплывающие подсказки по началу callback_data,
+                           например {"k1:p:c:": "⏳ Начисляем..."}
+        """
+        self.tasks = tasks
+        self.toasts = toasts or {}
+
+    def _toast_for(self, data):
+        if not data:
+            return None
+        for prefix, text in self.toasts.items():
+            if data.startswith(prefix):
+                return text
+        return None
+
+    async def __call__(self, handler, event: CallbackQuery, data):
+        self.tasks.spawn(self._answer(event), name=f"ack:{event.id}")
+        work = self.tasks.spawn(handler(event, data), name=f"callback:{event.id}")
+        # shield: отмена задачи polling-а не должна обрывать транзакцию на середине
+        return await asyncio.shield(work)
+
+    async def _answer(self, event: CallbackQuery):
+        try:
+            await event.answer(self._toast_for(event.data))
+        except Exception as e:
+            logger.warning("Не удалось ответить на callback %s: %r", event.id, e)
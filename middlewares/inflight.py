@@ -0,0 +1,26 @@
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Update
+
+from lifecycle import Lifecycle
+
+
+class InFlightMiddleware(BaseMiddleware):
+    """
+    Учитывает апдейты, которые сейчас обрабатываются (outer-middleware на update),
+    чтобы при остановке бот мог их дождаться и сохранить offset.
+
+    Апдейты, которые уже обработал предыдущий экземпляр бота
+    (ID меньше сохранённого offset), пропускаются.
+    """
+
+    def __init__(self, lifecycle: Lifecycle):
+        self.lifecycle = lifecycle
+
+    async def __call__(self, handler, event: Update, data):
+        if not self.lifecycle.begin(event.update_id):
+            return UNHANDLED
+        try:
+            return await handler(event, data)
+        finally:
+            self.lifecycle.end()
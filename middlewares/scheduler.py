@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_TEXT = "⏳ Бот сейчас перегружен. Попробуйте ещё раз через минуту."
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Планировщик обработки апдейтов (outer-middleware на update).
+
+    - Не больше `max_concurrency` обработчиков выполняются одновременно,
+      остальные апдейты ждут свободного места, не нагружая базу
+    - Апдейты одного пользователя обрабатываются строго по очереди:
+      два быстрых нажатия не гоняются за одни и те же данные FSM.
+      Очередь пользователя удаляется, как только она опустела
+    - Приоритетные апдейты (кнопки кассиров) получают свободное место
+      раньше клиентских и никогда не отбрасываются
+    - Под перегрузкой клиентский апдейт, прождавший дольше `max_wait` секунд,
+      или апдейт сверх `max_waiting` ожидающих (или `max_per_key`
+      у одного пользователя) отбрасывается — время ответа остаётся
+      предсказуемым вместо бесконечной очереди. Нажатие кнопки получает
+      ответ всегда, а о сообщениях пользователю сообщается один раз,
+      пока его очередь не опустеет: ответ на каждое лишнее сообщение
+      только добавил бы исходящих запросов под перегрузкой
+    """
+
+    def __init__(self, max_concurrency=32, max_waiting=1000, max_per_key=5, max_wait=5.0,
+                 priority_prefixes=()):
+        """
+        Args:
+            max_concurrency (int): Сколько обработчиков выполняются одновременно
+            max_waiting (int): Сколько клиентских апдейтов может ждать места
+            max_per_key (int): Сколько апдейтов одного пользователя может ждать своей очереди
+            max_wait (float): Сколько секунд клиентский апдейт может ждать, прежде чем его отбросят
+            priority_prefixes (tuple): Начала callback_data приоритетных кнопок (кассиров)
+        """
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.max_per_key = max_per_key
+        self.max_wait = max_wait
+        self.priority_prefixes = tuple(priority_prefixes)
+
+        self.running = 0
+        self.waiting = 0
+        self._keys = {}
+        self._notified = set()
+        self._slots = (deque(), deque())  # ожидающие места: приоритетные, обычные
+
+        # Статистика
+        self.processed = 0
+        self.shed = 0
+        self.max_wait_ms = 0.0
+
+    async def __call__(self, handler, event: Update, data):
+        arrived = time.monotonic()
+        priority = self._is_priority(event)
+        deadline = None if priority else arrived + self.max_wait
+        user = data.get("event_from_user")
+        key = user.id if user else None
+
+        if key is not None and not await self._acquire_key(key, priority, deadline):
+            return await self._shed(event, key, "очередь пользователя")
+        try:
+            if not await self._acquire_slot(priority, deadline):
+                return await self._shed(event, key, "ожидание места")
+            waited = (time.monotonic() - arrived) * 1000
+            self.max_wait_ms = max(self.max_wait_ms, waited)
+            try:
+                return await handler(event, data)
+            finally:
+                self.processed += 1
+                self._release_slot()
+        finally:
+            if key is not None:
+                self._release_key(key)
+
+    def stats(self):
+        """Выполняющиеся и ожидающие апдейты, отброшенные и наибольшее ожидание (мс)"""
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "keys": len(self._keys),
+            "processed": self.processed,
+            "shed": self.shed,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+    def _is_priority(self, event: Update):
+        callback = event.callback_query
+        return bool(callback and callback.data and callback.data.startswith(self.priority_prefixes))
+
+    # --- Очередь пользователя ---
+
+    async def _acquire_key(self, key, priority, deadline):
+        waiters = self._keys.get(key)
+        if waiters is None:
+            # Пользователь свободен: очередь существует, пока обрабатывается его апдейт
+            self._keys[key] = deque()
+            return True
+        if not priority and len(waiters) >= self.max_per_key:
+            return False
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        return await self._wait(future, deadline, lambda: self._release_key(key))
+
+    def _release_key(self, key):
+        waiters = self._keys[key]
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                # Очередь переходит к следующему апдейту пользователя
+                future.set_result(None)
+                return
+        del self._keys[key]
+        self._notified.discard(key)
+
+    # --- Общий лимит ---
+
+    async def _acquire_slot(self, priority, deadline):
+        # Пока кто-то ждёт, все места заняты: освобождённое место сразу передаётся ожидающему
+        if self.running < self.max_concurrency:
+            self.running += 1
+            return True
+        if not priority and self.waiting >= self.max_waiting:
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._slots[0 if priority else 1].append(future)
+        self.waiting += 1
+        try:
+            return await self._wait(future, deadline, self._release_slot)
+        finally:
+            self.waiting -= 1
+
+    def _release_slot(self):
+        for waiters in self._slots:
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    # Место переходит ожидающему, running не меняется
+                    future.set_result(None)
+                    return
+        self.running -= 1
+
+    @staticmethod
+    async def _wait(future, deadline, release):
+        """
+        Ждёт, пока future получит место, не дольше deadline.
+        Если место пришло одновременно с отменой задачи — возвращает его.
+
+        Returns:
+            bool: Получено ли место
+        """
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            await asyncio.wait((future,), timeout=timeout)
+        except asyncio.CancelledError:
+            if not future.cancel():
+                release()
+            raise
+        # Не дождались: отменённую future пропустит тот, кто освободит место
+        return not future.cancel()
+
+    async def _shed(self, event: Update, key, reason):
+        self.shed += 1
+        logger.info("Перегрузка: апдейт %s отброшен (%s), выполняется %d, ждут %d",
+                    event.update_id, reason, self.running, self.waiting)
+        try:
+            if event.callback_query is not None:
+                # Без ответа кнопка «крутится» у пользователя
+                await event.callback_query.answer(OVERLOAD_TEXT)
+            elif event.message is not None and key is not None and key not in self._notified:
+                self._notified.add(key)
+                await event.message.answer(OVERLOAD_TEXT)
+        except Exception as e:
+            logger.warning("Не удалось ответить на отброшенный апдейт %s: %r", event.update_id, e)
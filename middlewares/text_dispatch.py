@@ -0,0 +1,200 @@
+from inspect import isclass
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import Message
+
+from filters import ExactText
+
+
+ANY_STATE = object()
+_NOT_FOUND = float("inf")
+
+
+class _Barriers:
+    """
+    Позиции обработчиков, которые нельзя положить в индекс
+    (например, «любой текст в состоянии X»).
+    Индекс не должен перепрыгивать через них, иначе поменяется порядок обработки.
+    """
+
+    __slots__ = ("any_pos", "state_pos")
+
+    def __init__(self):
+        self.any_pos = _NOT_FOUND
+        self.state_pos = {}
+
+    def add(self, pos, states):
+        if states is ANY_STATE:
+            self.any_pos = min(self.any_pos, pos)
+        else:
+            for state in states:
+                self.state_pos.setdefault(state, pos)
+
+    def first(self, raw_state):
+        return min(self.any_pos, self.state_pos.get(raw_state, _NOT_FOUND))
+
+
+class TextIndex:
+    """
+    Хеш-таблица «(состояние FSM, точный текст) → обработчик».
+
+    Строится один раз после подключения всех роутеров: обработчики
+    обходятся в том же порядке, в котором их проверяет aiogram.
+    Обработчики с фильтрами ExactText и фильтрами состояния попадают в индекс;
+    остальные запоминаются как «барьеры», и если барьер стоит в цепочке раньше
+    найденного обработчика, поиск честно возвращает None —
+    тогда сообщение обрабатывается обычной цепочкой фильтров.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.barriers = _Barriers()
+        self.prefix_barriers = {}
+        self.size = 0
+
+    @classmethod
+    def build(cls, router):
+        """
+        Строит индекс для сообщений по роутеру и всем его дочерним роутерам.
+
+        Args:
+            router (Router): Корневой роутер (обычно Dispatcher)
+
+        Returns:
+            TextIndex: Готовый индекс
+        """
+        index = cls()
+        for pos, (owner, handler) in enumerate(_iter_handlers(router)):
+            index._add(pos, owner, handler, is_root=owner is router)
+        return index
+
+    def lookup(self, raw_state, text):
+        """
+        Находит обработчик по состоянию FSM и тексту сообщения.
+
+        Returns:
+            tuple or None: (router, handler) или None, если нужно идти обычной цепочкой
+        """
+        exact = self.entries.get((raw_state, text))
+        anywhere = self.entries.get((ANY_STATE, text))
+        if exact is None:
+            candidate = anywhere
+        elif anywhere is None or exact[0] < anywhere[0]:
+            candidate = exact
+        else:
+            candidate = anywhere
+        if candidate is None:
+            return None
+
+        limit = self.barriers.first(raw_state)
+        for prefix, barriers in self.prefix_barriers.items():
+            if text.startswith(prefix):
+                limit = min(limit, barriers.first(raw_state))
+        if candidate[0] >= limit:
+            return None
+        return candidate[1], candidate[2]
+
+    def _add(self, pos, owner, handler, is_root=False):
+        if owner.message._handler.filters or (not is_root and len(owner.message.outer_middleware)):
+            # Фильтры и outer-middleware дочернего роутера срабатывают до его обработчиков,
+            # поэтому такие обработчики обходить через индекс нельзя
+            self.barriers.add(pos, ANY_STATE)
+            return
+
+        texts, states, prefixes, other = None, ANY_STATE, None, False
+        for filter_object in handler.filters or ():
+            callback = filter_object.callback
+            if isinstance(callback, ExactText):
+                texts = callback.texts if texts is None else texts & callback.texts
+            elif isinstance(callback, Command):
+                prefixes = tuple(callback.prefix)
+                other = True
+            else:
+                filter_states = _states_of(callback)
+                if filter_states is None:
+                    other = True
+                elif filter_states is not ANY_STATE:
+                    states = filter_states if states is ANY_STATE else states & filter_states
+
+        if other or texts is None:
+            if prefixes:
+                for prefix in prefixes:
+                    self.prefix_barriers.setdefault(prefix, _Barriers()).add(pos, states)
+            else:
+                self.barriers.add(pos, states)
+            return
+
+        for text in texts:
+            for state in ([ANY_STATE] if states is ANY_STATE else states):
+                if self.entries.setdefault((state, text), (pos, owner, handler))[0] == pos:
+                    self.size += 1
+
+
+def _iter_handlers(router):
+    for handler in router.message.handlers:
+        yield router, handler
+    for sub_router in router.sub_routers:
+        yield from _iter_handlers(sub_router)
+
+
+def _states_of(callback):
+    """
+    Возвращает множество состояний фильтра, ANY_STATE
+    или None, если это не фильтр состояния.
+    """
+    if isinstance(callback, State):
+        return ANY_STATE if callback.state == "*" else frozenset([callback.state])
+    if isinstance(callback, StatesGroup) or (isclass(callback) and issubclass(callback, StatesGroup)):
+        return frozenset(callback.__all_states_names__)
+    if isinstance(callback, StateFilter):
+        states = set()
+        for state in callback.states:
+            if state == "*":
+                return ANY_STATE
+            nested = _states_of(state) if not isinstance(state, str) and state is not None else None
+            if nested is None:
+                states.add(state)
+            elif nested is ANY_STATE:
+                return ANY_STATE
+            else:
+                states |= nested
+        return frozenset(states)
+    return None
+
+
+class TextDispatchMiddleware(BaseMiddleware):
+    """
+    Находит обработчик текстового сообщения одним обращением к словарю.
+
+    Подключается последней outer-middleware для сообщений.
+    Если индекс знает обработчик — вызывает его напрямую
+    (с inner-middleware его роутера, как это делает aiogram),
+    иначе передаёт сообщение обычной цепочке фильтров.
+    """
+
+    def __init__(self, index: TextIndex):
+        self.index = index
+
+    async def __call__(self, handler, event: Message, data):
+        if event.text is None:
+            return await handler(event, data)
+
+        found = self.index.lookup(data.get("raw_state"), event.text)
+        if found is None:
+            return await handler(event, data)
+
+        router, handler_object = found
+        observer = router.message
+        data["handler"] = handler_object
+        data["event_router"] = router
+        wrapped = observer.outer_middleware.wrap_middlewares(
+            observer._resolve_middlewares(),
+            handler_object.call,
+        )
+        try:
+            return await wrapped(event, data)
+        except SkipHandler:
+            return await handler(event, data)
@@ -0,0 +1,140 @@
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, CallbackQuery
+
+
+THROTTLED_TEXT = "⏳ Слишком много нажатий. Подождите пару секунд."
+CODE_LIMIT_TEXT = "⏳ Вы уже получили несколько кодов. Попробуйте немного позже."
+
+
+class TokenBucket:
+    """Ведро токенов одного пользователя"""
+
+    __slots__ = ("tokens", "updated", "notified")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.notified = False
+
+
+class BucketRegistry:
+    """
+    Ведра токенов по пользователям с ограниченным объёмом памяти.
+
+    Хранится не больше `max_size` вёдер; при переполнении вытесняются
+    вёдра пользователей, которые дольше всех ничего не делали.
+    Вытеснять их безопасно: за время простоя ведро успевает наполниться,
+    а полное ведро ничем не отличается от нового.
+    """
+
+    def __init__(self, rate, burst, max_size=10000):
+        """
+        Args:
+            rate (float): Скорость пополнения, токенов в секунду
+            burst (int): Ёмкость ведра (сколько действий можно сделать подряд)
+            max_size (int): Максимальное количество хранимых вёдер
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, now=None):
+        """
+        Пытается забрать один токен из ведра пользователя.
+
+        Args:
+            key (int): Ключ (обычно Telegram ID пользователя)
+            now (float): Текущее время (для тестов), по умолчанию time.monotonic()
+
+        Returns:
+            TokenBucket or None: None, если токен получен;
+                                 ведро пользователя, если лимит исчерпан
+        """
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.notified = False
+            return None
+        return bucket
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничивает частоту апдейтов от одного пользователя (anti-flood).
+
+    Подключается как outer-middleware для сообщений и callback-запросов —
+    до быстрого ответа на callback, чтобы заблокированное нажатие
+    получило подсказку вместо обычного ответа.
+    Заблокированный апдейт не доходит до обработчиков и базы данных;
+    пользователь получает короткий заранее заготовленный ответ
+    один раз за период блокировки.
+    """
+
+    def __init__(self, rate=2.0, burst=8, max_users=10000):
+        self.buckets = BucketRegistry(rate, burst, max_users)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        bucket = self.buckets.take(user.id)
+        if bucket is None:
+            return await handler(event, data)
+
+        if isinstance(event, CallbackQuery):
+            # На callback нужно ответить в любом случае, иначе кнопка будет крутиться
+            await event.answer(THROTTLED_TEXT if not bucket.notified else None)
+        elif isinstance(event, Message) and not bucket.notified:
+            await event.answer(THROTTLED_TEXT)
+        bucket.notified = True
+
+
+class CodeIssueLimitMiddleware(BaseMiddleware):
+    """
+    Ограничивает количество кодов, которые один клиент может получить.
+
+    Подключается как inner-middleware для callback-запросов
+    и срабатывает только для обработчиков с флагом `issues_code`.
+    """
+
+    def __init__(self, rate=5 / 600, burst=5, max_users=10000):
+        """
+        Args:
+            rate (float): Скорость восстановления лимита, кодов в секунду
+                          (по умолчанию 5 кодов за 10 минут)
+            burst (int): Сколько кодов можно получить подряд
+            max_users (int): Максимальное количество хранимых вёдер
+        """
+        self.buckets = BucketRegistry(rate, burst, max_users)
+
+    async def __call__(self, handler, event, data):
+        if not get_flag(data, "issues_code"):
+            return await handler(event, data)
+
+        bucket = self.buckets.take(event.from_user.id)
+        if bucket is None:
+            return await handler(event, data)
+
+        if not bucket.notified and event.message:
+            await event.message.answer(CODE_LIMIT_TEXT)
+        bucket.notified = True
@@ -0,0 +1,53 @@
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Update
+
+from tracing import tracer
+
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """
+    Начинает трассу на каждый входящий апдейт (outer-middleware на update).
+
+    Все span-ы, созданные во время обработки — обработчик, запросы к базе,
+    вызовы Bot API, в том числе из задач, запущенных обработчиком, —
+    попадают в эту трассу.
+    """
+
+    async def __call__(self, handler, event: Update, data):
+        user = data.get("event_from_user")
+        with tracer.trace(f"update {event.event_type}", **{
+            "update.id": event.update_id,
+            "user.id": user.id if user else 0,
+        }) as span:
+            result = await handler(event, data)
+            if result is UNHANDLED:
+                span.set("update.unhandled", True)
+            return result
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """
+    Span вокруг обработчика (inner-middleware: срабатывает, когда обработчик найден)
+    """
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "?") if handler_object else "?"
+        with tracer.span(f"handler {name}"):
+            return await handler(event, data)
+
+
+class BotApiTracingMiddleware(BaseRequestMiddleware):
+    """
+    Span вокруг каждого вызова Bot API (middleware сессии бота)
+    """
+
+    async def __call__(self, make_request, bot, method):
+        api_method = method.__api_method__
+        with tracer.span(f"telegram {api_method}", **{"telegram.method": api_method}) as span:
+            chat_id = getattr(method, "chat_id", None)
+            if chat_id is not None:
+                span.set("telegram.chat_id", chat_id)
+            return await make_request(bot, method)
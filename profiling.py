@@ -0,0 +1,231 @@
+"""
+Профилирование работающего бота по команде администратора, без перезапуска.
+
+- cpu — cProfile потока event loop за окно в N секунд
+  (топ функций по собственному времени + файл .prof для snakeviz/pstats)
+- mem — разница двух снимков tracemalloc в начале и в конце окна
+  (где выросла память, по строкам кода)
+- loop — задержка event loop (насколько позже назначенного просыпается
+  короткий sleep) и задачи asyncio, сгруппированные по корутинам
+
+Одновременно выполняется только одно профилирование: cProfile и tracemalloc
+глобальны на процесс, а их накладные расходы не должны складываться.
+"""
+
+import asyncio
+import cProfile
+import marshal
+import os
+import pstats
+import sysconfig
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import asynccontextmanager
+from html import escape
+
+
+# Ограничения окна профилирования (сек)
+MIN_WINDOW = 1
+MAX_WINDOW = 300
+
+# Глубина стека, которую запоминает tracemalloc для каждого выделения
+TRACEMALLOC_FRAMES = 5
+
+_STDLIB = sysconfig.get_paths()["stdlib"]
+
+
+class ProfilerBusyError(RuntimeError):
+    """Профилирование уже выполняется"""
+
+
+class ProfileResult:
+    """
+    Результат профилирования: текстовая таблица и (необязательно) файл.
+    """
+
+    __slots__ = ("title", "table", "filename", "data")
+
+    def __init__(self, title, table, filename=None, data=None):
+        self.title = title
+        self.table = table
+        self.filename = filename
+        self.data = data
+
+
+class Profiler:
+    """
+    Профилирование процесса бота по запросу.
+    """
+
+    def __init__(self, top=20):
+        """
+        Args:
+            top (int): Сколько строк показывать в таблицах
+        """
+        self.top = top
+        self.running = None
+
+    async def cpu(self, seconds):
+        """
+        Профилирует поток event loop cProfile-ом в течение seconds секунд
+
+        Returns:
+            ProfileResult: Топ функций по собственному времени и файл .prof
+        """
+        async with self._busy("cpu"):
+            profile = cProfile.Profile()
+            started = time.perf_counter()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            elapsed = time.perf_counter() - started
+
+        stats = pstats.Stats(profile)
+        # Ожидание событий в select/epoll — простой loop, а не работа
+        rows = sorted(((key, value) for key, value in stats.stats.items() if not _is_idle(key)),
+                      key=lambda item: item[1][2], reverse=True)
+        lines = [f"{'own ms':>8} {'cum ms':>8} {'calls':>7}  функция"]
+        for (filename, line, name), (_, calls, own, cumulative, _) in rows[:self.top]:
+            where = "" if filename == "~" else f" {_short_path(filename)}:{line}"
+            lines.append(f"{own * 1000:8.1f} {cumulative * 1000:8.1f} {calls:7d}  {name}{where}")
+        busy = sum(row[1][2] for row in rows)
+        title = (f"CPU за {elapsed:.0f} с: занято {busy:.2f} с "
+                 f"({busy / elapsed:.0%} потока event loop)")
+        # Формат файла — как у pstats.Stats.dump_stats
+        data = marshal.dumps(stats.stats)
+        return ProfileResult(title, "\n".join(lines), f"cpu-{time.strftime('%Y%m%d-%H%M%S')}.prof", data)
+
+    async def memory(self, seconds):
+        """
+        Сравнивает снимки tracemalloc в начале и в конце окна
+
+        Returns:
+            ProfileResult: Топ строк кода по приросту памяти
+        """
+        async with self._busy("mem"):
+            started_here = not tracemalloc.is_tracing()
+            if started_here:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            try:
+                before = tracemalloc.take_snapshot()
+                await asyncio.sleep(seconds)
+                after = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                if started_here:
+                    tracemalloc.stop()
+
+        diff = await asyncio.to_thread(_compare_snapshots, before, after)
+        lines = [f"{'Δ KiB':>9} {'Δ блоков':>9} {'KiB':>9}  строка"]
+        for stat in diff[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 1024:+9.1f} {stat.count_diff:+9d} {stat.size / 1024:9.1f}  "
+                         f"{_short_path(frame.filename)}:{frame.lineno}")
+        growth = sum(stat.size_diff for stat in diff)
+        title = (f"Память за {seconds} с: {growth / 1024:+.1f} KiB, "
+                 f"отслеживается {current / 1024 / 1024:.1f} МиБ (пик {peak / 1024 / 1024:.1f} МиБ)")
+        if started_here:
+            title += "\nВыделения до начала окна не отслеживались — смотрите на Δ"
+        return ProfileResult(title, "\n".join(lines))
+
+    async def loop(self, seconds, interval=0.05):
+        """
+        Измеряет задержку event loop и собирает задачи asyncio
+
+        Args:
+            seconds (int): Окно измерения
+            interval (float): Как часто (сек) измерять задержку
+
+        Returns:
+            ProfileResult: Перцентили задержки и топ корутин по числу задач
+        """
+        async with self._busy("loop"):
+            lags = []
+            deadline = time.monotonic() + seconds
+            tasks_max = 0
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                await asyncio.sleep(interval)
+                lags.append(time.monotonic() - started - interval)
+                tasks_max = max(tasks_max, len(asyncio.all_tasks()))
+
+        lags.sort()
+        tasks = asyncio.all_tasks()
+        by_coro = Counter(_task_name(task) for task in tasks)
+        lines = [
+            f"задержка loop ({len(lags)} замеров): "
+            f"p50 {_pick(lags, 0.5) * 1000:.1f} мс, p99 {_pick(lags, 0.99) * 1000:.1f} мс, "
+            f"max {lags[-1] * 1000 if lags else 0:.1f} мс",
+            f"задач сейчас: {len(tasks)}, максимум за окно: {tasks_max}",
+            "",
+            f"{'задач':>6}  корутина",
+        ]
+        lines += [f"{count:6d}  {name}" for name, count in by_coro.most_common(self.top)]
+        return ProfileResult(f"Event loop за {seconds} с", "\n".join(lines))
+
+    @asynccontextmanager
+    async def _busy(self, kind):
+        """Не даёт запустить второе профилирование, пока идёт первое"""
+        if self.running is not None:
+            raise ProfilerBusyError(self.running)
+        self.running = kind
+        try:
+            yield
+        finally:
+            self.running = None
+
+
+def _compare_snapshots(before, after):
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>")]
+    before = before.filter_traces(filters)
+    after = after.filter_traces(filters)
+    return [stat for stat in after.compare_to(before, "lineno") if stat.size_diff]
+
+
+def _is_idle(key):
+    filename, _, name = key
+    return filename == "~" and name.startswith("<method '") and "select." in name
+
+
+def _short_path(filename):
+    """Путь относительно site-packages, стандартной библиотеки или текущей папки"""
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    if filename.startswith(_STDLIB):
+        return filename[len(_STDLIB):].lstrip(os.sep)
+    return os.path.relpath(filename) if os.path.isabs(filename) else filename
+
+
+def _task_name(task):
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or type(coro).__name__
+
+
+def _pick(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def format_result(result, limit=4000):
+    """
+    Текст сообщения с результатом (HTML), обрезанный до лимита Telegram
+
+    Args:
+        result (ProfileResult): Результат профилирования
+        limit (int): Максимальная длина таблицы
+
+    Returns:
+        str: Текст сообщения
+    """
+    table = result.table
+    if len(table) > limit - len(result.title) - 30:
+        table = table[:limit - len(result.title) - 30].rsplit("\n", 1)[0] + "\n…"
+    return f"🔬 {escape(result.title)}\n<pre>{escape(table)}</pre>"
+
+
+profiler = Profiler()
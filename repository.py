@@ -0,0 +1,573 @@
+from database import (connect, ADD_LEDGER_SQL, PENDING_CODE_TTL_MINUTES,
+                      SAVE_PURCHASE_CODE_SQL, SAVE_SPEND_CODE_SQL)
+from write_queue import write_queue
+
+
+# Сколько ID подставлять в один запрос `IN (...)` (SQLite ограничивает число параметров)
+BATCH_CHUNK_SIZE = 500
+
+
+class Record:
+    """
+    Базовый класс компактных записей из базы.
+
+    Поля перечисляются в __slots__ в том же порядке, что и колонки в SELECT,
+    поэтому запись создаётся прямо из строки курсора (см. from_row).
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        """row_factory для sqlite3: превращает строку курсора в запись"""
+        return cls(*row)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Client(Record):
+    """Клиент программы лояльности"""
+
+    __slots__ = ("user_id", "username", "full_name", "points", "total_purchases", "version")
+
+
+class StaffMember(Record):
+    """Кассир кафе"""
+
+    __slots__ = ("staff_id", "cafe_id", "username", "full_name")
+
+
+class CodeUse(Record):
+    """
+    Результат использования кода кассиром.
+
+    already_used — код был использован раньше, баланс не менялся;
+    points и version — баланс клиента после операции
+    (None, если баланс не изменился).
+    """
+
+    __slots__ = ("user_id", "cafe_id", "already_used", "points", "version")
+
+
+class PendingCode(Record):
+    """
+    Невыкупленный код в очереди кассиров.
+
+    kind — CodeKind ("p" — начисление, "s" — списание);
+    amount — стоимость списания (0 для начисления: баллы выбирает кассир);
+    created_at — время выдачи (unix).
+    """
+
+    __slots__ = ("kind", "code_id", "code", "amount", "cafe_id", "user_id",
+                 "client_name", "label", "created_at")
+
+
+CLIENT_COLUMNS = ", ".join(Client.__slots__)
+STAFF_COLUMNS = ", ".join(StaffMember.__slots__)
+
+# Таблицы кодов, которые может отменить кассир
+CODE_TABLES = frozenset(("purchase_codes", "spend_codes"))
+
+
+def _scalar(cursor, row):
+    """row_factory для запросов с одной колонкой"""
+    return row[0]
+
+
+def _fetch_one(row_factory, sql, params=()):
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.row_factory = row_factory
+        cur.execute(sql, params)
+        return cur.fetchone()
+
+
+def _fetch_all(row_factory, sql, params=()):
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.row_factory = row_factory
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+
+def _fetch_in(row_factory, sql, ids):
+    """
+    Выполняет запрос с `IN ({marks})` частями по BATCH_CHUNK_SIZE ID
+    на одном соединении.
+    """
+    ids = list(dict.fromkeys(ids))
+    rows = []
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.row_factory = row_factory
+        for start in range(0, len(ids), BATCH_CHUNK_SIZE):
+            chunk = ids[start:start + BATCH_CHUNK_SIZE]
+            cur.execute(sql.format(marks=", ".join("?" * len(chunk))), chunk)
+            rows.extend(cur.fetchall())
+    return rows
+
+
+def _code_condition(code, code_id, cafe_id):
+    """
+    Условие WHERE для поиска записи кода: по первичному ключу, если он известен,
+    иначе (кнопки старого формата) — по самому коду среди кодов не старше
+    PENDING_CODE_TTL_MINUTES. Код ищется только среди кодов кафе кассира
+    (кроме записей, созданных до появления этих колонок).
+    """
+    if code_id:
+        return "id = ? AND code = ? AND cafe_id = ?", (code_id, code, cafe_id)
+    # Короткие коды повторяются: старая кнопка действует только на свежие коды.
+    # Коды, выданные до появления колонок created_at и cafe_id, хранят в них NULL;
+    # тогда коды не повторялись, и такая запись находится по одному коду
+    since = f"-{PENDING_CODE_TTL_MINUTES} minutes"
+    return ("code = ? AND (cafe_id = ? OR cafe_id IS NULL) "
+            "AND (created_at >= datetime('now', ?) OR created_at IS NULL)"), (code, cafe_id, since)
+
+
+def get_client(user_id):
+    """
+    Получает профиль клиента по Telegram ID
+
+    Args:
+        user_id (int): Telegram ID клиента
+
+    Returns:
+        Client or None: Профиль клиента или None, если клиент не найден
+    """
+    return _fetch_one(Client.from_row,
+                      f"SELECT {CLIENT_COLUMNS} FROM clients WHERE user_id = ?",
+                      (user_id,))
+
+
+def get_clients(user_ids):
+    """
+    Получает профили сразу многих клиентов.
+
+    Args:
+        user_ids (Iterable[int]): Telegram ID клиентов
+
+    Returns:
+        dict[int, Client]: Профили по user_id (ненайденных клиентов в словаре нет)
+    """
+    clients = _fetch_in(Client.from_row,
+                        f"SELECT {CLIENT_COLUMNS} FROM clients WHERE user_id IN ({{marks}})",
+                        user_ids)
+    return {client.user_id: client for client in clients}
+
+
+def is_staff(user_id):
+    """
+    Проверяет, является ли пользователь кассиром
+
+    Args:
+        user_id (int): Telegram ID пользователя
+
+    Returns:
+        bool: True, если пользователь есть в таблице 'staff'
+    """
+    return _fetch_one(_scalar, "SELECT 1 FROM staff WHERE staff_id = ?", (user_id,)) is not None
+
+
+def get_staff(staff_id):
+    """
+    Получает данные кассира по Telegram ID
+
+    Args:
+        staff_id (int): Telegram ID кассира
+
+    Returns:
+        StaffMember or None: Кассир или None, если он не найден
+    """
+    return _fetch_one(StaffMember.from_row,
+                      f"SELECT {STAFF_COLUMNS} FROM staff WHERE staff_id = ?",
+                      (staff_id,))
+
+
+def get_cafe_staff_ids(cafe_id):
+    """
+    Получает Telegram ID кассиров указанного кафе
+
+    Args:
+        cafe_id (int): ID кафе
+
+    Returns:
+        list[int]: ID кассиров (пустой список, если кассиров нет)
+    """
+    return _fetch_all(_scalar, "SELECT staff_id FROM staff WHERE cafe_id = ?", (cafe_id,))
+
+
+def get_staff_by_cafes(cafe_ids):
+    """
+    Получает кассиров сразу нескольких кафе одним проходом.
+
+    Args:
+        cafe_ids (Iterable[int]): ID кафе
+
+    Returns:
+        dict[int, list[StaffMember]]: Кассиры по ID кафе (для кафе без кассиров — пустой список)
+    """
+    cafe_ids = list(cafe_ids)
+    staff_by_cafe = {cafe_id: [] for cafe_id in cafe_ids}
+    staff = _fetch_in(StaffMember.from_row,
+                      f"SELECT {STAFF_COLUMNS} FROM staff WHERE cafe_id IN ({{marks}}) "
+                      f"ORDER BY cafe_id, staff_id",
+                      cafe_ids)
+    for member in staff:
+        staff_by_cafe[member.cafe_id].append(member)
+    return staff_by_cafe
+
+
+def get_staff_page(limit, offset=0):
+    """
+    Получает страницу списка кассиров, сгруппированного по кафе, одним запросом.
+
+    Общее количество кассиров считается оконной функцией в том же запросе.
+
+    Args:
+        limit (int): Размер страницы
+        offset (int): Смещение от начала списка
+
+    Returns:
+        tuple: (list[StaffMember], всего кассиров)
+    """
+    rows = _fetch_all(None, f"""
+        SELECT {STAFF_COLUMNS}, COUNT(*) OVER () AS total
+        FROM staff
+        ORDER BY cafe_id, staff_id
+        LIMIT ? OFFSET ?""", (limit, offset))
+    if not rows:
+        return [], _fetch_one(_scalar, "SELECT COUNT(*) FROM staff")
+    return [StaffMember(*row[:-1]) for row in rows], rows[0][-1]
+
+
+def get_segment_counts():
+    """
+    Получает количество клиентов в каждом сегменте
+
+    Returns:
+        dict[str, int]: Количество клиентов по сегменту (пустой, если сегменты не считались)
+    """
+    return dict(_fetch_all(None, """
+        SELECT segment, COUNT(*) FROM client_segments GROUP BY segment"""))
+
+
+def get_segment_user_ids(segment, after_user_id=0, limit=1000):
+    """
+    Получает очередную порцию получателей рассылки по сегменту
+    (сканированием индекса idx_client_segments_segment, без OFFSET)
+
+    Args:
+        segment (str): Сегмент (ключ segmentation.SEGMENTS)
+        after_user_id (int): Последний ID из предыдущей порции
+        limit (int): Размер порции
+
+    Returns:
+        list[int]: Telegram ID клиентов по возрастанию
+    """
+    return _fetch_all(_scalar, """
+        SELECT user_id FROM client_segments
+        WHERE segment = ? AND user_id > ?
+        ORDER BY user_id
+        LIMIT ?""", (segment, after_user_id, limit))
+
+
+def get_pending_purchase_code(user_id, cafe_id, max_age_minutes=PENDING_CODE_TTL_MINUTES):
+    """
+    Ищет ещё не использованный код начисления клиента в указанном кафе.
+    Поиск идёт по индексу idx_purchase_codes_pending.
+
+    Args:
+        user_id (int): Telegram ID клиента
+        cafe_id (int): ID кафе
+        max_age_minutes (int): Коды старше этого возраста не переиспользуются
+
+    Returns:
+        str or None: Код, если он есть, иначе None
+    """
+    return _fetch_one(_scalar, """
+        SELECT code FROM purchase_codes
+        WHERE user_id = ? AND cafe_id = ? AND used = 0
+          AND created_at >= datetime('now', ?)
+        ORDER BY id DESC LIMIT 1""",
+                      (user_id, cafe_id, f"-{int(max_age_minutes)} minutes"))
+
+
+def get_pending_spend_code(user_id, cafe_id, cost, max_age_minutes=PENDING_CODE_TTL_MINUTES):
+    """
+    Ищет ещё не использованный код списания клиента в указанном кафе
+    на ту же сумму. Поиск идёт по индексу idx_spend_codes_pending.
+
+    Args:
+        user_id (int): Telegram ID клиента
+        cafe_id (int): ID кафе
+        cost (int): Стоимость товара в баллах
+        max_age_minutes (int): Коды старше этого возраста не переиспользуются
+
+    Returns:
+        str or None: Код, если он есть, иначе None
+    """
+    return _fetch_one(_scalar, """
+        SELECT code FROM spend_codes
+        WHERE user_id = ? AND cafe_id = ? AND used = 0 AND cost = ?
+          AND created_at >= datetime('now', ?)
+        ORDER BY id DESC LIMIT 1""",
+                      (user_id, cafe_id, cost, f"-{int(max_age_minutes)} minutes"))
+
+
+def get_pending_codes(max_age_minutes=PENDING_CODE_TTL_MINUTES):
+    """
+    Получает все невыкупленные коды начисления и списания не старше max_age_minutes
+    (для восстановления очередей кассиров после перезапуска)
+
+    Returns:
+        list[PendingCode]: Коды в порядке выдачи
+    """
+    since = f"-{int(max_age_minutes)} minutes"
+    return _fetch_all(PendingCode.from_row, """
+        SELECT 'p', p.id, p.code, 0, p.cafe_id, p.user_id, c.full_name, NULL,
+               CAST(strftime('%s', p.created_at) AS INTEGER) AS created
+        FROM purchase_codes AS p LEFT JOIN clients AS c ON c.user_id = p.user_id
+        WHERE p.used = 0 AND p.created_at >= datetime('now', ?)
+        UNION ALL
+        SELECT 's', s.id, s.code, s.cost, s.cafe_id, s.user_id, c.full_name, NULL,
+               CAST(strftime('%s', s.created_at) AS INTEGER)
+        FROM spend_codes AS s LEFT JOIN clients AS c ON c.user_id = s.user_id
+        WHERE s.used = 0 AND s.created_at >= datetime('now', ?)
+        ORDER BY created""", (since, since))
+
+
+def find_pending_code(cafe_id, code, max_age_minutes=PENDING_CODE_TTL_MINUTES):
+    """
+    Ищет невыкупленный код начисления или списания, который ввёл кассир.
+    Поиск идёт по индексам idx_purchase_codes_code и idx_spend_codes_code.
+
+    Args:
+        cafe_id (int): ID кафе кассира
+        code (str): Код, который показал клиент
+        max_age_minutes (int): Более старые коды не выкупаются
+
+    Returns:
+        PendingCode or None: Код, или None, если такого кода нет
+    """
+    since = f"-{int(max_age_minutes)} minutes"
+    return _fetch_one(PendingCode.from_row, """
+        SELECT 'p', p.id, p.code, 0, p.cafe_id, p.user_id, c.full_name, NULL,
+               CAST(strftime('%s', p.created_at) AS INTEGER) AS created
+        FROM purchase_codes AS p LEFT JOIN clients AS c ON c.user_id = p.user_id
+        WHERE p.code = ? AND p.used = 0 AND p.cafe_id = ? AND p.created_at >= datetime('now', ?)
+        UNION ALL
+        SELECT 's', s.id, s.code, s.cost, s.cafe_id, s.user_id, c.full_name, NULL,
+               CAST(strftime('%s', s.created_at) AS INTEGER)
+        FROM spend_codes AS s LEFT JOIN clients AS c ON c.user_id = s.user_id
+        WHERE s.code = ? AND s.used = 0 AND s.cafe_id = ? AND s.created_at >= datetime('now', ?)
+        ORDER BY created DESC
+        LIMIT 1""", (code, cafe_id, since, code, cafe_id, since))
+
+
+def get_cafe_modes():
+    """
+    Получает режимы работы с кодами кафе, для которых он задан
+
+    Returns:
+        dict[int, str]: Режим (см. cashier_queue.CODE_MODES) по cafe_id
+    """
+    return dict(_fetch_all(None, "SELECT cafe_id, code_mode FROM cafe_settings"))
+
+
+def get_bot_state(key, max_age_minutes=None):
+    """
+    Получает значение служебного состояния бота
+
+    Args:
+        key (str): Ключ (например, "update_offset")
+        max_age_minutes (int): Более старые значения не учитываются (None — любые)
+
+    Returns:
+        str or None: Значение, или None, если оно не сохранялось или устарело
+    """
+    if max_age_minutes is None:
+        return _fetch_one(_scalar, "SELECT value FROM bot_state WHERE key = ?", (key,))
+    return _fetch_one(_scalar, """
+        SELECT value FROM bot_state
+        WHERE key = ? AND updated_at >= datetime('now', ?)""",
+        (key, f"-{int(max_age_minutes)} minutes"))
+
+
+def get_cashier_dashboards():
+    """
+    Получает ID сообщений-очередей кассиров
+
+    Returns:
+        dict[int, int]: message_id по staff_id
+    """
+    return dict(_fetch_all(None, "SELECT staff_id, message_id FROM cashier_dashboards"))
+
+
+async def save_purchase_code(user_id, cafe_id, code):
+    """
+    Сохраняет выданный код начисления (через очередь записи)
+
+    Args:
+        user_id (int): Telegram ID клиента
+        cafe_id (int): ID кафе, где был получен код
+        code (str): Код, который видит клиент
+
+    Returns:
+        int: ID записи кода
+    """
+    return await write_queue.execute(SAVE_PURCHASE_CODE_SQL, (user_id, cafe_id, code))
+
+
+async def save_spend_code(user_id, code, cost, cafe_id):
+    """
+    Сохраняет выданный код списания (через очередь записи)
+
+    Args:
+        user_id (int): Telegram ID клиента
+        code (str): Код, который видит клиент
+        cost (int): Сколько баллов будет списано
+        cafe_id (int): ID кафе, где будет списание
+
+    Returns:
+        int: ID записи кода
+    """
+    return await write_queue.execute(SAVE_SPEND_CODE_SQL, (user_id, code, cost, cafe_id))
+
+
+def use_purchase_code(code, code_id, points, staff_id, cafe_id):
+    """
+    Подтверждает код начисления одной транзакцией:
+    помечает код использованным, начисляет баллы и пишет операцию в журнал.
+
+    Args:
+        code (str): Код, который видит клиент
+        code_id (int): ID записи кода (0, если неизвестен)
+        points (int): Сколько баллов начислить
+        staff_id (int): Telegram ID кассира
+        cafe_id (int): Кафе кассира (коды других кафе не найдутся)
+
+    Returns:
+        CodeUse or None: Результат, или None, если код не найден
+    """
+    condition, params = _code_condition(code, code_id, cafe_id)
+    with connect() as conn:
+        cur = conn.cursor()
+        # Код помечается использованным одним UPDATE: два кассира,
+        # подтверждающие один код одновременно, не начислят баллы дважды
+        cur.execute(f"""
+            UPDATE purchase_codes
+            SET used = 1
+            WHERE id = (SELECT id FROM purchase_codes
+                        WHERE {condition} AND used = 0
+                        ORDER BY id DESC LIMIT 1)
+            RETURNING user_id, cafe_id""", params)
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(f"SELECT user_id, cafe_id FROM purchase_codes WHERE {condition} LIMIT 1",
+                        params)
+            row = cur.fetchone()
+            return None if row is None else CodeUse(*row, True, None, None)
+
+        user_id, cafe_id = row
+        cur.execute("""
+            UPDATE clients
+            SET points = points + ?, total_purchases = total_purchases + 1,
+                version = version + 1
+            WHERE user_id = ?
+            RETURNING points, version""", (points, user_id))
+        balance = cur.fetchone() or (None, None)
+        cur.execute(ADD_LEDGER_SQL, (user_id, cafe_id, staff_id, points, "purchase", code))
+        conn.commit()
+    return CodeUse(user_id, cafe_id, False, *balance)
+
+
+def use_spend_code(code, code_id, cost, staff_id, cafe_id):
+    """
+    Подтверждает код списания одной транзакцией.
+
+    Код помечается использованным, только если он ещё не использован;
+    баллы списываются условным UPDATE (баланс не уходит в минус),
+    и только тогда операция пишется в журнал. Если баллов не хватило,
+    транзакция откатывается и код остаётся неиспользованным.
+
+    Args:
+        code (str): Код, который видит клиент
+        code_id (int): ID записи кода (0, если неизвестен)
+        cost (int): Сколько баллов списать (должно совпасть со стоимостью кода)
+        staff_id (int): Telegram ID кассира
+        cafe_id (int): Кафе кассира (коды других кафе не найдутся)
+
+    Returns:
+        CodeUse or None: Результат (points=None — баллов не хватило),
+                         или None, если код не найден или уже использован
+    """
+    condition, params = _code_condition(code, code_id, cafe_id)
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            UPDATE spend_codes
+            SET used = 1
+            WHERE id = (SELECT id FROM spend_codes
+                        WHERE {condition} AND cost = ? AND used = 0
+                        ORDER BY id DESC LIMIT 1)
+            RETURNING user_id, cafe_id""", (*params, cost))
+        row = cur.fetchone()
+        if row is None:
+            return None
+
+        user_id, cafe_id = row
+        cur.execute("""
+            UPDATE clients SET points = points - ?, version = version + 1
+            WHERE user_id = ? AND points >= ?
+            RETURNING points, version""", (cost, user_id, cost))
+        balance = cur.fetchone()
+        if balance is None:
+            # Баллов не хватило: код остаётся неиспользованным
+            conn.rollback()
+            return CodeUse(user_id, cafe_id, False, None, None)
+        cur.execute(ADD_LEDGER_SQL, (user_id, cafe_id, staff_id, -cost, "spend", code))
+        conn.commit()
+    return CodeUse(user_id, cafe_id, False, *balance)
+
+
+def cancel_code(table, code, code_id, cafe_id):
+    """
+    Отменяет ещё не использованный код (помечает его использованным).
+
+    Args:
+        table (str): Таблица кода (см. CODE_TABLES)
+        code (str): Код, который видит клиент
+        code_id (int): ID записи кода (0, если неизвестен)
+        cafe_id (int): Кафе кассира (коды других кафе не найдутся)
+
+    Returns:
+        int or None: Telegram ID клиента, если код был отменён, иначе None
+    """
+    if table not in CODE_TABLES:
+        raise ValueError(f"Unknown code table {table!r}")
+    condition, params = _code_condition(code, code_id, cafe_id)
+    with connect() as conn:
+        cur = conn.cursor()
+        cur.row_factory = _scalar
+        # Отменяется одна запись — самая свежая выдача этого кода
+        cur.execute(f"""
+            UPDATE {table}
+            SET used = 1
+            WHERE id = (SELECT id FROM {table}
+                        WHERE {condition} AND used = 0
+                        ORDER BY id DESC LIMIT 1)
+            RETURNING user_id""", params)
+        user_id = cur.fetchone()
+        conn.commit()
+    return user_id
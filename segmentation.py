@@ -0,0 +1,201 @@
+"""
+RFM-сегментация клиентов.
+
+История визитов (начислений) и списаний из журнала агрегируется по клиентам
+и читается из базы порциями в колоночные массивы (array): давность последнего
+визита (Recency), число визитов (Frequency) и сумма начисленных баллов (Monetary).
+Оценки 1–5 считаются по квинтилям сразу для всей базы,
+а принадлежность к сегменту сохраняется в таблицу client_segments
+с индексом по сегменту — рассылка выбирает получателей сканированием индекса.
+
+NumPy в зависимостях бота нет, поэтому колонки — стандартный array.array.
+
+Запуск вручную:
+    python segmentation.py
+"""
+
+import logging
+import time
+from array import array
+from bisect import bisect_right
+
+from database import connect
+
+
+logger = logging.getLogger(__name__)
+
+# Сегменты в порядке проверки правил: название для админа
+SEGMENTS = {
+    "champions": "🏆 Лучшие клиенты",
+    "loyal": "💛 Постоянные",
+    "at_risk": "⚠️ Уходящие ценные",
+    "new": "🌱 Новые",
+    "lapsed": "💤 Давно не были",
+    "regular": "🙂 Обычные",
+    "no_visits": "👻 Без покупок",
+}
+
+# Агрегаты по каждому клиенту (клиенты без операций тоже попадают в выборку)
+HISTORY_SQL = """
+    SELECT c.user_id,
+           COALESCE(CAST(strftime('%s', MAX(l.created_at)) AS INTEGER), 0),
+           COUNT(l.id),
+           COALESCE(SUM(CASE WHEN l.reason = 'purchase' THEN l.delta END), 0)
+    FROM clients AS c
+    LEFT JOIN ledger AS l
+      ON l.user_id = c.user_id AND l.reason IN ('purchase', 'spend')
+    GROUP BY c.user_id"""
+
+SAVE_SEGMENT_SQL = """
+    INSERT INTO client_segments (user_id, segment, recency, frequency, monetary)
+    VALUES (?, ?, ?, ?, ?)"""
+
+
+class History:
+    """Колонки истории клиентов (одинаковой длины)"""
+
+    __slots__ = ("user_ids", "last_visit", "visits", "earned")
+
+    def __init__(self):
+        self.user_ids = array("q")
+        self.last_visit = array("q")
+        self.visits = array("q")
+        self.earned = array("q")
+
+    def __len__(self):
+        return len(self.user_ids)
+
+
+def load_history(conn, batch_size=5000):
+    """
+    Читает агрегированную историю клиентов порциями в колонки.
+
+    Args:
+        conn (sqlite3.Connection): Соединение с базой
+        batch_size (int): Сколько строк читать из курсора за раз
+
+    Returns:
+        History: Колонки user_id, время последнего визита, визиты, начисленные баллы
+    """
+    history = History()
+    cur = conn.execute(HISTORY_SQL)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        user_ids, last_visit, visits, earned = zip(*rows)
+        history.user_ids.extend(user_ids)
+        history.last_visit.extend(last_visit)
+        history.visits.extend(visits)
+        history.earned.extend(earned)
+    return history
+
+
+def quintile_scores(values, mask, reverse=False):
+    """
+    Оценки 1–5 по квинтилям для всей колонки сразу.
+
+    Границы квинтилей берутся по отсортированным значениям
+    только тех клиентов, у которых mask = 1; остальным ставится 0.
+
+    Args:
+        values (array): Колонка значений
+        mask (array): 1 — клиент участвует в оценке, 0 — нет
+        reverse (bool): Меньшее значение лучше (для давности визита)
+
+    Returns:
+        array: Оценки ('b')
+    """
+    ranked = sorted(v for v, m in zip(values, mask) if m)
+    scores = array("b", bytes(len(values)))
+    if not ranked:
+        return scores
+    cuts = [ranked[len(ranked) * q // 5] for q in range(1, 5)]
+    for i, (value, m) in enumerate(zip(values, mask)):
+        if m:
+            score = bisect_right(cuts, value) + 1
+            scores[i] = 6 - score if reverse else score
+    return scores
+
+
+def classify(r, f, m):
+    """
+    Сегмент по оценкам R, F, M (0 — у клиента не было визитов)
+
+    Returns:
+        str: Ключ сегмента из SEGMENTS
+    """
+    if not f:
+        return "no_visits"
+    if r >= 4 and f >= 4 and m >= 4:
+        return "champions"
+    if f >= 4:
+        return "loyal"
+    if r <= 2 and (f >= 3 or m >= 3):
+        return "at_risk"
+    if r >= 4 and f <= 1:
+        return "new"
+    if r <= 2:
+        return "lapsed"
+    return "regular"
+
+
+def compute_segments(history, now=None):
+    """
+    Считает RFM-оценки и сегмент для каждого клиента.
+
+    Args:
+        history (History): Колонки истории
+        now (int): Текущее время (unix), по умолчанию — сейчас
+
+    Returns:
+        list[tuple]: Строки (user_id, segment, recency, frequency, monetary)
+    """
+    now = int(now if now is not None else time.time())
+    visited = array("b", (1 if v else 0 for v in history.visits))
+    days_since = array("q", ((now - ts) // 86400 for ts in history.last_visit))
+
+    recency = quintile_scores(days_since, visited, reverse=True)
+    frequency = quintile_scores(history.visits, visited)
+    monetary = quintile_scores(history.earned, visited)
+
+    return [
+        (user_id, classify(r, f, m), r, f, m)
+        for user_id, r, f, m in zip(history.user_ids, recency, frequency, monetary)
+    ]
+
+
+def run():
+    """
+    Пересчитывает сегменты всех клиентов и сохраняет их в client_segments
+    одной транзакцией (старые данные заменяются целиком).
+
+    Функция блокирующая — из обработчиков её нужно вызывать
+    через asyncio.to_thread.
+
+    Returns:
+        str: Описание результата (количество клиентов по сегментам и время)
+    """
+    started = time.perf_counter()
+    with connect() as conn:
+        history = load_history(conn)
+        loaded = time.perf_counter()
+        rows = compute_segments(history)
+        computed = time.perf_counter()
+        conn.execute("DELETE FROM client_segments")
+        conn.executemany(SAVE_SEGMENT_SQL, rows)
+        conn.commit()
+    saved = time.perf_counter()
+
+    counts = {}
+    for row in rows:
+        counts[row[1]] = counts.get(row[1], 0) + 1
+    summary = ", ".join(f"{segment}={counts[segment]}" for segment in SEGMENTS if segment in counts)
+    logger.info("Сегменты пересчитаны: %s", summary)
+    return (f"{len(rows)} клиентов ({summary}); чтение {(loaded - started) * 1000:.0f} мс, "
+            f"расчёт {(computed - loaded) * 1000:.0f} мс, "
+            f"запись {(saved - computed) * 1000:.0f} мс")
+
+
+if __name__ == "__main__":
+    print(run())
@@ -0,0 +1,134 @@
+"""
+Подписанные токены кодов для QR-кодов и ссылок t.me/<бот>?start=r_<токен>.
+
+Токен содержит всё, что нужно кассиру: тип кода, клиента, кафе, сумму,
+сам код, ID записи кода, время выдачи и срок действия — и подписан HMAC-SHA256.
+Кассир сканирует QR-код (или открывает ссылку), бот проверяет подпись
+и срок в памяти, без поиска в базе, а база используется только
+для атомарной отметки кода использованным по первичному ключу.
+
+Поэтому QR-код и цифровой код одной выдачи взаимоисключающие:
+выкупить можно только что-то одно.
+
+QR-картинки рисуются библиотекой qrcode (pip install qrcode[pil]),
+без неё клиент получает только ссылку.
+"""
+
+import base64
+import hashlib
+import hmac
+import io
+import struct
+import time
+
+from aiogram import Bot
+from aiogram.utils.deep_linking import create_start_link
+
+from config import BOT_TOKEN, TOKEN_SECRET
+from database import PENDING_CODE_TTL_MINUTES
+from repository import PendingCode
+
+try:
+    import qrcode
+except ImportError:  # QR-коды необязательны
+    qrcode = None
+
+
+# Префикс параметра /start для токенов кодов
+START_PREFIX = "r_"
+
+TOKEN_VERSION = 2
+
+# Версия, тип кода, user_id, кафе, сумма, длина кода, код, ID записи кода,
+# время выдачи (unix), срок действия (мин)
+_PAYLOAD = struct.Struct(">BcqHIBIIIH")
+
+# Длина подписи: 80 бит, чтобы вся ссылка уложилась в 64 символа параметра /start
+TAG_SIZE = 10
+
+_KEY = hashlib.sha256(b"bonuslink-redeem-token:" + (TOKEN_SECRET or BOT_TOKEN).encode()).digest()
+
+
+class TokenError(ValueError):
+    """Токен повреждён, подделан или просрочен"""
+
+
+def _sign(payload):
+    return hmac.new(_KEY, payload, hashlib.sha256).digest()[:TAG_SIZE]
+
+
+def issue(item, ttl_minutes=PENDING_CODE_TTL_MINUTES):
+    """
+    Создаёт подписанный токен для выданного кода.
+
+    Args:
+        item (PendingCode): Выданный код (см. repository.PendingCode)
+        ttl_minutes (int): Сколько минут токен действителен
+
+    Returns:
+        str: Токен (base64url, 55 символов)
+    """
+    payload = _PAYLOAD.pack(TOKEN_VERSION, item.kind.encode(), item.user_id, item.cafe_id or 0,
+                            item.amount, len(item.code), int(item.code), item.code_id,
+                            int(time.time()), ttl_minutes)
+    return base64.urlsafe_b64encode(payload + _sign(payload)).rstrip(b"=").decode()
+
+
+def verify(token, now=None):
+    """
+    Проверяет подпись и срок действия токена.
+
+    Args:
+        token (str): Токен
+        now (float): Текущее время (unix), по умолчанию — сейчас
+
+    Returns:
+        PendingCode: Код из токена (created_at — время выдачи)
+
+    Raises:
+        TokenError: Если токен повреждён, подделан или просрочен
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        raise TokenError("Токен повреждён") from None
+    if len(raw) != _PAYLOAD.size + TAG_SIZE:
+        raise TokenError("Токен повреждён")
+
+    payload, tag = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    if not hmac.compare_digest(tag, _sign(payload)):
+        raise TokenError("Неверная подпись")
+
+    version, kind, user_id, cafe_id, amount, code_len, code, code_id, created_at, ttl_minutes = \
+        _PAYLOAD.unpack(payload)
+    if version != TOKEN_VERSION:
+        raise TokenError("Неизвестная версия токена")
+    if created_at + ttl_minutes * 60 < (now if now is not None else time.time()):
+        raise TokenError("Срок действия кода истёк")
+
+    return PendingCode(kind.decode(), code_id, str(code).zfill(code_len), amount, cafe_id,
+                       user_id, None, None, created_at)
+
+
+async def create_link(bot: Bot, token):
+    """
+    Ссылка t.me/<бот>?start=r_<токен> — её открывает кассир
+
+    Returns:
+        str: Ссылка
+    """
+    return await create_start_link(bot, START_PREFIX + token)
+
+
+def render_qr(link):
+    """
+    Рисует QR-код ссылки.
+
+    Returns:
+        bytes or None: PNG-картинка или None, если библиотека qrcode не установлена
+    """
+    if qrcode is None:
+        return None
+    buffer = io.BytesIO()
+    qrcode.make(link, box_size=8, border=2).save(buffer, format="PNG")
+    return buffer.getvalue()
@@ -0,0 +1,346 @@
+"""
+Трассировка обработки апдейтов: из чего складывается время ответа.
+
+Каждый входящий апдейт получает trace_id (хранится в contextvar и
+наследуется задачами, созданными во время обработки). Внутри трассы
+пишутся вложенные span-ы:
+- update — вся обработка апдейта (middlewares/tracing.py)
+- handler — обработчик aiogram
+- db — каждый запрос к SQLite (database.connect) и ожидание очереди записи
+- telegram — каждый вызов Bot API
+
+Вне трассы (фоновые задачи, скрипты) span-ы не создаются и почти ничего не стоят.
+
+Завершённые трассы дописываются в файл TRACE_FILE в формате OTLP JSON
+(как у OpenTelemetry File Exporter: одна строка — один ExportTraceServiceRequest)
+с ротацией по размеру; такой файл можно загрузить в любой OTLP-совместимый инструмент.
+
+Самые медленные трассы:
+    python tracing.py traces.jsonl --top 10
+"""
+
+import argparse
+import asyncio
+import contextvars
+import glob
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+
+from config import TRACE_FILE, TRACE_SAMPLE
+
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "bonuslink-bot"
+
+# Коды статуса span-а в OTLP
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    """
+    Отрезок работы внутри трассы: имя, время начала и конца, атрибуты, статус.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "status", "error", "_token")
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _ids.getrandbits(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.error = None
+        self._token = None
+
+    def set(self, key, value):
+        """Добавляет атрибут span-у"""
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.status = STATUS_ERROR
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current.reset(self._token)
+        tracer.finish(self)
+        return False
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class _NoSpan:
+    """Заглушка вне трассы: with-блок ничего не записывает"""
+
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+# Отдельный генератор: ID трасс не должны сдвигать глобальный random (генерацию кодов)
+_ids = random.Random()
+
+
+class Tracer:
+    """
+    Создаёт span-ы и дописывает завершённые трассы в файл.
+    """
+
+    def __init__(self, path=TRACE_FILE, sample=TRACE_SAMPLE, flush_interval=2.0,
+                 max_bytes=20 * 1024 * 1024, backup_count=3):
+        """
+        Args:
+            path (str): Файл трасс (None — трассировка выключена)
+            sample (float): Доля апдейтов, для которых пишется трасса (0..1)
+            flush_interval (float): Как часто (сек) дописывать span-ы в файл
+            max_bytes (int): Размер файла, после которого он ротируется
+            backup_count (int): Сколько старых файлов хранить (traces.jsonl.1, .2, ...)
+        """
+        self.path = path
+        self.sample = sample
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.exported = 0
+        self._buffer = []
+        self._flusher = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def trace(self, name, **attributes):
+        """
+        Начинает новую трассу (корневой span) — на каждый входящий апдейт.
+        Часть апдейтов (1 - sample) не трассируется.
+        """
+        if not self.enabled or (self.sample < 1 and _ids.random() >= self.sample):
+            return _NO_SPAN
+        return Span(name, _ids.getrandbits(128), None, attributes)
+
+    def span(self, name, **attributes):
+        """
+        Вложенный span текущей трассы; вне трассы — заглушка
+        """
+        parent = _current.get()
+        if parent is None:
+            return _NO_SPAN
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+
+    def finish(self, span):
+        self._buffer.append(span)
+
+    def start(self):
+        """Запускает периодическую запись трасс в файл"""
+        if self.enabled and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop(), name="trace-export")
+
+    async def stop(self):
+        """Останавливает периодическую запись и дописывает оставшиеся span-ы"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        spans, self._buffer = self._buffer, []
+        await asyncio.to_thread(self._write, spans)
+
+    def _write(self, spans):
+        line = json.dumps(to_otlp(spans), ensure_ascii=False)
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+        self.exported += len(spans)
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.error("Не удалось записать трассы: %r", e)
+
+
+def current_trace_id():
+    """
+    ID текущей трассы (32 hex-символа) или None вне трассы
+    """
+    span = _current.get()
+    return f"{span.trace_id:032x}" if span is not None else None
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        # В OTLP JSON 64-битные целые передаются строкой
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp(spans):
+    """
+    Span-ы в формате OTLP JSON (ExportTraceServiceRequest)
+
+    Args:
+        spans (list[Span]): Завершённые span-ы
+
+    Returns:
+        dict: Запрос экспорта
+    """
+    items = []
+    for span in spans:
+        attributes = dict(span.attributes)
+        if "db.statement" in attributes:
+            attributes["db.statement"] = " ".join(str(attributes["db.statement"]).split())[:300]
+        item = {
+            "traceId": f"{span.trace_id:032x}",
+            "spanId": f"{span.span_id:016x}",
+            "name": span.name,
+            "kind": 3 if span.name.startswith(("db", "telegram")) else 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [_attribute(key, value) for key, value in attributes.items()],
+            "status": {"code": span.status},
+        }
+        if span.parent_id is not None:
+            item["parentSpanId"] = f"{span.parent_id:016x}"
+        if span.error:
+            item["status"]["message"] = span.error
+        items.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": items}],
+    }]}
+
+
+tracer = Tracer()
+
+
+# --- Сводка по файлу трасс ---
+
+def read_spans(path):
+    """
+    Читает span-ы из файла трасс и его ротированных копий
+
+    Returns:
+        dict: {traceId: [span (dict OTLP)]}
+    """
+    traces = defaultdict(list)
+    for name in sorted(glob.glob(f"{glob.escape(path)}*")):
+        with open(name, encoding="utf-8") as file:
+            for line in file:
+                request = json.loads(line)
+                for resource in request.get("resourceSpans", []):
+                    for scope in resource.get("scopeSpans", []):
+                        for span in scope.get("spans", []):
+                            traces[span["traceId"]].append(span)
+    return traces
+
+
+def _ms(span):
+    return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+
+
+def _attributes(span):
+    return {item["key"]: next(iter(item["value"].values())) for item in span.get("attributes", [])}
+
+
+def summarize(traces, top=10):
+    """
+    Текстовая сводка: самые медленные трассы с разбивкой времени
+    по обработчику, базе и Telegram
+
+    Args:
+        traces (dict): Результат read_spans
+        top (int): Сколько трасс показать
+
+    Returns:
+        str: Сводка
+    """
+    roots = []
+    for spans in traces.values():
+        root = next((span for span in spans if "parentSpanId" not in span), None)
+        if root is not None:
+            roots.append((_ms(root), root, spans))
+    roots.sort(key=lambda item: item[0], reverse=True)
+
+    lines = [f"Трасс: {len(roots)}, span-ов: {sum(len(spans) for spans in traces.values())}"]
+    for total, root, spans in roots[:top]:
+        attrs = _attributes(root)
+        handler = next((span["name"] for span in spans if span["name"].startswith("handler")), "-")
+        by_kind = defaultdict(float)
+        for span in spans:
+            kind = span["name"].split(" ", 1)[0]
+            if kind in ("db", "telegram"):
+                by_kind[kind] += _ms(span)
+        lines.append(
+            f"\n{total:8.1f} мс  {root['traceId']}  {root['name']}  {handler}  "
+            f"user={attrs.get('user.id', '-')}  "
+            f"db={by_kind['db']:.1f} мс  telegram={by_kind['telegram']:.1f} мс"
+        )
+        start = int(root["startTimeUnixNano"])
+        for span in sorted(spans, key=lambda s: int(s["startTimeUnixNano"]))[:30]:
+            if span is root:
+                continue
+            offset = (int(span["startTimeUnixNano"]) - start) / 1e6
+            attrs = _attributes(span)
+            detail = attrs.get("db.statement") or (f"chat {attrs['telegram.chat_id']}"
+                                                   if "telegram.chat_id" in attrs else "")
+            error = " ❌" if span.get("status", {}).get("code") == STATUS_ERROR else ""
+            lines.append(f"    +{offset:7.1f} {_ms(span):7.1f} мс  {span['name']}  {detail[:80]}{error}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Самые медленные трассы обработки апдейтов")
+    parser.add_argument("path", nargs="?", default=TRACE_FILE or "traces.jsonl", help="файл трасс")
+    parser.add_argument("--top", type=int, default=10, help="сколько трасс показать")
+    args = parser.parse_args()
+    print(summarize(read_spans(args.path), args.top))
+
+
+if __name__ == "__main__":
+    main()
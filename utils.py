@@ -1,5 +1,4 @@
-import random
-from database import get_staff_by_id, code_exists_in_db
+from repository import is_staff
 from config import ADMIN_ID
 
 
@@ -23,24 +22,5 @@ def get_user_role(user_id: int):
     if int(user_id) == int(ADMIN_ID):
         return "admin"
     
-    staff = get_staff_by_id(user_id)
-    
-    return "staff" if staff else "client"
-
-
-def generate_purchase_code(length=3):
-    """
-    Генерирует уникальный числовой код, который может использоваться:
-    - Для подтверждения покупки (начисления баллов)
-    - Для подтверждения списания баллов
-    
-    Args:
-        length (int): Длина кода (по умолчанию 3 символа)
+    return "staff" if is_staff(user_id) else "client"
 
-    Returns:
-        str: Уникальный код, которого ещё нет в базе данных
-    """
-    while True:
-        code = ''.join(random.choice('0123456789') for _ in range(length))
-        if not code_exists_in_db(code):
-            return code
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import connect
+from tracing import tracer
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Write:
+    __slots__ = ("sql", "params", "many", "future")
+
+    def __init__(self, sql, params, many, future):
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.future = future
+
+
+class WriteQueue:
+    """
+    Очередь записи в SQLite с групповым коммитом.
+
+    Записи, пришедшие в течение короткого окна (`max_delay` секунд)
+    или набравшие `max_batch` штук, выполняются в одной транзакции —
+    один fsync на пакет вместо одного на строку.
+    Каждая запись выполняется в собственном SAVEPOINT, поэтому ошибка
+    одной строки не откатывает остальные строки пакета.
+
+    Вызывающий код получает результат только после коммита своего пакета.
+    Все записи выполняются в одном отдельном потоке с одним соединением.
+    """
+
+    def __init__(self, max_delay=0.005, max_batch=200):
+        """
+        Args:
+            max_delay (float): Окно накопления пакета в секундах
+            max_batch (int): Максимальное количество записей в пакете
+        """
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._queue = None
+        self._worker = None
+        self._executor = None
+        self._conn = None
+
+        # Статистика
+        self.batches = 0
+        self.rows = 0
+        self.last_batch_size = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.total_commit_ms = 0.0
+
+    def start(self):
+        """
+        Запускает фоновый обработчик очереди (если он ещё не запущен)
+        """
+        if self._worker is not None and not self._worker.done():
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._worker = asyncio.create_task(self._run(), name="write-queue")
+
+    async def stop(self):
+        """
+        Дописывает всё, что осталось в очереди, и останавливает обработчик
+        """
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=True)
+        logger.info("Очередь записи остановлена: %s", self.stats())
+
+    async def execute(self, sql, params=()):
+        """
+        Ставит запрос в очередь и ждёт коммита пакета, в который он попал.
+
+        Args:
+            sql (str): SQL-запрос на запись
+            params (tuple): Параметры запроса
+
+        Returns:
+            int: lastrowid выполненного запроса
+        """
+        return await self._submit(sql, params, False)
+
+    async def executemany(self, sql, seq_of_params):
+        """
+        Ставит в очередь запрос, выполняемый для набора параметров (executemany).
+
+        Args:
+            sql (str): SQL-запрос на запись
+            seq_of_params (list[tuple]): Наборы параметров
+
+        Returns:
+            int: Количество изменённых строк
+        """
+        return await self._submit(sql, list(seq_of_params), True)
+
+    def stats(self):
+        """
+        Возвращает статистику очереди: количество пакетов и строк,
+        размер последнего пакета и задержку коммита (мс).
+        """
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": round(self.rows / self.batches, 2) if self.batches else 0,
+            "last_commit_ms": round(self.last_commit_ms, 2),
+            "avg_commit_ms": round(self.total_commit_ms / self.batches, 2) if self.batches else 0,
+            "max_commit_ms": round(self.max_commit_ms, 2),
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
+
+    async def _submit(self, sql, params, many):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        # Время ожидания пакета и коммита — span текущей трассы
+        with tracer.span("db write_queue", **{"db.system": "sqlite", "db.statement": sql}):
+            await self._queue.put(_Write(sql, params, many, future))
+            return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results, commit_ms = await loop.run_in_executor(self._executor, self._commit, batch)
+            except Exception as e:
+                logger.error("Ошибка коммита пакета из %d записей: %r", len(batch), e)
+                results = [e] * len(batch)
+                commit_ms = 0.0
+            else:
+                self._record(len(batch), commit_ms)
+
+            for item, result in zip(batch, results):
+                self._queue.task_done()
+                if item.future.done():
+                    continue
+                if isinstance(result, Exception):
+                    item.future.set_exception(result)
+                else:
+                    item.future.set_result(result)
+
+    def _record(self, size, commit_ms):
+        self.batches += 1
+        self.rows += size
+        self.last_batch_size = size
+        self.last_commit_ms = commit_ms
+        self.total_commit_ms += commit_ms
+        self.max_commit_ms = max(self.max_commit_ms, commit_ms)
+        logger.debug("Пакет записи: %d строк, коммит %.2f мс", size, commit_ms)
+
+    def _commit(self, batch):
+        """
+        Выполняет пакет в одной транзакции (в потоке записи)
+        """
+        if self._conn is None:
+            self._conn = connect()
+            self._conn.isolation_level = None
+
+        started = time.perf_counter()
+        cur = self._conn.cursor()
+        results = []
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for item in batch:
+                cur.execute("SAVEPOINT write_item")
+                try:
+                    if item.many:
+                        cur.executemany(item.sql, item.params)
+                        results.append(cur.rowcount)
+                    else:
+                        cur.execute(item.sql, item.params)
+                        results.append(cur.lastrowid)
+                    cur.execute("RELEASE write_item")
+                except Exception as e:
+                    cur.execute("ROLLBACK TO write_item")
+                    cur.execute("RELEASE write_item")
+                    results.append(e)
+            cur.execute("COMMIT")
+        except Exception:
+            if self._conn.in_transaction:
+                cur.execute("ROLLBACK")
+            raise
+        return results, (time.perf_counter() - started) * 1000
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+write_queue = WriteQueue()